@@ -5,31 +5,46 @@ Atualização MENSAL automática dos dados CNPJ (Receita Federal — SERPRO+).
 A Receita publica uma pasta nova AAAA-MM/ todo mês (snapshot completo).
 Este script:
   1. Detecta a pasta mais recente no repositório SERPRO+
-  2. Se houver mês novo (ou --force): baixa os 37 .zip, extrai
-  3. Dropa índices secundários + materialized view (recarga fica rápida)
-  4. Recarrega tudo via COPY (run_import_fast.py — truncate + reload)
-  5. Reconstrói índices + materialized view
-  6. Verifica (verify_import.py)
-  7. Marca o mês importado em public.etl_import_state
+  2. Se houver mês novo (ou --force): PIPELINE download → carga. Os 37 .zip
+     são baixados em ordem de dependência (auxiliares → Empresas → demais)
+     para uma fila limitada; os loaders consomem cada zip assim que ele
+     termina de baixar e fazem COPY direto do zip (sem extrair) nas tabelas
+     de STAGING (empresas_new, ...). Rede e carga se sobrepõem.
+  3. Índices + materialized view + rollup de contagens + tabela do
+     autocomplete construídos nas _new
+  4. SWAP atômico _new → produção numa única transação (só depois que TODOS
+     os arquivos carregaram: qualquer falha antes disso deixa a produção
+     intocada — ela segue servindo durante toda a recarga)
+  5. Verifica (verify_import.py)
+  6. Marca o mês importado em public.etl_import_state
+  7. Invalida o cache (nova geração) e aquece cache + buffers do Postgres
+     com os CNPJs/buscas mais pedidos (warmup_cache.py)
 
 Idempotente: se o banco já está no mês mais recente, não faz nada.
 
 Uso:
   DATABASE_URL=postgresql://... python atualizar_mensal.py
-  DATABASE_URL=... python atualizar_mensal.py --force   # reimporta mesmo sem mês novo
+  DATABASE_URL=... python atualizar_mensal.py --force       # reimporta mesmo sem mês novo
+  DATABASE_URL=... python atualizar_mensal.py --sequential  # modo antigo: baixa tudo, dropa
+                                                            # índices e recarrega a produção
+  DATABASE_URL=... python atualizar_mensal.py --extract     # (implica --sequential) extrai p/ disco
+  DATABASE_URL=... python atualizar_mensal.py --no-warmup   # não roda o aquecimento no fim
 """
 import os
 import sys
 import zipfile
 import logging
 import argparse
+import queue
+import threading
 import subprocess
 from pathlib import Path
 
 import psycopg2
 
 sys.path.append(str(Path(__file__).parent))
-from src.etl.downloader_serpro import SerproDownloader, CasaDosDadosDownloader
+from src.etl.downloader_serpro import SerproDownloader, CasaDosDadosDownloader, load_order
+import run_import_fast
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 log = logging.getLogger("atualizar")
@@ -38,6 +53,14 @@ BASE = Path(__file__).parent
 DOWNLOADS = BASE / "downloads"
 PY = sys.executable
 
+STAGING_SUFFIX = "_new"
+CORE_TABLES = ["empresas", "estabelecimentos", "socios", "simples_nacional"]
+MATVIEW = "vw_estabelecimentos_completos"
+ROLLUP = "search_facet_counts"
+AUTOCOMPLETE = "autocomplete_nomes"
+# zips baixados e ainda não carregados (limita o disco ocupado à frente da carga)
+PIPELINE_QUEUE = int(os.getenv("PIPELINE_QUEUE", "4"))
+
 DROP_INDEXES_SQL = """
 DO $$
 DECLARE r record;
@@ -75,6 +98,7 @@ def last_imported_month(conn) -> str:
     conn.commit()
     cur.execute("SELECT month FROM public.etl_import_state WHERE id = 1")
     r = cur.fetchone()
+    conn.commit()  # não deixa a conexão "idle in transaction"
     return r[0] if r else None
 
 
@@ -89,6 +113,7 @@ def mark_month(conn, month: str):
 
 
 def extract_all(zip_paths):
+    """Só com --extract: o padrão é o loader ler direto dos zips (metade do disco)."""
     for zp in zip_paths:
         zp = Path(zp)
         if zipfile.is_zipfile(zp):
@@ -97,6 +122,119 @@ def extract_all(zip_paths):
             log.info("  extraído: %s", zp.name)
 
 
+def bounded(iterable, maxsize):
+    """Consome `iterable` numa thread produtora, com no máximo `maxsize` itens
+    prontos à espera do consumidor (fila cheia => o produtor, i.e. o download,
+    pausa). Exceção do produtor é relançada no consumidor."""
+    q = queue.Queue(maxsize=maxsize)
+    end = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                q.put(item)
+            q.put(end)
+        except BaseException as e:
+            q.put(e)
+
+    # daemon: se a carga abortar, o download pendurado na fila não segura o processo
+    threading.Thread(target=produce, name="download", daemon=True).start()
+    while True:
+        item = q.get()
+        if item is end:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def _unsuffixed(name: str, suffix: str) -> str:
+    """empresas_new_pkey -> empresas_pkey; idx_estab_uf_new -> idx_estab_uf."""
+    return name[:-len(suffix)] if name.endswith(suffix) else name.replace(suffix, "", 1)
+
+
+def swap_staging(conn, suffix: str = STAGING_SUFFIX):
+    """Promove as tabelas {t}{suffix}, a MV, o rollup e o autocomplete (sufixados) a produção numa ÚNICA
+    transação: DROP das antigas e RENAME das novas (tabelas, constraints, índices,
+    sequence do SERIAL). Ou o mês novo entra inteiro, ou nada muda."""
+    new_rels = [t + suffix for t in CORE_TABLES] + [MATVIEW + suffix, ROLLUP + suffix, AUTOCOMPLETE + suffix]
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT r.relname, c.conname FROM pg_constraint c JOIN pg_class r ON r.oid = c.conrelid
+        WHERE r.relnamespace = 'public'::regnamespace AND r.relname = ANY(%s)
+          AND c.contype IN ('p', 'u', 'f')
+    """, (new_rels,))
+    constraints = cur.fetchall()
+    cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND tablename = ANY(%s)",
+                (new_rels,))
+    # índices de PK/UNIQUE são renomeados junto com a constraint
+    indexes = [r[0] for r in cur.fetchall() if r[0] not in {c for _, c in constraints}]
+    cur.execute("SELECT relname FROM pg_class WHERE relkind = 'S' "
+                "AND relnamespace = 'public'::regnamespace AND relname = ANY(%s)",
+                ([f"{t}{suffix}_id_seq" for t in CORE_TABLES],))
+    sequences = [r[0] for r in cur.fetchall()]
+
+    try:
+        cur.execute("SET LOCAL lock_timeout = '60s'")
+        cur.execute(f"DROP MATERIALIZED VIEW IF EXISTS {MATVIEW} CASCADE")
+        cur.execute(f"DROP TABLE IF EXISTS {', '.join(CORE_TABLES + [ROLLUP, AUTOCOMPLETE])} CASCADE")
+        for t in CORE_TABLES:
+            cur.execute(f"ALTER TABLE {t}{suffix} RENAME TO {t}")
+        cur.execute(f"ALTER MATERIALIZED VIEW {MATVIEW}{suffix} RENAME TO {MATVIEW}")
+        cur.execute(f"ALTER TABLE {ROLLUP}{suffix} RENAME TO {ROLLUP}")
+        cur.execute(f"ALTER TABLE {AUTOCOMPLETE}{suffix} RENAME TO {AUTOCOMPLETE}")
+        for table, con in constraints:
+            cur.execute(f"ALTER TABLE {_unsuffixed(table, suffix)} "
+                        f"RENAME CONSTRAINT {con} TO {_unsuffixed(con, suffix)}")
+        for idx in indexes:
+            cur.execute(f"ALTER INDEX {idx} RENAME TO {_unsuffixed(idx, suffix)}")
+        for seq in sequences:
+            cur.execute(f"ALTER SEQUENCE {seq} RENAME TO {_unsuffixed(seq, suffix)}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    log.info("🔁 Swap concluído: %s promovidas (%d constraints, %d índices renomeados)",
+             ", ".join(new_rels), len(constraints), len(indexes))
+
+
+def release_zip(zp):
+    """Zip já commitado no staging: apaga na hora, para a fila do pipeline
+    limitar também o disco (não só o download adiantado)."""
+    zp = Path(zp)
+    try:
+        size = zp.stat().st_size
+        zp.unlink()
+        log.info("  🧹 %s carregado e removido (%.1f GB liberados)", zp.name, size / 1e9)
+    except OSError as e:
+        log.warning("  não removeu %s: %s", zp.name, e)
+
+
+def pipelined_load(url: str, zips, jobs: int, on_loaded=None):
+    """Carrega os zips de `zips` (iterável, possivelmente ainda baixando) nas
+    tabelas de staging. A produção não é tocada aqui. `on_loaded(zip)` roda
+    quando todos os membros do zip foram commitados (ver release_zip)."""
+    # preparo e fechamento em conexões próprias: nenhuma fica parada durante a carga
+    conn = psycopg2.connect(url, connect_timeout=30)
+    try:
+        run_import_fast.tune_session(conn)
+        run_import_fast.prepare_load(conn, CORE_TABLES, STAGING_SUFFIX)
+    finally:
+        conn.close()
+    totals = run_import_fast.load_stream(url, zips, CORE_TABLES, STAGING_SUFFIX, jobs,
+                                         on_loaded=on_loaded)
+    for t in CORE_TABLES:
+        log.info("=== %s%s: %s linhas ===", t, STAGING_SUFFIX, f"{totals.get(t, 0):,}")
+    conn = psycopg2.connect(url, connect_timeout=30)
+    try:
+        run_import_fast.tune_session(conn)
+        run_import_fast.finish_load(conn, CORE_TABLES, STAGING_SUFFIX)
+    finally:
+        conn.close()
+
+
 def run(cmd):
     log.info("→ %s", " ".join(cmd))
     subprocess.run(cmd, check=True, cwd=str(BASE), env={**os.environ})
@@ -140,10 +278,23 @@ def main():
     p.add_argument("--force", action="store_true", help="reimporta mesmo sem mês novo")
     p.add_argument("--skip-download", action="store_true", help="usa os arquivos já baixados")
     p.add_argument("--keep-files", action="store_true", help="NÃO apagar os CSVs/zips após importar")
+    p.add_argument("--extract", action="store_true",
+                   help="extrai os zips para disco antes da carga (implica --sequential)")
+    p.add_argument("--sequential", action="store_true",
+                   help="modo antigo: baixa tudo, dropa índices e recarrega a produção no lugar")
+    p.add_argument("--jobs", type=int, default=int(os.getenv("IMPORT_JOBS", "2")),
+                   help="arquivos carregados em paralelo no pipeline (padrão: IMPORT_JOBS ou 2)")
+    p.add_argument("--no-warmup", action="store_true",
+                   help="não aquece cache/buffers após a carga (warmup_cache.py)")
     args = p.parse_args()
 
+    # Conexões curtas: o pipeline leva horas, e uma conexão parada esse tempo
+    # todo cai por timeout de servidor/pooler antes do swap
     conn = get_conn()
-    last = last_imported_month(conn)
+    try:
+        last = last_imported_month(conn)
+    finally:
+        conn.close()
 
     d = make_downloader()
     latest = d.get_latest_folder()
@@ -153,38 +304,77 @@ def main():
         log.info("✅ Banco já está atualizado (%s). Nada a fazer.", latest)
         return
 
-    if not args.skip_download:
-        log.info("⬇️  Baixando pasta %s...", latest)
-        res = d.download_latest()
-        log.info("Extraindo %d arquivos...", len(res["files"]))
-        extract_all(res["files"])
-        if not args.keep_files:
-            cleanup(["*.zip"])  # zips não são mais necessários após extrair
+    if args.sequential or args.extract:
+        if not args.skip_download:
+            log.info("⬇️  Baixando pasta %s...", latest)
+            res = d.download_latest()
+            if args.extract:
+                log.info("Extraindo %d arquivos...", len(res["files"]))
+                extract_all(res["files"])
+                if not args.keep_files:
+                    cleanup(["*.zip"])  # zips não são mais necessários após extrair
+
+        log.info("🧹 Dropando índices + materialized view para recarga rápida...")
+        conn = get_conn()
+        try:
+            cur = conn.cursor(); cur.execute(DROP_INDEXES_SQL); conn.commit()
+        finally:
+            conn.close()
+
+        run([PY, "run_import_fast.py"])               # truncate + reload (todos os tipos)
+        run([PY, "setup_database.py", "--stage", "indexes"])
+        run([PY, "setup_database.py", "--stage", "matview"])
+        run([PY, "setup_database.py", "--stage", "rollup"])
+        run([PY, "setup_database.py", "--stage", "autocomplete"])
+    else:
+        if args.skip_download:
+            zips = sorted(DOWNLOADS.glob("*.zip"), key=lambda f: load_order(f.name))
+        else:
+            log.info("⬇️  Pipeline: baixando %s e carregando cada zip ao terminar "
+                     "(fila de %d, %d jobs)...", latest, PIPELINE_QUEUE, args.jobs)
+            zips = bounded(d.iter_latest(), PIPELINE_QUEUE)
+        # tudo em staging: falha em qualquer arquivo => produção intocada
+        # zips núcleo saem do disco assim que commitados (auxiliares ficam até o cleanup)
+        pipelined_load(os.environ["DATABASE_URL"], zips, args.jobs,
+                       on_loaded=None if args.keep_files else release_zip)
+        run([PY, "setup_database.py", "--stage", "indexes", "--suffix", STAGING_SUFFIX])
+        run([PY, "setup_database.py", "--stage", "matview", "--suffix", STAGING_SUFFIX])
+        run([PY, "setup_database.py", "--stage", "rollup", "--suffix", STAGING_SUFFIX])
+        run([PY, "setup_database.py", "--stage", "autocomplete", "--suffix", STAGING_SUFFIX])
+        conn = get_conn()
+        try:
+            swap_staging(conn)
+        finally:
+            conn.close()
 
-    log.info("🧹 Dropando índices + materialized view para recarga rápida...")
-    cur = conn.cursor(); cur.execute(DROP_INDEXES_SQL); conn.commit()
-
-    run([PY, "run_import_fast.py"])               # truncate + reload (todos os tipos)
-    run([PY, "setup_database.py", "--stage", "indexes"])
-    run([PY, "setup_database.py", "--stage", "matview"])
     run([PY, "verify_import.py"])
 
     if not args.keep_files:
-        log.info("Liberando disco (CSVs já importados)...")
+        log.info("Liberando disco (zips/CSVs já importados)...")
         cleanup(RFB_PATTERNS)
 
-    # CACHE-02: invalida o Redis para não servir dado stale após a recarga
+    # CACHE-02: invalida o Redis para não servir dado stale após a recarga.
+    # Um INCR da geração: todas as chaves (cnpj:*, search:*, sf:stale:*, ...)
+    # vivem em g{geração}:* e as da geração antiga expiram pelo TTL.
     try:
         from src.api.cache_redis import cache as redis_cache
-        total = 0
-        for pat in ("cnpj_api:*", "cnpj:*", "socios:*", "cnaes:*", "municipios:*", "search:*"):
-            total += redis_cache.delete_pattern(pat)
-        log.info("Cache Redis invalidado (%s chaves)", total)
+        generation = redis_cache.bump_generation()
+        log.info("Cache Redis invalidado (geração %s)", generation)
     except Exception as e:
         log.warning("Não invalidou o cache Redis: %s", str(e)[:80])
 
-    mark_month(conn, latest)
-    conn.close()
+    conn = get_conn()
+    try:
+        mark_month(conn, latest)
+    finally:
+        conn.close()
+
+    # WARMUP: falha no aquecimento não invalida a carga (só a 1a hora fica mais lenta)
+    if not args.no_warmup:
+        try:
+            run([PY, "warmup_cache.py"])
+        except subprocess.CalledProcessError as e:
+            log.warning("Warm-up falhou (código %s); a API aquece sob demanda", e.returncode)
     log.info("✅ Atualização do mês %s concluída, verificada, cache invalidado e disco limpo.", latest)
 
 
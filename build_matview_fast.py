@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 """Cria a materialized view vw_estabelecimentos_completos (rota quente) de forma
 robusta: keepalive + retry contra quedas do proxy, work_mem alto e paralelismo no
-JOIN (24 vCPU). Depois constroi os indices da MV em paralelo (UNIQUE + GIN trigram).
+JOIN (24 vCPU). Depois constroi os indices da MV em paralelo (UNIQUE + GIN trigram
++ GIN full-text + GIN do array de CNAEs secundarios), o rollup de contagens da busca (search_facet_counts;
+SKIP_ROLLUP=1 pula) e a tabela do autocomplete (autocomplete_nomes;
+SKIP_AUTOCOMPLETE=1 pula).
 Idempotente: DROP no inicio permite re-rodar."""
 import os
 import sys
 import time
 import logging
+from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import psycopg2
@@ -17,6 +21,8 @@ log = logging.getLogger("mv")
 URL = os.getenv("DATABASE_URL")
 KAL = dict(keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=5)
 WMEM = os.getenv("WORK_MEM", "2GB")
+ROLLUP_SQL = Path(__file__).parent / "src" / "database" / "setup" / "04_search_rollup.sql"
+AUTOCOMPLETE_SQL = Path(__file__).parent / "src" / "database" / "setup" / "05_autocomplete.sql"
 
 MV_SQL = """
 DO $$ BEGIN
@@ -26,16 +32,20 @@ DO $$ BEGIN
     DROP VIEW vw_estabelecimentos_completos CASCADE;
   END IF;
 END $$;
+CREATE EXTENSION IF NOT EXISTS unaccent;
 CREATE MATERIALIZED VIEW vw_estabelecimentos_completos AS
 SELECT
     e.cnpj_completo, e.identificador_matriz_filial, emp.razao_social, e.nome_fantasia,
     e.situacao_cadastral, e.data_situacao_cadastral,
     msc.descricao AS motivo_situacao_cadastral_desc, e.data_inicio_atividade,
     e.cnae_fiscal_principal, e.cnae_fiscal_secundaria, cnae.descricao AS cnae_principal_desc,
+    regexp_split_to_array(nullif(btrim(e.cnae_fiscal_secundaria), ''), '\\s*,\\s*') AS cnaes_secundarios,
     e.tipo_logradouro, e.logradouro, e.numero, e.complemento, e.bairro, e.cep, e.uf,
-    mun.descricao AS municipio_desc, e.ddd_1, e.telefone_1, e.correio_eletronico,
+    e.municipio, mun.descricao AS municipio_desc, e.ddd_1, e.telefone_1, e.correio_eletronico,
     emp.natureza_juridica, nj.descricao AS natureza_juridica_desc, emp.porte_empresa,
-    emp.capital_social, emp.ente_federativo_responsavel, sn.opcao_simples, sn.opcao_mei
+    emp.capital_social, emp.ente_federativo_responsavel, sn.opcao_simples, sn.opcao_mei,
+    setweight(to_tsvector('simple', unaccent(coalesce(emp.razao_social, ''))), 'A') ||
+    setweight(to_tsvector('simple', unaccent(coalesce(e.nome_fantasia, ''))), 'B') AS nome_busca
 FROM estabelecimentos e
 INNER JOIN empresas emp ON e.cnpj_basico = emp.cnpj_basico
 LEFT JOIN motivos_situacao_cadastral msc ON e.motivo_situacao_cadastral = msc.codigo
@@ -51,9 +61,16 @@ MV_INDEXES = [
     ("idx_mv_estab_razao_trgm", "CREATE INDEX idx_mv_estab_razao_trgm ON vw_estabelecimentos_completos USING gin (razao_social gin_trgm_ops)"),
     ("idx_mv_estab_fantasia_trgm", "CREATE INDEX idx_mv_estab_fantasia_trgm ON vw_estabelecimentos_completos USING gin (nome_fantasia gin_trgm_ops)"),
     ("idx_mv_estab_municipio_desc_trgm", "CREATE INDEX idx_mv_estab_municipio_desc_trgm ON vw_estabelecimentos_completos USING gin (municipio_desc gin_trgm_ops)"),
+    # Busca textual por relevancia (q): tsvector sem acentos
+    ("idx_mv_estab_nome_busca", "CREATE INDEX idx_mv_estab_nome_busca ON vw_estabelecimentos_completos USING gin (nome_busca)"),
     ("idx_mv_estab_uf", "CREATE INDEX idx_mv_estab_uf ON vw_estabelecimentos_completos (uf)"),
     ("idx_mv_estab_situacao", "CREATE INDEX idx_mv_estab_situacao ON vw_estabelecimentos_completos (situacao_cadastral)"),
-    ("idx_mv_estab_cnae", "CREATE INDEX idx_mv_estab_cnae ON vw_estabelecimentos_completos (cnae_fiscal_principal)"),
+    # Formas quentes da busca com cnpj_completo no fim (paginacao sem sort); o
+    # municipio filtra pelo codigo. O de cnae tambem atende o filtro so por cnae.
+    ("idx_mv_estab_mun_sit_cnpj", "CREATE INDEX idx_mv_estab_mun_sit_cnpj ON vw_estabelecimentos_completos (municipio, situacao_cadastral, cnpj_completo)"),
+    ("idx_mv_estab_cnae_uf_sit_cnpj", "CREATE INDEX idx_mv_estab_cnae_uf_sit_cnpj ON vw_estabelecimentos_completos (cnae_fiscal_principal, uf, situacao_cadastral, cnpj_completo)"),
+    # CNAE secundario (cnae_secundario / cnae_qualquer): pertinencia no array com &&
+    ("idx_mv_estab_cnaes_secundarios", "CREATE INDEX idx_mv_estab_cnaes_secundarios ON vw_estabelecimentos_completos USING gin (cnaes_secundarios)"),
     # Composto p/ filtro regional (uf+situacao) com paginacao por cnpj: torna o
     # COUNT index-only e a busca ordenada instantaneos (evita o 502 por timeout).
     ("idx_mv_estab_uf_sit_cnpj", "CREATE INDEX idx_mv_estab_uf_sit_cnpj ON vw_estabelecimentos_completos (uf, situacao_cadastral, cnpj_completo)"),
@@ -136,6 +153,36 @@ def build_index(item):
     raise RuntimeError(f"{name} falhou")
 
 
+def build_rollup():
+    """Contagens exatas em agrupamentos estreitos (GROUPING SETS sobre
+    uf/municipio/cnae/situacao/porte/simples/mei/ano), agregadas da MV recem-criada (usadas no total do /search e no /search/facets)."""
+    conn = connect(); conn.autocommit = True; cur = conn.cursor()
+    cur.execute(f"SET work_mem = '{WMEM}'")
+    cur.execute("SET statement_timeout = 0")
+    t = time.time()
+    cur.execute(ROLLUP_SQL.read_text(encoding="utf-8"))
+    cur.execute("SELECT count(*), count(DISTINCT grupo) FROM search_facet_counts")
+    rows, sets = cur.fetchone()
+    conn.close()
+    log.info("ROLLUP pronto em %.1f min: %d linhas em %d agrupamentos",
+             (time.time() - t) / 60, rows, sets)
+
+
+def build_autocomplete():
+    """Nomes normalizados das matrizes + indice de prefixos (text_pattern_ops)
+    lidos pelo /autocomplete."""
+    conn = connect(); conn.autocommit = True; cur = conn.cursor()
+    cur.execute(f"SET work_mem = '{WMEM}'")
+    cur.execute(f"SET maintenance_work_mem = '{WMEM}'")
+    cur.execute("SET statement_timeout = 0")
+    t = time.time()
+    cur.execute(AUTOCOMPLETE_SQL.read_text(encoding="utf-8"))
+    cur.execute("SELECT count(*) FROM autocomplete_nomes")
+    rows = cur.fetchone()[0]
+    conn.close()
+    log.info("AUTOCOMPLETE pronto em %.1f min: %d nomes", (time.time() - t) / 60, rows)
+
+
 def main():
     if not URL:
         log.error("DATABASE_URL nao definida"); sys.exit(2)
@@ -158,6 +205,10 @@ def main():
     k, n = cur.fetchone()
     conn.close()
     log.info("MATVIEW PRONTA em %.1f min. relkind=%s linhas=%d", (time.time() - t0) / 60, k, n)
+    if not os.getenv("SKIP_ROLLUP"):
+        build_rollup()
+    if not os.getenv("SKIP_AUTOCOMPLETE"):
+        build_autocomplete()
 
 
 if __name__ == "__main__":
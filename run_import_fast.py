@@ -10,13 +10,27 @@ Fluxo por arquivo:
 Pré-requisitos:
   - Tabelas criadas: python setup_database.py --stage all
   - Auxiliares já importadas (cnaes, municipios, ...)
-  - CSVs extraídos em ./downloads
+  - ZIPs da Receita (ou CSVs já extraídos) em ./downloads
   - DATABASE_URL no ambiente.
 
 Uso:
   DATABASE_URL=postgresql://... python run_import_fast.py
   DATABASE_URL=... python run_import_fast.py --only simples_nacional   # validar um tipo
   DATABASE_URL=... python run_import_fast.py --suffix _new             # carga em STAGING
+  DATABASE_URL=... python run_import_fast.py --jobs 4                  # 4 arquivos em paralelo
+
+Leitura direto do ZIP:
+  Os membros de cada .zip em ./downloads são abertos com ZipFile.open() e
+  alimentam o COPY em streaming — uma leitura sequencial do zip, sem extrair
+  ~30 GB de CSV para o disco. CSVs soltos (extraídos antes) continuam valendo
+  e têm prioridade sobre o membro de mesmo nome dentro do zip.
+
+Modo PARALELO (--jobs N, ou IMPORT_JOBS no ambiente):
+  Cada arquivo (parte 0..9 de EMPRECSV/ESTABELE/SOCIOCSV, SIMPLES) vira um job
+  com conexão PRÓPRIA e tabela TEMP própria — N backends do Postgres fazendo
+  COPY + INSERT/SELECT ao mesmo tempo, em vez de um único. FKs já estão
+  removidas durante a carga, então a ordem entre tipos não importa. Funciona
+  igual com --suffix (só muda a tabela-alvo).
 
 Modo STAGING (--suffix _new):
   Cria empresas_new, estabelecimentos_new, socios_new e simples_nacional_new
@@ -29,8 +43,12 @@ import os
 import re
 import sys
 import time
+import zipfile
 import argparse
 import logging
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from pathlib import Path
 
 import psycopg2
@@ -199,63 +217,210 @@ def make_stg_ddl(name, ncols):
     return f"CREATE TEMP TABLE IF NOT EXISTS {name} ({cols})"
 
 
-def load_type(conn, type_name, files, suffix=""):
+def tune_session(conn):
+    """Otimizações de carga em massa (valem para a sessão da conexão)."""
+    cur = conn.cursor()
+    cur.execute("SET synchronous_commit = off")
+    cur.execute("SET work_mem = '256MB'")
+    cur.execute("SET maintenance_work_mem = '512MB'")
+    conn.commit()
+    cur.close()
+
+
+def zip_sources(zp, types=ORDER):
+    """[(tipo, (zip, membro)), ...] dos membros de UM zip que casam com os tipos."""
+    with zipfile.ZipFile(zp) as z:
+        names = [i.filename for i in z.infolist() if not i.is_dir()]
+    return [(t, (str(zp), m)) for m in names for t in types
+            if fnmatchcase(Path(m).name, SPECS[t]["glob"])]
+
+
+def find_sources(type_name):
+    """Fontes do tipo como [(arquivo, membro), ...]: CSVs soltos em downloads/
+    (membro=None) e membros dos .zip que casam com o glob do tipo. Um membro
+    cujo CSV já foi extraído é ignorado (não carrega duas vezes)."""
+    pattern = SPECS[type_name]["glob"]
+    loose = sorted(DOWNLOADS.glob(pattern))
+    sources = [(str(f), None) for f in loose]
+    seen = {f.name for f in loose}
+    for zp in sorted(DOWNLOADS.glob("*.zip")):
+        try:
+            zipped = zip_sources(zp, [type_name])
+        except zipfile.BadZipFile:
+            log.warning("ZIP corrompido, ignorado: %s", zp.name)
+            continue
+        sources.extend(src for _, src in zipped if Path(src[1]).name not in seen)
+    return sources
+
+
+@contextmanager
+def open_source(src):
+    """Stream binário da fonte: o CSV solto ou o membro lido direto do zip
+    (descompressão sob demanda, sem arquivo intermediário)."""
+    fpath, member = src
+    if member is None:
+        with open(fpath, "rb") as fh:
+            yield fh
+    else:
+        with zipfile.ZipFile(fpath) as z, z.open(member) as fh:
+            yield fh
+
+
+def source_name(src):
+    fpath, member = src
+    return Path(fpath).name if member is None else f"{Path(fpath).name}:{Path(member).name}"
+
+
+def source_size(src):
+    """Tamanho descomprimido (ordena os jobs do paralelo, maiores primeiro)."""
+    fpath, member = src
+    if member is None:
+        return os.path.getsize(fpath)
+    with zipfile.ZipFile(fpath) as z:
+        return z.getinfo(member).file_size
+
+
+def load_file(conn, type_name, src, suffix=""):
+    """COPY de UMA fonte (CSV solto ou membro de zip) para a TEMP da sessão +
+    INSERT/SELECT na tabela-alvo. Retorna (linhas_no_csv, inseridas, segundos)."""
     spec = SPECS[type_name]
     target = spec["target"] + suffix
     cur = conn.cursor()
     cur.execute(make_stg_ddl(spec["stg"], spec["stg_cols"]))
+    t0 = time.time()
+    cur.execute(f"TRUNCATE {spec['stg']}")
+    copy_sql = (f"COPY {spec['stg']} FROM STDIN WITH "
+                f"(FORMAT csv, DELIMITER ';', QUOTE '\"', ENCODING 'LATIN1')")
+    with open_source(src) as fh:
+        cur.copy_expert(copy_sql, _NullStripReader(fh))
+    cur.execute(f"SELECT count(*) FROM {spec['stg']}")
+    staged = cur.fetchone()[0]
+    cur.execute(
+        f"INSERT INTO {target} ({spec['cols']}) "
+        f"SELECT {spec['select']} FROM {spec['stg']} "
+        f"ON CONFLICT {spec['conflict']} DO NOTHING"
+    )
+    inserted = cur.rowcount
     conn.commit()
+    cur.close()
+    return staged, inserted, time.time() - t0
+
 
+def _log_file(type_name, src, staged, inserted, dt, job=None):
+    rate = int(staged / dt) if dt else 0
+    log.info("  %s[%s] %s: %s linhas, %s inseridas em %.1fs (%s linhas/s)",
+             f"job {job} " if job is not None else "", type_name, source_name(src),
+             f"{staged:,}", f"{inserted:,}", dt, f"{rate:,}")
+
+
+def load_type(conn, type_name, sources, suffix=""):
     total = 0
-    for fpath in files:
-        t0 = time.time()
-        cur.execute(f"TRUNCATE {spec['stg']}")
-        copy_sql = (f"COPY {spec['stg']} FROM STDIN WITH "
-                    f"(FORMAT csv, DELIMITER ';', QUOTE '\"', ENCODING 'LATIN1')")
-        with open(fpath, "rb") as fh:
-            cur.copy_expert(copy_sql, _NullStripReader(fh))
-        cur.execute(f"SELECT count(*) FROM {spec['stg']}")
-        staged = cur.fetchone()[0]
-        cur.execute(
-            f"INSERT INTO {target} ({spec['cols']}) "
-            f"SELECT {spec['select']} FROM {spec['stg']} "
-            f"ON CONFLICT {spec['conflict']} DO NOTHING"
-        )
-        inserted = cur.rowcount
-        conn.commit()
+    for src in sources:
+        staged, inserted, dt = load_file(conn, type_name, src, suffix)
         total += inserted
-        dt = time.time() - t0
-        rate = int(staged / dt) if dt else 0
-        log.info("  [%s] %s: %s linhas, %s inseridas em %.1fs (%s linhas/s)",
-                 type_name, Path(fpath).name, f"{staged:,}", f"{inserted:,}", dt, f"{rate:,}")
-    cur.close()
+        _log_file(type_name, src, staged, inserted, dt)
     return total
 
 
-def main():
-    p = argparse.ArgumentParser()
-    p.add_argument("--only", help="tipos separados por vírgula (ex.: empresas,socios)")
-    p.add_argument("--keep", action="store_true", help="NÃO truncar as tabelas antes (append)")
-    p.add_argument("--suffix", default="",
-                   help="carga em staging: cria e carrega tabelas {nome}{suffix} "
-                        "(ex.: _new) SEM tocar na produção")
-    args = p.parse_args()
-
-    url = os.getenv("DATABASE_URL")
-    if not url:
-        log.error("DATABASE_URL não definida."); sys.exit(2)
+# Jobs concorrentes com ON CONFLICT na mesma tabela podem esbarrar em deadlock
+# (raro: as partes da Receita quase não se sobrepõem). A transação do arquivo
+# é desfeita inteira, então repetir é seguro.
+JOB_MAX_ATTEMPTS = 3
 
-    suffix = validate_suffix(args.suffix) if args.suffix else ""
-    types = ORDER if not args.only else [t.strip() for t in args.only.split(",")]
 
+def _run_job(url, job, type_name, src, suffix):
+    """Um arquivo em conexão própria (TEMP própria). Roda em thread do pool:
+    o psycopg2 libera o GIL durante o COPY, e o trabalho pesado é do backend."""
     conn = psycopg2.connect(url, connect_timeout=30)
+    try:
+        tune_session(conn)
+        for attempt in range(1, JOB_MAX_ATTEMPTS + 1):
+            try:
+                staged, inserted, dt = load_file(conn, type_name, src, suffix)
+                break
+            except psycopg2.errors.DeadlockDetected:
+                conn.rollback()
+                if attempt == JOB_MAX_ATTEMPTS:
+                    raise
+                log.warning("  job %d [%s] %s: deadlock, tentativa %d/%d",
+                            job, type_name, source_name(src), attempt + 1, JOB_MAX_ATTEMPTS)
+        _log_file(type_name, src, staged, inserted, dt, job=job)
+        return type_name, staged, inserted, dt
+    finally:
+        conn.close()
+
+
+def load_parallel(url, tasks, suffix="", jobs=2):
+    """Carrega [(tipo, fonte), ...] com até `jobs` conexões simultâneas.
+    Retorna {tipo: inseridas}; qualquer job com erro aborta a carga."""
+    by_type = {}
+    staged_total, busy = 0, 0.0
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="import") as pool:
+        futures = [pool.submit(_run_job, url, i, t, f, suffix)
+                   for i, (t, f) in enumerate(tasks, 1)]
+        for fut in as_completed(futures):
+            type_name, staged, inserted, dt = fut.result()
+            by_type[type_name] = by_type.get(type_name, 0) + inserted
+            staged_total += staged
+            busy += dt
+    wall = time.time() - t0
+    log.info("=== PARALELO: %d arquivo(s), %d jobs, %s linhas em %.1fs "
+             "(%s linhas/s agregado; %.1fx sobre o tempo somado dos jobs) ===",
+             len(tasks), jobs, f"{staged_total:,}", wall,
+             f"{int(staged_total / wall) if wall else 0:,}", busy / wall if wall else 0)
+    return by_type
+
+
+def load_stream(url, zips, types=ORDER, suffix="", jobs=2, on_loaded=None):
+    """Pipeline download → COPY: carrega cada zip assim que o iterável `zips` o
+    entrega (ex.: à medida que o download termina), com até `jobs` conexões.
+    Com todos os jobs ocupados o iterável não é consumido — a contrapressão
+    chega ao produtor (fila limitada do atualizar_mensal.py). Zips sem membros
+    dos tipos pedidos (auxiliares) são só registrados. Qualquer erro, do
+    produtor ou de um job, aborta a carga. Retorna {tipo: inseridas}.
+    `on_loaded(zip)`: chamado quando TODOS os membros do zip já foram
+    commitados (ex.: apagar o zip e liberar o disco)."""
+    by_type, pending = {}, {}
+    remaining = {}  # zip -> membros ainda não commitados
+    n = 0
+
+    def collect(return_when):
+        done, _ = wait(pending, return_when=return_when)
+        for fut in done:
+            zp = pending.pop(fut)
+            type_name, _, inserted, _ = fut.result()
+            by_type[type_name] = by_type.get(type_name, 0) + inserted
+            remaining[zp] -= 1
+            if remaining[zp] == 0:
+                del remaining[zp]
+                if on_loaded is not None:
+                    on_loaded(zp)
+
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="import") as pool:
+        for zp in zips:
+            sources = zip_sources(zp, types)
+            if not sources:
+                log.info("  %s: sem dados núcleo (auxiliar), não carregado aqui", Path(zp).name)
+            if sources:
+                remaining[zp] = len(sources)
+            for type_name, src in sources:
+                while len(pending) >= jobs:
+                    collect(FIRST_COMPLETED)
+                n += 1
+                pending[pool.submit(_run_job, url, n, type_name, src, suffix)] = zp
+        while pending:
+            collect(FIRST_COMPLETED)
+    log.info("=== PIPELINE: %d arquivo(s) carregados em %.1fs (%d jobs) ===",
+             n, time.time() - t0, jobs)
+    return by_type
+
+
+def prepare_load(conn, types, suffix="", keep=False):
+    """Antes da carga: funções auxiliares, staging (se suffix), DROP das FKs
+    e TRUNCATE das tabelas-alvo (exceto com keep)."""
     cur = conn.cursor()
-    # Otimizações de carga em massa
-    cur.execute("SET synchronous_commit = off")
-    cur.execute("SET work_mem = '256MB'")
-    cur.execute("SET maintenance_work_mem = '512MB'")
-    conn.commit()
-
     cur.execute(HELPERS_SQL); conn.commit()
     log.info("Funções auxiliares rfb_date/rfb_num criadas.")
 
@@ -267,7 +432,7 @@ def main():
     log.info("FKs removidas para acelerar a carga%s.",
              f" (staging {suffix})" if suffix else "")
 
-    if not args.keep:
+    if not keep:
         # com suffix as tabelas acabaram de ser criadas — TRUNCATE é no-op
         # inofensivo (mantido para reexecuções com --only/--keep)
         for t in types:
@@ -275,16 +440,12 @@ def main():
         conn.commit()
         log.info("Tabelas-alvo truncadas: %s",
                  ", ".join(SPECS[t]["target"] + suffix for t in types))
+    cur.close()
 
-    grand = time.time()
-    for t in types:
-        files = sorted(str(f) for f in DOWNLOADS.glob(SPECS[t]["glob"]))
-        if not files:
-            log.warning("Nenhum arquivo p/ %s (%s)", t, SPECS[t]["glob"]); continue
-        log.info("=== %s: %d arquivo(s) ===", t.upper(), len(files))
-        n = load_type(conn, t, files, suffix)
-        log.info("=== %s concluído: %s linhas ===", t, f"{n:,}")
 
+def finish_load(conn, types, suffix=""):
+    """Depois da carga: FKs de volta (NOT VALID) + ANALYZE das tabelas-alvo."""
+    cur = conn.cursor()
     # Re-adiciona FKs como NOT VALID (documenta relação sem revalidar tudo)
     try:
         cur.execute(readd_fks_sql(suffix)); conn.commit()
@@ -297,7 +458,57 @@ def main():
     for t in types:
         cur.execute(f"ANALYZE {SPECS[t]['target']}{suffix}")
     conn.commit()
-    cur.close(); conn.close()
+    cur.close()
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--only", help="tipos separados por vírgula (ex.: empresas,socios)")
+    p.add_argument("--keep", action="store_true", help="NÃO truncar as tabelas antes (append)")
+    p.add_argument("--suffix", default="",
+                   help="carga em staging: cria e carrega tabelas {nome}{suffix} "
+                        "(ex.: _new) SEM tocar na produção")
+    p.add_argument("--jobs", type=int, default=int(os.getenv("IMPORT_JOBS", "1")),
+                   help="arquivos carregados em paralelo, cada um em conexão própria "
+                        "(padrão: IMPORT_JOBS ou 1 = sequencial)")
+    args = p.parse_args()
+
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        log.error("DATABASE_URL não definida."); sys.exit(2)
+
+    suffix = validate_suffix(args.suffix) if args.suffix else ""
+    types = ORDER if not args.only else [t.strip() for t in args.only.split(",")]
+
+    conn = psycopg2.connect(url, connect_timeout=30)
+    tune_session(conn)
+    prepare_load(conn, types, suffix, keep=args.keep)
+
+    grand = time.time()
+    tasks = []
+    for t in types:
+        sources = find_sources(t)
+        if not sources:
+            log.warning("Nenhum arquivo p/ %s (%s)", t, SPECS[t]["glob"]); continue
+        zipped = sum(1 for _, m in sources if m is not None)
+        log.info("=== %s: %d arquivo(s)%s ===", t.upper(), len(sources),
+                 f", {zipped} lido(s) direto do zip" if zipped else "")
+        if args.jobs > 1:
+            tasks.extend((t, s) for s in sources)
+            continue
+        n = load_type(conn, t, sources, suffix)
+        log.info("=== %s concluído: %s linhas ===", t, f"{n:,}")
+
+    if tasks:
+        # Maiores primeiro: o último job a terminar não é um ESTABELE de 2 GB
+        tasks.sort(key=lambda ts: source_size(ts[1]), reverse=True)
+        totals = load_parallel(url, tasks, suffix, args.jobs)
+        for t in types:
+            if t in totals:
+                log.info("=== %s concluído: %s linhas ===", t, f"{totals[t]:,}")
+
+    finish_load(conn, types, suffix)
+    conn.close()
     log.info("CARGA RÁPIDA COMPLETA em %.1f min.", (time.time() - grand) / 60)
 
 
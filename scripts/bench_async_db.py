@@ -0,0 +1,123 @@
+"""
+Benchmark de carga: latência de requisições rápidas enquanto há consultas
+lentas concorrentes no MESMO worker (um event loop).
+
+Compara os dois modelos de acesso ao banco usados nas rotas:
+  - sync : psycopg2 chamado direto dentro de `async def` (modelo antigo)
+  - async: AsyncDatabaseManager (psycopg 3, pool assíncrono)
+
+Cada "requisição lenta" roda pg_sleep(--slow-seconds); cada "requisição
+rápida" roda SELECT 1. Mede p50/p95/p99 das rápidas.
+
+Uso:
+    DATABASE_URL=postgresql://... python scripts/bench_async_db.py --slow 4 --fast 200
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+# Chegadas em ritmo fixo: a latência é medida a partir do instante PLANEJADO de
+# chegada, então o tempo em que o loop ficou bloqueado entra na conta.
+ARRIVAL_GAP = 0.005
+
+
+async def _sleep_until(deadline: float):
+    delay = deadline - time.perf_counter()
+    await asyncio.sleep(delay if delay > 0 else 0)
+
+
+def _pct(values: list[float], p: float) -> float:
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+async def run_sync_mode(dsn: str, slow: int, fast: int, slow_seconds: float) -> list[float]:
+    """psycopg2 dentro de async def: cada execute bloqueia o loop."""
+    conns = [psycopg2.connect(dsn) for _ in range(slow + 1)]
+
+    async def slow_req(conn):
+        cur = conn.cursor()
+        cur.execute("SELECT pg_sleep(%s)", (slow_seconds,))
+        cur.close()
+
+    async def fast_req(conn, out, t_planned):
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.fetchone()
+        cur.close()
+        out.append((time.perf_counter() - t_planned) * 1000)
+
+    latencies: list[float] = []
+    tasks = [asyncio.create_task(slow_req(c)) for c in conns[:slow]]
+    start = time.perf_counter()
+    for i in range(fast):
+        tasks.append(asyncio.create_task(fast_req(conns[-1], latencies, start + i * ARRIVAL_GAP)))
+        await _sleep_until(start + (i + 1) * ARRIVAL_GAP)
+    await asyncio.gather(*tasks)
+    for c in conns:
+        c.close()
+    return latencies
+
+
+async def run_async_mode(dsn: str, slow: int, fast: int, slow_seconds: float) -> list[float]:
+    """AsyncDatabaseManager: o loop segue livre enquanto o Postgres trabalha."""
+    from src.database.async_connection import AsyncDatabaseManager
+
+    db = AsyncDatabaseManager(dsn)
+    db.min_size, db.max_size = slow + 1, slow + 2
+    await db.open()
+    await db.pool.wait()
+
+    async def fast_req(out, t_planned):
+        await db.fetchone("SELECT 1")
+        out.append((time.perf_counter() - t_planned) * 1000)
+
+    latencies: list[float] = []
+    tasks = [asyncio.create_task(db.execute("SELECT pg_sleep(%s)", (slow_seconds,))) for _ in range(slow)]
+    start = time.perf_counter()
+    for i in range(fast):
+        tasks.append(asyncio.create_task(fast_req(latencies, start + i * ARRIVAL_GAP)))
+        await _sleep_until(start + (i + 1) * ARRIVAL_GAP)
+    await asyncio.gather(*tasks)
+    await db.close()
+    return latencies
+
+
+def report(name: str, lat: list[float]):
+    print(f"{name:6s} n={len(lat):4d}  p50={statistics.median(lat):8.1f}ms  "
+          f"p95={_pct(lat, 95):8.1f}ms  p99={_pct(lat, 99):8.1f}ms  max={max(lat):8.1f}ms")
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--slow", type=int, default=4, help="consultas lentas concorrentes")
+    parser.add_argument("--slow-seconds", type=float, default=2.0)
+    parser.add_argument("--fast", type=int, default=200, help="requisições rápidas disparadas durante as lentas")
+    parser.add_argument("--mode", choices=("sync", "async", "both"), default="both")
+    args = parser.parse_args()
+
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        raise RuntimeError("DATABASE_URL não encontrado")
+
+    if args.mode in ("sync", "both"):
+        report("sync", asyncio.run(run_sync_mode(dsn, args.slow, args.fast, args.slow_seconds)))
+    if args.mode in ("async", "both"):
+        report("async", asyncio.run(run_async_mode(dsn, args.slow, args.fast, args.slow_seconds)))
+
+
+if __name__ == "__main__":
+    main()
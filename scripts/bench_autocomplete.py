@@ -0,0 +1,92 @@
+"""
+Benchmark do autocomplete: latência da consulta de prefixos em
+autocomplete_nomes (faixa no btree text_pattern_ops) x o que a UI usava,
+/search?razao_social= (ILIKE '%x%' na MV).
+
+Simula digitação: para cada nome, consulta cada prefixo a partir de 2
+caracteres ("pa", "pad", "pada", ...). Mede p50/p95/max no banco (sem cache;
+na API os prefixos curtos saem do Redis).
+
+Uso:
+    DATABASE_URL=postgresql://... python scripts/bench_autocomplete.py --limit 10
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.api.autocomplete import (  # noqa: E402
+    AUTOCOMPLETE_SQL, MIN_PREFIX_LENGTH, normalize_prefix, prefix_bounds
+)
+
+DEFAULT_NAMES = ['PADARIA SAO JOSE', 'COMERCIO DE ALIMENTOS', 'CONSTRUTORA', 'TRANSPORTES RODOVIARIOS']
+
+ILIKE_SQL = """
+    SELECT razao_social, cnpj_completo, uf, situacao_cadastral
+    FROM vw_estabelecimentos_completos
+    WHERE razao_social ILIKE %s
+    ORDER BY razao_social, cnpj_completo
+    LIMIT %s
+"""
+
+
+def _pct(values: list[float], p: float) -> float:
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+def report(name: str, lat: list[float]):
+    print(f"{name:8s} n={len(lat):4d}  p50={statistics.median(lat):8.1f}ms  "
+          f"p95={_pct(lat, 95):8.1f}ms  max={max(lat):8.1f}ms")
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", default=DEFAULT_NAMES)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--ilike", action="store_true", help="mede também o ILIKE na MV (lento)")
+    args = parser.parse_args()
+
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        raise RuntimeError("DATABASE_URL não encontrado")
+
+    conn = psycopg2.connect(dsn)
+    try:
+        cursor = conn.cursor()
+        prefix_lat, ilike_lat = [], []
+        for name in args.names:
+            for end in range(MIN_PREFIX_LENGTH, len(name) + 1):
+                typed = name[:end]
+                prefix = normalize_prefix(typed)
+                if prefix is None:
+                    continue
+                t0 = time.perf_counter()
+                cursor.execute(AUTOCOMPLETE_SQL, (*prefix_bounds(prefix), args.limit))
+                cursor.fetchall()
+                prefix_lat.append((time.perf_counter() - t0) * 1000)
+                if args.ilike:
+                    t0 = time.perf_counter()
+                    cursor.execute(ILIKE_SQL, (f"%{typed}%", args.limit))
+                    cursor.fetchall()
+                    ilike_lat.append((time.perf_counter() - t0) * 1000)
+        report("prefixo", prefix_lat)
+        if ilike_lat:
+            report("ilike", ilike_lat)
+        cursor.close()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark do codec do cache: pickle+zlib (antigo) x CachedBody (JSON+gzip).
+
+Página sintética do /search (padrão 1.000 linhas). Mede:
+  - tamanho gravado no Redis (≈ memória por entrada)
+  - custo do HIT até os bytes irem para o socket:
+      antigo: zlib.decompress + pickle.loads + json (FastAPI) + gzip nível 9
+              (GZipMiddleware)
+      novo  : bytes do Redis direto (Content-Encoding: gzip) ou um
+              gzip.decompress para clientes sem gzip
+  - custo do MISS para gravar a entrada
+
+Com REDIS_URL, também lê o MEMORY USAGE real das duas chaves.
+
+Uso:
+    python scripts/bench_cache_codec.py --rows 1000
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import pickle
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.api.cache_redis import CachedBody, RedisCache  # noqa: E402
+from src.api.search_filters import SEARCH_COLUMNS  # noqa: E402
+
+
+def make_page(rows: int, seed: int = 42) -> dict:
+    rng = random.Random(seed)
+    words = ['COMERCIO', 'SERVICOS', 'LTDA', 'ME', 'TRANSPORTES', 'ALIMENTOS', 'SAO', 'PAULO', 'DE', 'E']
+    items = []
+    for i in range(rows):
+        item = {c: None for c in SEARCH_COLUMNS}
+        cnpj = f"{rng.randrange(10**13):014d}"
+        item.update({
+            'cnpj_completo': cnpj, 'cnpj_basico': cnpj[:8], 'cnpj_ordem': cnpj[8:12], 'cnpj_dv': cnpj[12:],
+            'identificador_matriz_filial': '1', 'razao_social': ' '.join(rng.choices(words, k=4)),
+            'nome_fantasia': ' '.join(rng.choices(words, k=2)), 'situacao_cadastral': '02',
+            'data_situacao_cadastral': '2005-11-03', 'data_inicio_atividade': f"{rng.randint(1970, 2024)}-01-01",
+            'cnae_fiscal_principal': f"{rng.randint(1000000, 9999999)}", 'cnae_principal_desc': 'Comércio varejista',
+            'tipo_logradouro': 'RUA', 'logradouro': ' '.join(rng.choices(words, k=3)), 'numero': str(rng.randint(1, 999)),
+            'bairro': 'CENTRO', 'cep': f"{rng.randint(1000000, 99999999):08d}", 'uf': 'SP', 'municipio_desc': 'SAO PAULO',
+            'ddd_1': '11', 'telefone_1': f"{rng.randint(20000000, 99999999)}", 'porte_empresa': '01',
+            'capital_social': float(rng.randint(1000, 10**6)), 'opcao_simples': 'S', 'opcao_mei': 'N',
+            'cnae_secundarios_completos': [],
+        })
+        items.append(item)
+    return {'total': 123456, 'total_exact': True, 'page': 1, 'per_page': rows,
+            'total_pages': 124, 'items': items, 'next_cursor': None}
+
+
+def timed(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--rows', type=int, default=1000)
+    p.add_argument('--repeat', type=int, default=20)
+    args = p.parse_args()
+
+    page = make_page(args.rows)
+    old_entry = zlib.compress(pickle.dumps(page), level=6)
+    new_body = CachedBody.from_value(page)
+
+    def hit_old():
+        value = pickle.loads(zlib.decompress(old_entry))
+        body = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode()
+        gzip.compress(body, compresslevel=9)
+
+    def hit_new_gzip():
+        CachedBody(new_body.gzipped).gzipped
+
+    def hit_new_plain():
+        CachedBody(new_body.gzipped).body()
+
+    def miss_old():
+        zlib.compress(pickle.dumps(page), level=6)
+
+    def miss_new():
+        CachedBody.from_value(page)
+
+    print(f"página sintética do /search: {args.rows} linhas, JSON {len(new_body.body()) / 1024:.0f} KB")
+    print(f"  entrada no Redis : antigo {len(old_entry) / 1024:8.1f} KB | novo {len(new_body.gzipped) / 1024:8.1f} KB")
+    print(f"  HIT  antigo      : {timed(hit_old, args.repeat):8.2f} ms")
+    print(f"  HIT  novo (gzip) : {timed(hit_new_gzip, args.repeat):8.3f} ms")
+    print(f"  HIT  novo (plain): {timed(hit_new_plain, args.repeat):8.2f} ms")
+    print(f"  MISS antigo      : {timed(miss_old, args.repeat):8.2f} ms")
+    print(f"  MISS novo        : {timed(miss_new, args.repeat):8.2f} ms")
+
+    if os.getenv('REDIS_URL'):
+        cache = RedisCache(url=os.getenv('REDIS_URL'))
+        if cache.enabled:
+            client = cache.redis_client
+            client.set('bench:codec:old', old_entry, ex=60)
+            cache.set('bench:codec:new', new_body, ttl_seconds=60)
+            print(f"  MEMORY USAGE     : antigo {client.memory_usage('bench:codec:old')} B | "
+                  f"novo {client.memory_usage('bench:codec:new')} B")
+            cache.delete_many(['bench:codec:old', 'bench:codec:new'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark de round trips ao Redis por requisição (RedisCache).
+
+Compara, para os padrões de acesso das rotas:
+  - search: página + total do /search
+      antigo: GET página, GET total, SET total, SET página (miss) / 1 GET (hit)
+      novo  : MGET [página, total] + 1 pipeline no miss
+  - bulk  : N chaves cnpj:* do /cnpj/bulk
+      antigo: um GET/SETEX por chave
+      novo  : get_many (MGET) + set_many (pipeline)
+
+Conta os round trips instrumentando o cliente (cada comando avulso = 1,
+cada pipeline.execute() = 1) e mede a latência média por requisição.
+
+Uso:
+    REDIS_URL=redis://localhost:6379/0 python scripts/bench_cache_roundtrips.py --requests 500 --bulk 1000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.api.cache_redis import RedisCache  # noqa: E402
+
+
+class RoundTrips:
+    """Conta round trips do cliente redis-py (comandos avulsos + pipelines)."""
+
+    def __init__(self, client):
+        self.n = 0
+        execute_command = client.execute_command
+        pipeline = client.pipeline
+
+        def counted_command(*args, **kwargs):
+            self.n += 1
+            return execute_command(*args, **kwargs)
+
+        def counted_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def counted_execute(*a, **kw):
+                self.n += 1
+                return execute(*a, **kw)
+
+            pipe.execute = counted_execute
+            return pipe
+
+        client.execute_command = counted_command
+        client.pipeline = counted_pipeline
+
+
+def search_old(cache: RedisCache, page_key: str, count_key: str, page: dict):
+    if cache.get(page_key) is not None:
+        return
+    if cache.get(count_key) is None:
+        cache.set(count_key, {'total': 1234, 'exact': True}, ttl_seconds=360 * 60)
+    cache.set(page_key, page, ttl_seconds=3600)
+
+
+def search_new(cache: RedisCache, page_key: str, count_key: str, page: dict):
+    found = cache.get_many([page_key, count_key])
+    if page_key in found:
+        return
+    to_cache = {page_key: page}
+    if count_key not in found:
+        to_cache[count_key] = {'total': 1234, 'exact': True}
+    cache.set_many(to_cache, ttl_seconds=3600, ttls={count_key: 360 * 60})
+
+
+def bulk_old(cache: RedisCache, keys: list, row: dict):
+    misses = [k for k in keys if cache.get(k) is None]
+    for k in misses:
+        cache.set(k, row, ttl_seconds=3600)
+
+
+def bulk_new(cache: RedisCache, keys: list, row: dict):
+    found = cache.get_many(keys)
+    cache.set_many({k: row for k in keys if k not in found}, ttl_seconds=3600)
+
+
+def run(name, fn, cache, counter, make_args, requests):
+    counter.n = 0
+    t0 = time.perf_counter()
+    for i in range(requests):
+        fn(cache, *make_args(i))
+    elapsed = time.perf_counter() - t0
+    print(f"  {name:<12} {counter.n / requests:8.1f} round trips/req  "
+          f"{elapsed / requests * 1000:8.2f} ms/req")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--requests', type=int, default=500)
+    p.add_argument('--bulk', type=int, default=1000, help="CNPJs por requisição do bulk")
+    args = p.parse_args()
+
+    cache = RedisCache(url=os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+    if not cache.enabled:
+        sys.exit("Redis indisponível (REDIS_URL)")
+    counter = RoundTrips(cache.redis_client)
+
+    run_id = uuid.uuid4().hex[:8]
+    page = {'total': 1234, 'items': [{'cnpj_completo': f"{i:014d}", 'uf': 'SP'} for i in range(100)]}
+    row = {'cnpj_completo': '00000000000191', 'razao_social': 'EMPRESA TESTE', 'uf': 'DF'}
+
+    # Metade miss (chave nova), metade hit (repete a anterior)
+    def search_args(prefix):
+        return lambda i: (f"bench:{run_id}:{prefix}:p:{i // 2}", f"bench:{run_id}:{prefix}:c:{i // 2}", page)
+
+    def bulk_args(prefix):
+        return lambda i: ([f"bench:{run_id}:{prefix}:{i // 2}:{j}" for j in range(args.bulk)], row)
+
+    print(f"search ({args.requests} req, 50% hit):")
+    run("antigo", search_old, cache, counter, search_args('so'), args.requests)
+    run("MGET+pipe", search_new, cache, counter, search_args('sn'), args.requests)
+
+    bulk_requests = max(2, args.requests // 50)
+    print(f"bulk ({bulk_requests} req x {args.bulk} chaves, 50% hit):")
+    run("antigo", bulk_old, cache, counter, bulk_args('bo'), bulk_requests)
+    run("MGET+pipe", bulk_new, cache, counter, bulk_args('bn'), bulk_requests)
+
+    cache.delete_many(list(cache.redis_client.scan_iter(f"bench:{run_id}:*", count=1000)))
+
+
+if __name__ == '__main__':
+    main()
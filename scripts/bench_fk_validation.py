@@ -0,0 +1,116 @@
+"""
+Micro-benchmark da transformação de chunk do CNPJImporter (sem banco).
+
+Compara, num chunk sintético de estabelecimentos (padrão 1M linhas):
+  - apply: validate_foreign_key por célula via .apply(lambda) + to_datetime
+           por coluna (modelo antigo)
+  - vetor: filter_valid_codes (Series.isin/where) + format_rfb_dates
+           (datas distintas parseadas uma vez, todas as colunas juntas)
+
+Confere que os dois produzem o mesmo resultado antes de imprimir os tempos.
+
+Uso:
+    python scripts/bench_fk_validation.py --rows 1000000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.etl.transform import filter_valid_codes, format_rfb_dates  # noqa: E402
+
+FK_COLUMNS = {
+    'motivo_situacao_cadastral': 'motivos_situacao_cadastral',
+    'pais': 'paises',
+    'cnae_fiscal_principal': 'cnaes',
+    'municipio': 'municipios',
+}
+DATE_COLUMNS = ['data_situacao_cadastral', 'data_inicio_atividade', 'data_situacao_especial']
+
+
+def make_codes() -> dict[str, set[str]]:
+    """Tabelas auxiliares com a cardinalidade real (aprox.) da Receita."""
+    return {
+        'motivos_situacao_cadastral': {f"{i:02d}" for i in range(60)},
+        'paises': {f"{i:03d}" for i in range(250)},
+        'cnaes': {f"{i:07d}" for i in range(100000, 101360)},
+        'municipios': {f"{i:04d}" for i in range(5570)},
+    }
+
+
+def make_chunk(rows: int, codes: dict[str, set[str]], seed: int = 42) -> pd.DataFrame:
+    """Chunk com ~5% de códigos inválidos, vazios e datas zeradas."""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for col, table in FK_COLUMNS.items():
+        pool = np.array(sorted(codes[table]) + ['', '9999999', 'XX'], dtype=object)
+        weights = np.full(len(pool), 0.95 / (len(pool) - 3))
+        weights[-3:] = 0.05 / 3
+        data[col] = rng.choice(pool, size=rows, p=weights)
+    days = pd.date_range('1970-01-01', '2025-12-31').strftime('%Y%m%d').to_numpy(dtype=object)
+    days = np.concatenate([days, np.array(['', '00000000'], dtype=object)])
+    for col in DATE_COLUMNS:
+        data[col] = rng.choice(days, size=rows)
+    return pd.DataFrame(data)
+
+
+def transform_apply(chunk: pd.DataFrame, codes: dict[str, set[str]]) -> pd.DataFrame:
+    def validate_foreign_key(value, table_name):
+        if not value or value == '':
+            return ''
+        if value not in codes[table_name]:
+            return ''
+        return value
+
+    for col, table in FK_COLUMNS.items():
+        chunk[col] = chunk[col].apply(lambda x: validate_foreign_key(x, table))
+    for date_col in DATE_COLUMNS:
+        chunk[date_col] = pd.to_datetime(chunk[date_col], format='%Y%m%d', errors='coerce')
+        chunk[date_col] = chunk[date_col].dt.strftime('%Y-%m-%d')
+        chunk[date_col] = chunk[date_col].replace('NaT', '').fillna('')
+    return chunk
+
+
+def transform_vector(chunk: pd.DataFrame, codes: dict[str, set[str]]) -> pd.DataFrame:
+    for col, table in FK_COLUMNS.items():
+        chunk[col] = filter_valid_codes(chunk[col], codes[table])
+    return format_rfb_dates(chunk, DATE_COLUMNS)
+
+
+def timed(fn, chunk, codes, repeat):
+    best, out = float('inf'), None
+    for _ in range(repeat):
+        work = chunk.copy()
+        t0 = time.perf_counter()
+        out = fn(work, codes)
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--rows', type=int, default=1_000_000)
+    p.add_argument('--repeat', type=int, default=3)
+    args = p.parse_args()
+
+    codes = make_codes()
+    chunk = make_chunk(args.rows, codes)
+    t_apply, out_apply = timed(transform_apply, chunk, codes, args.repeat)
+    t_vector, out_vector = timed(transform_vector, chunk, codes, args.repeat)
+    pd.testing.assert_frame_equal(out_apply.astype(object), out_vector.astype(object))
+
+    print(f"chunk sintético: {args.rows:,} linhas, {len(FK_COLUMNS)} FKs + {len(DATE_COLUMNS)} datas")
+    print(f"  apply : {t_apply * 1000:9.1f} ms")
+    print(f"  vetor : {t_vector * 1000:9.1f} ms")
+    print(f"  ganho : {t_apply / t_vector:9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark da busca por nome: ILIKE '%termo%' (filtro razao_social) x busca
+textual `q` (tsvector nome_busca + GIN, top-K por relevância).
+
+Para cada termo, mede a 1ª página (--limit linhas) dos dois caminhos, com o
+mesmo SQL das rotas:
+  - ilike: razao_social ILIKE %s ORDER BY razao_social, cnpj_completo
+  - q    : ranked_page_query (ranqueia todas as linhas que casam, top-N por rank)
+
+Mostra o melhor tempo de --repeat execuções e quantas linhas cada caminho
+devolveu. Termos com acento mostram a diferença de recall: ILIKE 'CONSTRUÇÃO'
+não casa 'CONSTRUCAO' (e vice-versa); a busca textual casa os dois.
+
+Uso:
+    DATABASE_URL=postgresql://... python scripts/bench_text_search.py --limit 100
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src.api.search_filters import (  # noqa: E402
+    SEARCH_SELECT, TEXT_SEARCH_CONDITION, build_tsquery, ranked_page_query
+)
+
+DEFAULT_TERMS = ['COMERCIO', 'CONSTRUCAO', 'CONSTRUÇÃO', 'SERVICOS', 'TRANSPORTES LTDA', 'PADARIA SAO JOSE']
+
+
+def timed(cursor, query: str, params: list, repeat: int) -> tuple[float, int]:
+    best, rows = float('inf'), 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        cursor.execute(query, params)
+        rows = len(cursor.fetchall())
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000, rows
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("terms", nargs="*", default=DEFAULT_TERMS)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        raise RuntimeError("DATABASE_URL não encontrado")
+
+    ilike_query = f"""
+        SELECT {SEARCH_SELECT}
+        FROM vw_estabelecimentos_completos
+        WHERE razao_social ILIKE %s
+        ORDER BY razao_social, cnpj_completo
+        LIMIT %s OFFSET %s
+    """
+    ranked_query = ranked_page_query(SEARCH_SELECT, TEXT_SEARCH_CONDITION)
+
+    conn = psycopg2.connect(dsn)
+    try:
+        cursor = conn.cursor()
+        print(f"{'termo':22s} {'ilike ms':>10s} {'linhas':>7s} {'q ms':>10s} {'linhas':>7s}")
+        for term in args.terms:
+            tsquery = build_tsquery(term)
+            ilike_ms, ilike_rows = timed(cursor, ilike_query, [f"%{term}%", args.limit, 0], args.repeat)
+            q_ms, q_rows = timed(cursor, ranked_query, [tsquery, tsquery, args.limit, 0], args.repeat)
+            print(f"{term:22s} {ilike_ms:10.1f} {ilike_rows:7d} {q_ms:10.1f} {q_rows:7d}")
+        cursor.close()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,10 +11,11 @@ Ordem recomendada para uma carga nova (rápida):
     3) python run_etl.py --skip-init              # importa os dados
     4) python setup_database.py --stage indexes   # índices (CONCURRENTLY) pós-carga
     5) python setup_database.py --stage matview    # materialized view + refresh
+    6) python setup_database.py --stage rollup     # contagens exatas da busca (facetas)
 
 Conexão: usa --url ou a variável de ambiente DATABASE_URL.
 
-Modo STAGING (--suffix _new, apenas nos estágios indexes e matview):
+Modo STAGING (--suffix _new, apenas nos estágios indexes, matview e rollup):
   Cria os índices e a materialized view sobre as tabelas sufixadas
   (empresas_new etc., carregadas por run_import_fast.py --suffix _new),
   com nomes de objetos sufixados (idx_empresas_razao_trgm_new,
@@ -65,13 +66,16 @@ def apply_suffix(sql: str, suffix: str) -> str:
          'opcao_simples' etc. NÃO são afetados; auxiliares como cnaes e
          municipios continuam apontando para a produção — são estáticas e a
          MV materializa o snapshot, então o swap não depende delas);
-      3. sufixa o nome da materialized view;
+      3. sufixa o nome da materialized view, do rollup de contagens e da
+         tabela do autocomplete;
       4. sufixa os nomes de índices (idx_*)."""
     sql = re.sub(r"\bCONCURRENTLY\b\s*", "", sql)
     sql = re.sub(r"\b(empresas|estabelecimentos|socios|simples_nacional)\b",
                  lambda m: m.group(1) + suffix, sql)
     sql = sql.replace("vw_estabelecimentos_completos",
                       "vw_estabelecimentos_completos" + suffix)
+    sql = sql.replace("search_facet_counts", "search_facet_counts" + suffix)
+    sql = sql.replace("autocomplete_nomes", "autocomplete_nomes" + suffix)
     sql = re.sub(r"\b(idx_[a-z0-9_]+)", lambda m: m.group(1) + suffix, sql)
     return sql
 
@@ -158,6 +162,26 @@ def stage_matview(url: str, suffix: str = ""):
     run_block(url, sql, label)
 
 
+def stage_rollup(url: str, suffix: str = ""):
+    sql = (SETUP_DIR / "04_search_rollup.sql").read_text(encoding="utf-8")
+    label = "Estágio ROLLUP: contagens exatas da busca"
+    if suffix:
+        # staging: search_facet_counts_new agregando a MV _new
+        sql = apply_suffix(sql, suffix)
+        label += f" (staging {suffix})"
+    run_block(url, "SET work_mem = '512MB';\n" + sql, label)
+
+
+def stage_autocomplete(url: str, suffix: str = ""):
+    sql = (SETUP_DIR / "05_autocomplete.sql").read_text(encoding="utf-8")
+    label = "Estágio AUTOCOMPLETE: nomes normalizados + índice de prefixos"
+    if suffix:
+        # staging: autocomplete_nomes_new lendo a MV _new
+        sql = apply_suffix(sql, suffix)
+        label += f" (staging {suffix})"
+    run_block(url, "SET maintenance_work_mem = '512MB';\n" + sql, label)
+
+
 def verify(url: str):
     conn = psycopg2.connect(url, connect_timeout=30)
     with conn.cursor() as cur:
@@ -182,18 +206,18 @@ def verify(url: str):
 
 def main():
     p = argparse.ArgumentParser(description="Setup do banco CNPJ")
-    p.add_argument("--stage", choices=["core", "app", "indexes", "matview", "all", "verify"],
+    p.add_argument("--stage", choices=["core", "app", "indexes", "matview", "rollup", "autocomplete", "all", "verify"],
                    default="all", help="Estágio a executar (all = core+app)")
     p.add_argument("--url", help="DATABASE_URL (sobrepõe a variável de ambiente)")
     p.add_argument("--suffix", default="",
                    help="staging: cria índices/matview sobre as tabelas sufixadas "
-                        "(ex.: _new). Válido apenas com --stage indexes|matview.")
+                        "(ex.: _new). Válido apenas com --stage indexes|matview|rollup|autocomplete.")
     args = p.parse_args()
     url = get_url(args.url)
     suffix = validate_suffix(args.suffix) if args.suffix else ""
 
-    if suffix and args.stage not in ("indexes", "matview"):
-        log.error("--suffix só é suportado com --stage indexes ou matview.")
+    if suffix and args.stage not in ("indexes", "matview", "rollup", "autocomplete"):
+        log.error("--suffix só é suportado com --stage indexes, matview, rollup ou autocomplete.")
         sys.exit(2)
 
     if args.stage in ("core", "all"):
@@ -204,6 +228,10 @@ def main():
         stage_indexes(url, suffix)
     if args.stage == "matview":
         stage_matview(url, suffix)
+    if args.stage == "rollup":
+        stage_rollup(url, suffix)
+    if args.stage == "autocomplete":
+        stage_autocomplete(url, suffix)
     if args.stage in ("all", "verify"):
         verify(url)
 
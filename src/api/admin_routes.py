@@ -333,6 +333,16 @@ async def admin_db_health(current_admin: dict = Depends(get_current_admin_user))
     }
 
 
+@router.get("/cache")
+async def admin_cache_stats(current_admin: dict = Depends(get_current_admin_user)):
+    """Redis + L1 do worker + coalescência de misses + tabelas auxiliares (deste worker)."""
+    from src.api.cache_redis import cache
+    from src.api.reference_registry import reference_registry
+    from src.api.single_flight import single_flight
+    return {"cache": cache.get_stats(), "single_flight": single_flight.stats(),
+            "reference": reference_registry.stats()}
+
+
 # ----------------- ETL / ATUALIZAÇÕES -----------------
 @router.get("/etl")
 async def admin_etl_status(current_admin: dict = Depends(get_current_admin_user)):
@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 import jwt
 from passlib.context import CryptContext
 from src.database.connection import db_manager
+from src.database.async_connection import async_db_manager
 from src.config import settings
 import logging
 import os
@@ -92,7 +93,7 @@ async def get_current_user(token: str = Depends(db_manager.oauth2_scheme)):
     if token_data.username is None:
         raise credentials_exception
 
-    user = await db_manager.get_user_by_username(token_data.username)
+    user = await async_db_manager.get_user_by_username(token_data.username)
     if user is None:
         raise credentials_exception
     return user
@@ -533,7 +534,7 @@ async def register(user: UserCreate, request: Request):
         raise HTTPException(status_code=400, detail="Telefone inválido")
     
     # Verificar username duplicado
-    existing_user = await db_manager.get_user_by_username(user.username)
+    existing_user = await async_db_manager.get_user_by_username(user.username)
     if existing_user:
         raise HTTPException(status_code=400, detail="Username já cadastrado")
 
@@ -657,7 +658,7 @@ async def login(form_data: UserLogin, request: Request):
     verify_recaptcha_v3(form_data.recaptcha_token, 'login', client_ip, request)
 
     # Tenta buscar por username primeiro
-    user = await db_manager.get_user_by_username(form_data.username)
+    user = await async_db_manager.get_user_by_username(form_data.username)
 
     # Se não encontrou, tenta buscar por email
     if not user:
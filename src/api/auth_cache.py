@@ -0,0 +1,92 @@
+"""
+AuthCache — cache quente (por processo) do contexto de autenticação por API key.
+
+Toda requisição autenticada precisava de 4-5 idas ao banco (UPDATE da key,
+busca da assinatura, assinatura de fallback, upsert da cota, upsert do uso
+diário). O contexto "quem é o dono desta key e qual o seu plano" muda
+raramente, então fica aqui por AUTH_CACHE_TTL segundos, indexado pelo HASH da
+key (a key em claro nunca é guardada).
+
+Revogação continua imediata: apagar uma key incrementa `auth:epoch` no Redis e
+todo worker descarta este cache na requisição seguinte (ver usage_buffer). Sem
+Redis, vale o TTL curto.
+"""
+import time
+import logging
+from threading import Lock
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_TTL = 30  # segundos
+AUTH_CACHE_MAX_ENTRIES = 10000
+
+
+class AuthCache:
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: dict[str, tuple[float, dict]] = {}
+        self._lock = Lock()
+        # Último `auth:epoch` visto no Redis (ver usage_buffer): mudou => alguma key foi revogada
+        self.epoch: Optional[str] = None
+
+    def get(self, key_hash: str) -> Optional[dict]:
+        """Cópia do contexto (os handlers mutam o dict do usuário) ou None."""
+        entry = self._entries.get(key_hash)
+        if entry is None:
+            return None
+        expires_at, ctx = entry
+        if time.time() >= expires_at:
+            with self._lock:
+                self._entries.pop(key_hash, None)
+            return None
+        return dict(ctx)
+
+    def set(self, key_hash: str, ctx: dict):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # Descarta os expirados; se ainda cheio, recomeça (mesmo critério do cache em memória)
+                now = time.time()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[key_hash] = (time.time() + self.ttl, dict(ctx))
+
+    def invalidate(self, key_hash: str):
+        with self._lock:
+            self._entries.pop(key_hash, None)
+
+    def invalidate_user(self, user_id: int):
+        """Chamar após mudar keys/assinatura de um usuário (efeito neste worker)."""
+        with self._lock:
+            self._entries = {k: v for k, v in self._entries.items() if v[1].get('id') != user_id}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def sync_epoch(self, epoch: str):
+        """Epoch de revogação mudou em outro worker: descarta tudo e passa a usar o novo."""
+        with self._lock:
+            self._entries.clear()
+            self.epoch = epoch
+
+
+auth_cache = AuthCache()
+
+
+async def load_api_key_context(key_hash: str) -> Optional[dict]:
+    """
+    Contexto da key (usuário + assinatura vigente + última assinatura) —
+    do cache ou em UMA consulta ao banco. None = key inexistente/inativa.
+    """
+    ctx = auth_cache.get(key_hash)
+    if ctx is not None:
+        return ctx
+    from src.database.async_connection import async_db_manager
+    ctx = await async_db_manager.resolve_api_key(key_hash)
+    if ctx is not None:
+        auth_cache.set(key_hash, ctx)
+        return dict(ctx)
+    return None
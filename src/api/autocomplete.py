@@ -0,0 +1,72 @@
+"""
+Autocomplete de nomes de empresas (/autocomplete).
+
+Lê a tabela autocomplete_nomes (05_autocomplete.sql, reconstruída pelo ETL):
+uma linha por matriz com o nome normalizado, ordenada e indexada com
+text_pattern_ops. Um prefixo vira uma FAIXA do btree:
+
+    nome_norm ~>=~ 'padaria sao j' AND nome_norm ~<~ 'padaria sao k'
+
+Operadores explícitos em vez de LIKE 'x%': com o prefixo em parâmetro, o plano
+genérico (prepared statement do pool) não consegue converter LIKE em faixa de
+índice; a faixa explícita usa o índice em qualquer plano. A comparação é byte
+a byte (UTF-8), e a ordem dos bytes é a ordem dos code points — incrementar o
+último caractere dá o limite superior exato.
+
+Prefixos curtos são os mais pedidos (todo usuário passa por "co", "com"...):
+as respostas ficam no cache (L1 + Redis) da geração do dataset.
+"""
+from typing import List, Optional
+
+from src.api.search_filters import normalize_text
+
+AUTOCOMPLETE_TABLE = "autocomplete_nomes"
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_LENGTH = 100
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 20
+
+AUTOCOMPLETE_SQL = f"""
+    SELECT razao_social, cnpj_completo, uf, situacao_cadastral
+    FROM {AUTOCOMPLETE_TABLE}
+    WHERE nome_norm ~>=~ %s AND nome_norm ~<~ %s
+    ORDER BY nome_norm, cnpj_completo
+    LIMIT %s
+"""
+
+
+def normalize_prefix(text: Optional[str]) -> Optional[str]:
+    """
+    Mesma forma de nome_norm: minúsculas, sem acentos, espaços colapsados.
+    O espaço final é mantido ("sao " não casa "saopaulo"). None se curto demais.
+    """
+    if not text:
+        return None
+    trailing = text[-1:].isspace()
+    prefix = ' '.join(normalize_text(text).split())[:MAX_PREFIX_LENGTH]
+    if len(prefix) < MIN_PREFIX_LENGTH:
+        return None
+    return prefix + ' ' if trailing and len(prefix) < MAX_PREFIX_LENGTH else prefix
+
+
+def prefix_bounds(prefix: str) -> tuple[str, str]:
+    """[início, fim) da faixa de nome_norm que começa com `prefix`."""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def cache_key(prefix: str, limit: int) -> str:
+    return f"ac:{limit}:{prefix}"
+
+
+def rows_to_suggestions(rows) -> List[dict]:
+    return [
+        {'razao_social': razao_social, 'cnpj': cnpj, 'uf': uf, 'situacao_cadastral': situacao}
+        for razao_social, cnpj, uf, situacao in rows
+    ]
+
+
+async def fetch_suggestions(prefix: str, limit: int) -> List[dict]:
+    from src.database.async_connection import async_db_manager
+    start, end = prefix_bounds(prefix)
+    rows = await async_db_manager.fetchall(AUTOCOMPLETE_SQL, (start, end, limit))
+    return rows_to_suggestions(rows)
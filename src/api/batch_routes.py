@@ -6,13 +6,22 @@ Sistema de créditos e pacotes para buscas avançadas
 from fastapi import APIRouter, HTTPException, Query, Header, Depends
 from typing import Optional, List, Dict, Any
 from src.database.connection import db_manager
+from src.database.async_connection import async_db_manager
+from src.api.auth_cache import auth_cache, load_api_key_context
+from src.utils.security_utils import hash_api_key
 from src.api.models import PaginatedResponse, EstabelecimentoCompleto
 from src.api.auth import get_current_user
 from src.api.security_logger import log_query
 from src.api.rate_limiter import rate_limiter
 from src.api.plan_service import plan_service, require_feature
+from src.api.cache_redis import cache as shared_cache
+from src.api.search_rollup import build_rollup_conditions, exact_total
+from src.api.search_filters import build_search_conditions, build_tsquery, check_rank_offset, ranked_page_query
+from src.api.reference_registry import resolve_municipio_codigos
 from pydantic import BaseModel
+import hashlib
 import logging
+import os
 from datetime import datetime
 import json
 
@@ -74,7 +83,13 @@ async def verify_api_key_for_batch(x_api_key: str = Header(None)):
             detail="API Key não fornecida. Use o header 'X-API-Key'"
         )
 
-    user = await db_manager.verify_api_key(x_api_key)
+    # AUTH-1RT: mesmo contexto em cache usado pelos demais endpoints (routes.py)
+    key_hash = hash_api_key(x_api_key)
+    try:
+        user = await load_api_key_context(key_hash)
+    except Exception as e:
+        logger.error(f"Erro ao verificar API key (batch): {e}")
+        user = None
     if not user:
         raise HTTPException(
             status_code=401,
@@ -82,63 +97,44 @@ async def verify_api_key_for_batch(x_api_key: str = Header(None)):
         )
 
     # VERIFICAÇÃO DE ASSINATURA (mesma lógica dos endpoints em routes.py)
+    if user.get('sub_plan'):
+        user['plan'] = user['sub_plan']
+    else:
+        # Sem assinatura válida: verificar se há assinatura com pagamento pendente
+        if user.get('last_status') in ('past_due', 'unpaid'):
+            raise HTTPException(
+                status_code=402,
+                detail={
+                    "error": "payment_required",
+                    "message": "Sua assinatura está com pagamento pendente. Por favor, atualize suas informações de pagamento para continuar usando a API.",
+                    "action_url": "/subscription",
+                    "help": "Acesse a página de assinatura para atualizar seu método de pagamento",
+                    "suggestions": [
+                        "Atualize suas informações de pagamento",
+                        "Verifique se seu cartão não está expirado",
+                        "Entre em contato com o suporte se o problema persistir"
+                    ]
+                }
+            )
+
+        # Sem assinatura Stripe ativa: plano Free
+        user['plan'] = 'free'
+
+    # last_used/total_requests da key (lote não consome a cota mensal de consultas)
     try:
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute("""
-                    SELECT p.name
-                    FROM clientes.stripe_subscriptions ss
-                    JOIN clientes.plans p ON ss.plan_id = p.id
-                    WHERE ss.user_id = %s
-                        AND ss.current_period_end > NOW()
-                        AND ss.status IN ('active', 'trialing', 'canceled')
-                    ORDER BY ss.created_at DESC
-                    LIMIT 1
-                """, (user['id'],))
-                subscription = cursor.fetchone()
-
-                if subscription:
-                    user['plan'] = subscription[0]
-                else:
-                    # Sem assinatura válida: verificar se há assinatura com pagamento pendente
-                    cursor.execute("""
-                        SELECT ss.status
-                        FROM clientes.stripe_subscriptions ss
-                        WHERE ss.user_id = %s
-                        ORDER BY ss.created_at DESC
-                        LIMIT 1
-                    """, (user['id'],))
-                    any_subscription = cursor.fetchone()
-
-                    if any_subscription and any_subscription[0] in ('past_due', 'unpaid'):
-                        raise HTTPException(
-                            status_code=402,
-                            detail={
-                                "error": "payment_required",
-                                "message": "Sua assinatura está com pagamento pendente. Por favor, atualize suas informações de pagamento para continuar usando a API.",
-                                "action_url": "/subscription",
-                                "help": "Acesse a página de assinatura para atualizar seu método de pagamento",
-                                "suggestions": [
-                                    "Atualize suas informações de pagamento",
-                                    "Verifique se seu cartão não está expirado",
-                                    "Entre em contato com o suporte se o problema persistir"
-                                ]
-                            }
-                        )
-
-                    # Sem assinatura Stripe ativa: plano Free
-                    user['plan'] = 'free'
-            finally:
-                cursor.close()
-    except HTTPException:
-        raise
+        key_ok = await async_db_manager.touch_api_key(key_hash)
     except Exception as e:
         logger.error(f"Erro ao verificar assinatura (batch): {e}")
         raise HTTPException(
             status_code=500,
             detail="Erro ao verificar assinatura. Por favor, tente novamente."
         )
+    if not key_ok:
+        auth_cache.invalidate(key_hash)
+        raise HTTPException(
+            status_code=401,
+            detail="API Key inválida ou expirada"
+        )
 
     # Rate limiting com limites do plano (configuráveis no admin via clientes.plans)
     user_plan = user.get('plan', 'free')
@@ -167,15 +163,15 @@ async def get_user_batch_credits(user_id: int) -> Dict[str, Any]:
     idempotente — no máximo uma renovação por usuário por mês).
     """
     try:
-        with db_manager.get_connection() as conn:
+        async with async_db_manager.connection() as conn:
             cursor = conn.cursor()
             try:
-                cursor.execute("""
+                await cursor.execute("""
                     SELECT * FROM clientes.vw_user_batch_credits
                     WHERE user_id = %s
                 """, (user_id,))
 
-                result = cursor.fetchone()
+                result = await cursor.fetchone()
 
                 if not result:
                     return {
@@ -199,7 +195,7 @@ async def get_user_batch_credits(user_id: int) -> Dict[str, Any]:
                 #   ou se o plano passou a incluir mais créditos mensais (upgrade).
                 # Idempotente: chamadas repetidas no mesmo mês não concedem de novo.
                 if plan_monthly > 0:
-                    cursor.execute("""
+                    await cursor.execute("""
                         INSERT INTO clientes.batch_query_credits
                             (user_id, total_credits, used_credits, monthly_included_credits, purchased_credits, last_reset_at)
                         VALUES (%s, %s, 0, %s, 0, date_trunc('month', CURRENT_DATE))
@@ -216,11 +212,11 @@ async def get_user_batch_credits(user_id: int) -> Dict[str, Any]:
                     if cursor.rowcount > 0:
                         logger.info(f"✅ Créditos mensais de lote concedidos: user_id={user_id}, créditos={plan_monthly}")
                         # Reler a view para refletir os créditos recém-concedidos
-                        cursor.execute("""
+                        await cursor.execute("""
                             SELECT * FROM clientes.vw_user_batch_credits
                             WHERE user_id = %s
                         """, (user_id,))
-                        result = cursor.fetchone()
+                        result = await cursor.fetchone()
 
                 return {
                     'total_credits': result[4] or 0,
@@ -232,7 +228,7 @@ async def get_user_batch_credits(user_id: int) -> Dict[str, Any]:
                     'batch_queries_this_month': result[9] or 0
                 }
             finally:
-                cursor.close()
+                await cursor.close()
     except Exception as e:
         logger.error(f"Erro ao buscar créditos: {e}")
         return {
@@ -249,12 +245,73 @@ async def get_user_batch_credits(user_id: int) -> Dict[str, Any]:
 # ENDPOINTS - CONSULTAS EM LOTE
 # ============================================
 
+# Contagem do /batch/search: COUNT(*) exato na MV de ~72M linhas estoura o
+# statement_timeout (ver /search). Conta no máximo BATCH_COUNT_CAP linhas, com
+# timeout curto; acima disso o total é só um piso (total_is_lower_bound).
+BATCH_COUNT_CAP = int(os.getenv('BATCH_COUNT_CAP', '10000'))
+BATCH_COUNT_TIMEOUT_MS = int(os.getenv('BATCH_COUNT_TIMEOUT_MS', '5000'))
+
+
+async def count_batch_results(where_clause: str, params: list, rollup, cache_key: str):
+    """
+    (total, total_is_lower_bound) na ordem mais barata: rollup exato (filtros
+    só por igualdade) -> cache -> COUNT limitado. (None, True) se nem o COUNT
+    limitado coube no timeout.
+    """
+    async with async_db_manager.connection() as conn:
+        if rollup is not None:
+            total = await exact_total(conn, *rollup)
+            if total is not None:
+                return total, False
+
+        cached = shared_cache.get(cache_key)
+        if cached is not None:
+            return cached['total'], cached['lower_bound']
+
+        try:
+            async with conn.cursor() as cursor:
+                # SET LOCAL: vale só para esta transação (a da contagem)
+                await cursor.execute(f"SET LOCAL statement_timeout = {int(BATCH_COUNT_TIMEOUT_MS)}")
+                await cursor.execute(f"""
+                    SELECT count(*) FROM (
+                        SELECT 1 FROM vw_estabelecimentos_completos
+                        WHERE {where_clause}
+                        LIMIT %s
+                    ) capped
+                """, params + [BATCH_COUNT_CAP])
+                total = (await cursor.fetchone())[0]
+        except Exception as e:
+            logger.warning(f"Contagem limitada do batch falhou/expirou: {e}")
+            return None, True
+
+    result = {'total': total, 'lower_bound': total >= BATCH_COUNT_CAP}
+    # Sem invalidação própria: a chave vive no namespace g{geração}: do cache,
+    # e a carga seguinte (bump_generation) passa a ler/gravar em outro
+    shared_cache.set(cache_key, result, ttl_seconds=6 * 3600)
+    return result['total'], result['lower_bound']
+
+
+async def refund_batch_credits(user_id: int, credits: int):
+    """Estorno de uma reserva (falha depois de reservar). Não levanta: já há um erro a propagar."""
+    try:
+        await async_db_manager.execute("""
+            UPDATE clientes.batch_query_credits
+            SET used_credits = GREATEST(used_credits - %s, 0),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = %s
+        """, (credits, user_id))
+    except Exception as e:
+        logger.error(f"Falha ao estornar {credits} créditos do user_id={user_id}: {e}")
+
+
 @router.post("/search")
 async def batch_search_companies(
     razao_social: str = Query(None, description="Razão social da empresa"),
     nome_fantasia: str = Query(None, description="Nome fantasia da empresa"),
+    q: str = Query(None, description="Busca textual em razão social + nome fantasia (sem acentos, por relevância)"),
     cnae: str = Query(None, description="CNAE principal"),
-    cnae_secundario: str = Query(None, description="CNAE secundário"),
+    cnae_secundario: str = Query(None, description="CNAE secundário (um ou vários, separados por vírgula)"),
+    cnae_qualquer: str = Query(None, description="CNAE principal OU secundário (um ou vários, separados por vírgula)"),
     uf: str = Query(None, description="UF"),
     municipio: str = Query(None, description="Nome do município ou código IBGE"),
     situacao_cadastral: str = Query(None, description="Situação cadastral"),
@@ -283,7 +340,8 @@ async def batch_search_companies(
     
     **Filtros Disponíveis**:
     - Razão social e nome fantasia
-    - CNAE principal e secundário  
+    - Busca textual `q` (sem acentos, resultados por relevância)
+    - CNAE principal e secundário (listas; `cnae_qualquer` = principal OU secundário)
     - Localização (UF, município, CEP, bairro, logradouro)
     - Situação cadastral
     - Data de início de atividade
@@ -316,292 +374,264 @@ async def batch_search_companies(
                 }
             )
         
-        # Construir query dinâmica
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-
-            conditions = []
-            params = []
-            
-            if razao_social:
-                conditions.append("razao_social ILIKE %s")
-                params.append(f"%{razao_social}%")
-            
-            if nome_fantasia:
-                conditions.append("nome_fantasia ILIKE %s")
-                params.append(f"%{nome_fantasia}%")
-            
-            if cnae:
-                conditions.append("cnae_fiscal_principal = %s")
-                params.append(cnae)
-            
-            if cnae_secundario:
-                conditions.append("cnae_fiscal_secundaria LIKE %s")
-                params.append(f"%{cnae_secundario}%")
-            
-            if uf:
-                conditions.append("uf = %s")
-                params.append(uf.upper())
-            
-            if municipio:
-                # A MV não tem a coluna 'municipio' (código): usar municipio_desc.
-                # Aceita nome (ILIKE) ou código IBGE (resolve a descrição), como em /search.
-                municipio_clean = municipio.strip()
-                if municipio_clean.isdigit():
-                    conditions.append("municipio_desc = (SELECT descricao FROM municipios WHERE codigo = %s LIMIT 1)")
-                    params.append(municipio_clean)
-                else:
-                    conditions.append("municipio_desc ILIKE %s")
-                    params.append(f"%{municipio_clean}%")
-            
-            if situacao_cadastral:
-                conditions.append("situacao_cadastral = %s")
-                params.append(situacao_cadastral)
-            
-            if data_inicio_atividade_min:
-                try:
-                    datetime.strptime(data_inicio_atividade_min, '%Y-%m-%d')
-                    conditions.append("data_inicio_atividade >= %s")
-                    params.append(data_inicio_atividade_min)
-                except ValueError:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="data_inicio_atividade_min deve estar no formato YYYY-MM-DD"
-                    )
-            
-            if data_inicio_atividade_max:
-                try:
-                    datetime.strptime(data_inicio_atividade_max, '%Y-%m-%d')
-                    conditions.append("data_inicio_atividade <= %s")
-                    params.append(data_inicio_atividade_max)
-                except ValueError:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="data_inicio_atividade_max deve estar no formato YYYY-MM-DD"
-                    )
-            
-            if porte:
-                conditions.append("porte_empresa = %s")
-                params.append(porte)
-            
-            if identificador_matriz_filial:
-                conditions.append("identificador_matriz_filial = %s")
-                params.append(identificador_matriz_filial)
-            
-            if simples:
-                conditions.append("opcao_simples = %s")
-                params.append(simples.upper())
-            
-            if mei:
-                conditions.append("opcao_mei = %s")
-                params.append(mei.upper())
-            
-            if cep:
-                conditions.append("cep LIKE %s")
-                params.append(f"{cep}%")
-            
-            if bairro:
-                conditions.append("bairro ILIKE %s")
-                params.append(f"%{bairro}%")
-            
-            if logradouro:
-                conditions.append("logradouro ILIKE %s")
-                params.append(f"%{logradouro}%")
-            
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
+        # Construir filtros (nenhuma conexão aberta ainda): os mesmos do /search,
+        # pelo construtor compartilhado, + os filtros exclusivos do lote
+        municipio_codigos = await resolve_municipio_codigos(municipio)
+        conditions, params = build_search_conditions(
+            razao_social, nome_fantasia, cnae, municipio, uf, situacao_cadastral,
+            data_inicio_atividade_min, data_inicio_atividade_max,
+            q=q, cnae_secundario=cnae_secundario, cnae_qualquer=cnae_qualquer,
+            municipio_codigos=municipio_codigos,
+        )
+        tsquery = build_tsquery(q)  # já validado por build_search_conditions; None sem q
+        if tsquery is not None:
+            check_rank_offset(offset)
 
-            # COBRAR ANTES da query cara: reserva atômica de 'limit' créditos
-            # (máximo que esta página pode retornar). Se não houver saldo,
-            # retorna 402 SEM executar COUNT/busca. O excedente é estornado
-            # após a busca, na MESMA transação (rollback automático em erro).
-            cursor.execute("""
-                UPDATE clientes.batch_query_credits
-                SET used_credits = used_credits + %s,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = %s
-                  AND (total_credits - used_credits) >= %s
-                RETURNING available_credits
-            """, (limit, user['id'], limit))
-            reservation = cursor.fetchone()
+        if porte:
+            conditions.append("porte_empresa = %s")
+            params.append(porte)
+        
+        if identificador_matriz_filial:
+            conditions.append("identificador_matriz_filial = %s")
+            params.append(identificador_matriz_filial)
+        
+        if simples:
+            conditions.append("opcao_simples = %s")
+            params.append(simples.upper())
+        
+        if mei:
+            conditions.append("opcao_mei = %s")
+            params.append(mei.upper())
+        
+        if cep:
+            conditions.append("cep LIKE %s")
+            params.append(f"{cep}%")
+        
+        if bairro:
+            conditions.append("bairro ILIKE %s")
+            params.append(f"%{bairro}%")
+        
+        if logradouro:
+            conditions.append("logradouro ILIKE %s")
+            params.append(f"%{logradouro}%")
+        
+        where_clause = " AND ".join(conditions) if conditions else "1=1"
+
+        filters_used = {
+            'razao_social': razao_social,
+            'nome_fantasia': nome_fantasia,
+            'q': q,
+            'cnae': cnae,
+            'cnae_secundario': cnae_secundario,
+            'cnae_qualquer': cnae_qualquer,
+            'uf': uf,
+            'municipio': municipio,
+            'situacao_cadastral': situacao_cadastral,
+            'data_inicio_atividade_min': data_inicio_atividade_min,
+            'data_inicio_atividade_max': data_inicio_atividade_max,
+            'porte': porte,
+            'identificador_matriz_filial': identificador_matriz_filial,
+            'simples': simples,
+            'mei': mei,
+            'cep': cep,
+            'bairro': bairro,
+            'logradouro': logradouro,
+            'limit': limit,
+            'offset': offset
+        }
 
-            if not reservation:
-                cursor.close()
-                raise HTTPException(
-                    status_code=402,
-                    detail={
-                        "error": "insufficient_batch_credits",
-                        "message": f"Você precisa de {limit} créditos, mas tem apenas {available_credits} disponíveis.",
-                        "action_url": "/batch/packages",
-                        "help": "Adquira mais créditos para continuar",
-                        "credits_needed": limit,
-                        "credits_available": available_credits,
-                        "suggestions": [
-                            f"Compre um pacote de consultas em lote (+{limit} créditos)",
-                            "Reduza o número de resultados por página (use o parâmetro 'limit')",
-                            "Faça upgrade do seu plano"
-                        ]
-                    }
-                )
+        # Contagem exata pelo rollup só se TODOS os filtros forem de igualdade nele
+        rollup = None
+        if not (identificador_matriz_filial or cep or bairro or logradouro):
+            rollup = build_rollup_conditions(
+                razao_social, nome_fantasia, cnae, municipio, uf, situacao_cadastral,
+                data_inicio_atividade_min, data_inicio_atividade_max,
+                porte=porte, opcao_simples=simples, opcao_mei=mei, q=q,
+                cnae_secundario=cnae_secundario, cnae_qualquer=cnae_qualquer,
+                municipio_codigos=municipio_codigos,
+            )
 
-            # COUNT exato para empresas
-            count_query = f"""
-                SELECT COUNT(*)
-                FROM vw_estabelecimentos_completos
-                WHERE {where_clause}
-            """
-            cursor.execute(count_query, params)
-            total_result = cursor.fetchone()
-            total = total_result[0] if total_result else 0
-
-            # Verificar se há resultados para retornar
-            if total == 0:
-                # Estornar a reserva integralmente (nenhum resultado retornado)
-                cursor.execute("""
+        # 1) COBRAR ANTES da query cara: reserva atômica de 'limit' créditos
+        # (máximo que esta página pode retornar) numa transação CURTA, já
+        # commitada — a linha de créditos do usuário não fica travada durante
+        # a contagem/busca. Sem saldo => 402 SEM executar contagem/busca.
+        async with async_db_manager.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("""
                     UPDATE clientes.batch_query_credits
-                    SET used_credits = GREATEST(used_credits - %s, 0),
+                    SET used_credits = used_credits + %s,
                         updated_at = CURRENT_TIMESTAMP
                     WHERE user_id = %s
-                """, (limit, user['id']))
-                cursor.close()
-                return PaginatedResponse(
-                    total=0,
-                    page=offset // limit + 1,
-                    per_page=limit,
-                    total_pages=0,
-                    items=[]
-                )
+                      AND (total_credits - used_credits) >= %s
+                    RETURNING available_credits
+                """, (limit, user['id'], limit))
+                reservation = await cursor.fetchone()
 
-            # Buscar dados
-            data_query = f"""
-                SELECT 
-                    cnpj_completo, identificador_matriz_filial, razao_social,
-                    nome_fantasia, situacao_cadastral, data_situacao_cadastral,
-                    data_inicio_atividade, cnae_fiscal_principal, cnae_principal_desc,
-                    tipo_logradouro, logradouro, numero, complemento, bairro,
-                    cep, uf, municipio_desc, ddd_1, telefone_1,
-                    correio_eletronico, porte_empresa, capital_social,
-                    opcao_simples, opcao_mei
-                FROM vw_estabelecimentos_completos
-                WHERE {where_clause}
-                ORDER BY razao_social
-                LIMIT %s OFFSET %s
-            """
-            
-            cursor.execute(data_query, params + [limit, offset])
-            results = cursor.fetchall()
+        if not reservation:
+            raise HTTPException(
+                status_code=402,
+                detail={
+                    "error": "insufficient_batch_credits",
+                    "message": f"Você precisa de {limit} créditos, mas tem apenas {available_credits} disponíveis.",
+                    "action_url": "/batch/packages",
+                    "help": "Adquira mais créditos para continuar",
+                    "credits_needed": limit,
+                    "credits_available": available_credits,
+                    "suggestions": [
+                        f"Compre um pacote de consultas em lote (+{limit} créditos)",
+                        "Reduza o número de resultados por página (use o parâmetro 'limit')",
+                        "Faça upgrade do seu plano"
+                    ]
+                }
+            )
 
-            columns = [
-                'cnpj_completo', 'identificador_matriz_filial', 'razao_social',
-                'nome_fantasia', 'situacao_cadastral', 'data_situacao_cadastral',
-                'data_inicio_atividade', 'cnae_fiscal_principal', 'cnae_principal_desc',
-                'tipo_logradouro', 'logradouro', 'numero', 'complemento', 'bairro',
-                'cep', 'uf', 'municipio_desc', 'ddd_1', 'telefone_1',
-                'correio_eletronico', 'porte_empresa', 'capital_social',
-                'opcao_simples', 'opcao_mei'
-            ]
-            
-            items = []
-            for row in results:
-                data = dict(zip(columns, row))
-                cnpj = data['cnpj_completo']
-                data['cnpj_basico'] = cnpj[:8] if cnpj else ''
-                data['cnpj_ordem'] = cnpj[8:12] if cnpj and len(cnpj) >= 12 else ''
-                data['cnpj_dv'] = cnpj[12:14] if cnpj and len(cnpj) >= 14 else ''
-                
-                if data.get('data_situacao_cadastral'):
-                    data['data_situacao_cadastral'] = str(data['data_situacao_cadastral'])
-                if data.get('data_inicio_atividade'):
-                    data['data_inicio_atividade'] = str(data['data_inicio_atividade'])
-                
-                # Não buscar CNAEs secundários em batch para performance
-                data['cnae_secundarios_completos'] = []
-                
-                items.append(EstabelecimentoCompleto(**data))
-            
-            # COBRAR CRÉDITOS - Apenas pelos resultados retornados:
-            # estorna a diferença entre a reserva ('limit') e o efetivamente retornado
-            credits_to_consume = len(items)
-            refund = limit - credits_to_consume
-            if refund > 0:
-                cursor.execute("""
-                    UPDATE clientes.batch_query_credits
-                    SET used_credits = GREATEST(used_credits - %s, 0),
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE user_id = %s
-                """, (refund, user['id']))
-
-            # Registrar filtros usados para auditoria
-            filters_used = {
-                'razao_social': razao_social,
-                'nome_fantasia': nome_fantasia,
-                'cnae': cnae,
-                'cnae_secundario': cnae_secundario,
-                'uf': uf,
-                'municipio': municipio,
-                'situacao_cadastral': situacao_cadastral,
-                'data_inicio_atividade_min': data_inicio_atividade_min,
-                'data_inicio_atividade_max': data_inicio_atividade_max,
-                'porte': porte,
-                'identificador_matriz_filial': identificador_matriz_filial,
-                'simples': simples,
-                'mei': mei,
-                'cep': cep,
-                'bairro': bairro,
-                'logradouro': logradouro,
-                'limit': limit,
-                'offset': offset
+        # 2) Contagem + página, fora da transação da reserva. Qualquer falha
+        # daqui em diante estorna a reserva inteira.
+        try:
+            count_key = "search:batchcount:" + hashlib.md5(
+                json.dumps([where_clause, params], default=str).encode()
+            ).hexdigest()
+            total, total_is_lower_bound = await count_batch_results(
+                where_clause, params, rollup, count_key
+            )
+
+            results = []
+            if total != 0:
+                select_cols = """
+                        cnpj_completo, identificador_matriz_filial, razao_social,
+                        nome_fantasia, situacao_cadastral, data_situacao_cadastral,
+                        data_inicio_atividade, cnae_fiscal_principal, cnae_principal_desc,
+                        tipo_logradouro, logradouro, numero, complemento, bairro,
+                        cep, uf, municipio_desc, ddd_1, telefone_1,
+                        correio_eletronico, porte_empresa, capital_social,
+                        opcao_simples, opcao_mei
+                """
+                if tsquery is not None:
+                    # Busca textual: ordenada por relevância (ver ranked_page_query)
+                    data_query = ranked_page_query(select_cols, where_clause)
+                    data_params = [tsquery] + params + [limit, offset]
+                else:
+                    data_query = f"""
+                        SELECT {select_cols}
+                        FROM vw_estabelecimentos_completos
+                        WHERE {where_clause}
+                        ORDER BY razao_social
+                        LIMIT %s OFFSET %s
+                    """
+                    data_params = params + [limit, offset]
+                async with async_db_manager.connection() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(data_query, data_params)
+                        results = await cursor.fetchall()
+        except Exception:
+            await refund_batch_credits(user['id'], limit)
+            raise
+
+        columns = [
+            'cnpj_completo', 'identificador_matriz_filial', 'razao_social',
+            'nome_fantasia', 'situacao_cadastral', 'data_situacao_cadastral',
+            'data_inicio_atividade', 'cnae_fiscal_principal', 'cnae_principal_desc',
+            'tipo_logradouro', 'logradouro', 'numero', 'complemento', 'bairro',
+            'cep', 'uf', 'municipio_desc', 'ddd_1', 'telefone_1',
+            'correio_eletronico', 'porte_empresa', 'capital_social',
+            'opcao_simples', 'opcao_mei'
+        ]
+
+        items = []
+        for row in results:
+            data = dict(zip(columns, row))
+            cnpj = data['cnpj_completo']
+            data['cnpj_basico'] = cnpj[:8] if cnpj else ''
+            data['cnpj_ordem'] = cnpj[8:12] if cnpj and len(cnpj) >= 12 else ''
+            data['cnpj_dv'] = cnpj[12:14] if cnpj and len(cnpj) >= 14 else ''
+
+            if data.get('data_situacao_cadastral'):
+                data['data_situacao_cadastral'] = str(data['data_situacao_cadastral'])
+            if data.get('data_inicio_atividade'):
+                data['data_inicio_atividade'] = str(data['data_inicio_atividade'])
+
+            # Não buscar CNAEs secundários em batch para performance
+            data['cnae_secundarios_completos'] = []
+
+            items.append(EstabelecimentoCompleto(**data))
+
+        if total is None:
+            # Nem a contagem limitada coube no timeout: o piso é o que já se sabe
+            total = offset + len(items) + (1 if len(items) == limit else 0)
+            total_is_lower_bound = True
+        elif total_is_lower_bound:
+            # O teto não considera o offset: a página atual já prova mais linhas
+            total = max(total, offset + len(items))
+
+        # 3) LIQUIDAÇÃO numa transação curta: estorna a diferença entre a
+        # reserva ('limit') e o efetivamente retornado + registros de uso.
+        # Se falhar, estorna a reserva inteira (a página não é entregue).
+        credits_to_consume = len(items)
+        refund = limit - credits_to_consume
+        try:
+            async with async_db_manager.connection() as conn:
+                async with conn.cursor() as cursor:
+                    if refund > 0:
+                        await cursor.execute("""
+                            UPDATE clientes.batch_query_credits
+                            SET used_credits = GREATEST(used_credits - %s, 0),
+                                updated_at = CURRENT_TIMESTAMP
+                            WHERE user_id = %s
+                        """, (refund, user['id']))
+
+                    # Registrar uso para auditoria (mesma transação do estorno:
+                    # se algo falhar, estorno e registro são revertidos juntos)
+                    if credits_to_consume > 0:
+                        await cursor.execute("""
+                            INSERT INTO clientes.batch_query_usage (
+                                user_id, api_key_id, credits_used, filters_used, results_returned, endpoint
+                            ) VALUES (%s, %s, %s, %s, %s, %s)
+                        """, (
+                            user['id'],
+                            None,  # api_key_id - TODO: pegar do header
+                            credits_to_consume,
+                            json.dumps(filters_used),
+                            len(items),
+                            '/batch/search'
+                        ))
+
+                        await cursor.execute("""
+                            INSERT INTO clientes.monthly_usage (user_id, month_year, batch_queries_used)
+                            VALUES (%s, TO_CHAR(CURRENT_DATE, 'YYYY-MM'), %s)
+                            ON CONFLICT (user_id, month_year)
+                            DO UPDATE SET batch_queries_used = COALESCE(clientes.monthly_usage.batch_queries_used, 0) + EXCLUDED.batch_queries_used
+                        """, (user['id'], credits_to_consume))
+        except Exception:
+            await refund_batch_credits(user['id'], limit)
+            raise
+
+        # Log de auditoria
+        await log_query(
+            user_id=user['id'],
+            action='batch_search',
+            resource='/batch/search',
+            details={
+                'filters': filters_used,
+                'results_returned': len(items),
+                'credits_consumed': credits_to_consume,
+                'total_found': total,
+                'total_is_lower_bound': total_is_lower_bound
             }
-            
-            # Registrar uso para auditoria (mesma transação da cobrança:
-            # se algo falhar, cobrança e registro são revertidos juntos)
-            if credits_to_consume > 0:
-                cursor.execute("""
-                    INSERT INTO clientes.batch_query_usage (
-                        user_id, api_key_id, credits_used, filters_used, results_returned, endpoint
-                    ) VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    user['id'],
-                    None,  # api_key_id - TODO: pegar do header
-                    credits_to_consume,
-                    json.dumps(filters_used),
-                    len(items),
-                    '/batch/search'
-                ))
+        )
 
-                cursor.execute("""
-                    INSERT INTO clientes.monthly_usage (user_id, month_year, batch_queries_used)
-                    VALUES (%s, TO_CHAR(CURRENT_DATE, 'YYYY-MM'), %s)
-                    ON CONFLICT (user_id, month_year)
-                    DO UPDATE SET batch_queries_used = COALESCE(clientes.monthly_usage.batch_queries_used, 0) + EXCLUDED.batch_queries_used
-                """, (user['id'], credits_to_consume))
+        total_pages = (total + limit - 1) // limit
 
-            cursor.close()
+        logger.info(f"✅ Busca em lote: user_id={user['id']}, resultados={len(items)}, créditos consumidos={credits_to_consume}")
+
+        return PaginatedResponse(
+            total=total,
+            page=offset // limit + 1,
+            per_page=limit,
+            total_pages=total_pages,
+            items=items,
+            total_is_lower_bound=total_is_lower_bound
+        )
 
-            # Log de auditoria
-            await log_query(
-                user_id=user['id'],
-                action='batch_search',
-                resource='/batch/search',
-                details={
-                    'filters': filters_used,
-                    'results_returned': len(items),
-                    'credits_consumed': credits_to_consume,
-                    'total_found': total
-                }
-            )
-            
-            total_pages = (total + limit - 1) // limit
-            
-            logger.info(f"✅ Busca em lote: user_id={user['id']}, resultados={len(items)}, créditos consumidos={credits_to_consume}")
-            
-            return PaginatedResponse(
-                total=total,
-                page=offset // limit + 1,
-                per_page=limit,
-                total_pages=total_pages,
-                items=items
-            )
-    
     except HTTPException:
         raise
     except Exception as e:
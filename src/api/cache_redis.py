@@ -1,20 +1,98 @@
 """
 Sistema de Cache Redis Otimizado
 Para uso em produção com alta performance
+
+Geração do dataset: toda chave de get/set/get_many/... (e os locks) ganha o
+prefixo `g{geração}:`. Invalidar o cache após uma carga é UM INCR em
+cache:generation (bump_generation): os workers passam a ler/gravar no
+namespace novo em até GENERATION_CHECK_INTERVAL segundos e as chaves da
+geração antiga expiram sozinhas pelo TTL. Nada de KEYS/DEL em massa.
+
+Um miss lento pode atravessar o INCR: o valor foi lido da carga anterior e
+não pode ir para o namespace novo. Quem carrega do banco fixa a geração ANTES
+da leitura (pinned_generation, usado pelo SingleFlight): dentro do bloco as
+chaves usam a geração fixada e set/set_many descartam a gravação se a
+geração atual já é outra.
+
+Codificação dos valores (1º byte = formato):
+- b'J' + gzip(JSON)  — valores comuns (dicts, listas, modelos Pydantic)
+- b'B' + gzip(JSON)  — CachedBody: o corpo JSON FINAL de uma resposta. Num hit
+  vai direto para o cliente com Content-Encoding: gzip, sem desserializar,
+  re-serializar nem recomprimir.
+Qualquer outro prefixo (ex.: o antigo zlib(pickle), que nenhuma chave g{n}:
+pode ter) é tratado como miss — nunca pickle.loads em dado do cache.
 """
 
 import redis
+import gzip
 import json
 import logging
 import hashlib
-from typing import Any, Optional
-from datetime import timedelta
+import os
+from typing import Any, Dict, Iterable, Optional
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 from functools import wraps
-import pickle
-import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from src.api.local_cache import GENERATION_CHECK_INTERVAL, LocalCache
 
 logger = logging.getLogger(__name__)
 
+_TAG_JSON = b'J'
+# Geração do dataset: incrementada pelo ETL a cada carga (ver cabeçalho)
+GENERATION_KEY = "cache:generation"
+# delete_pattern: SCAN/UNLINK em lotes (nunca KEYS, que trava o Redis)
+SCAN_BATCH = 1000
+_TAG_BODY = b'B'
+# Geração fixada pelo carregamento em andamento nesta task (pinned_generation)
+_pinned_generation: ContextVar[Optional[str]] = ContextVar('cache_pinned_generation', default=None)
+# 6: página de 1.000 linhas ~8% maior que pickle+zlib com custo de miss quase
+# igual ao nível 1 (scripts/bench_cache_codec.py); 9 triplica o custo do miss
+CACHE_GZIP_LEVEL = int(os.getenv('CACHE_GZIP_LEVEL', '6'))
+
+
+def _json_default(obj):
+    if hasattr(obj, 'model_dump'):  # Pydantic v2
+        return obj.model_dump(mode='json')
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"{type(obj).__name__} não é serializável em JSON")
+
+
+def encode_json(value: Any) -> bytes:
+    """JSON compacto em UTF-8 (mesmo formato do JSONResponse do FastAPI)."""
+    return json.dumps(
+        value, default=_json_default, ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8')
+
+
+class CachedBody:
+    """
+    Corpo JSON final de uma resposta, já em gzip. Guardado e lido do Redis
+    como está; as rotas devolvem `gzipped` num Response cru.
+    """
+    __slots__ = ('gzipped',)
+
+    def __init__(self, gzipped: bytes):
+        self.gzipped = gzipped
+
+    @classmethod
+    def from_value(cls, value: Any) -> 'CachedBody':
+        return cls(gzip.compress(encode_json(value), compresslevel=CACHE_GZIP_LEVEL, mtime=0))
+
+    def body(self) -> bytes:
+        """JSON sem compressão (cliente sem Accept-Encoding: gzip)."""
+        return gzip.decompress(self.gzipped)
+
+    def value(self) -> Any:
+        return json.loads(self.body())
+
 class RedisCache:
     """
     Cache Redis com compressão e serialização otimizada
@@ -32,7 +110,10 @@ class RedisCache:
         e RECONECTA automaticamente (um blip no boot não desliga o cache para sempre).
         """
         self._conn_params = dict(url=url, host=host, port=port, db=db, password=password)
-        self._memory_cache = {}
+        # Fallback em memória: LRU limitado (não apaga tudo ao encher)
+        self._memory = LocalCache(max_entries=self._MEMORY_CACHE_MAX_KEYS, max_ttl=None)
+        self._generation: Optional[str] = None
+        self._generation_expires = 0.0
         self._next_reconnect = 0.0
         self.redis_client = None
         self.enabled = False
@@ -78,10 +159,70 @@ class RedisCache:
         if not self.enabled and _time.time() >= self._next_reconnect:
             self._try_connect()
 
-    def _memory_set(self, key, value):
-        if len(self._memory_cache) >= self._MEMORY_CACHE_MAX_KEYS:
-            self._memory_cache.clear()  # descarte simples: cache é descartável
-        self._memory_cache[key] = value
+    def _memory_set(self, key, value, ttl_seconds=3600):
+        self._memory.set(key, value, ttl_seconds)
+
+    def generation(self) -> Optional[str]:
+        """
+        Geração atual do dataset ('0' se nunca incrementada); None sem Redis.
+        Relida do Redis no máximo a cada GENERATION_CHECK_INTERVAL segundos.
+        """
+        import time as _time
+        if not self.enabled:
+            return None
+        now = _time.monotonic()
+        if self._generation is not None and now < self._generation_expires:
+            return self._generation
+        try:
+            value = self.redis_client.get(GENERATION_KEY)
+            self._generation = value.decode() if value is not None else '0'
+            self._generation_expires = now + GENERATION_CHECK_INTERVAL
+        except Exception as e:
+            logger.error(f"Erro ao ler geração do cache: {e}")
+        return self._generation
+
+    def bump_generation(self) -> Optional[int]:
+        """
+        Nova carga no banco: invalida TODO o cache de dados num INCR atômico.
+        Workers trocam de namespace (e descartam o L1) em segundos.
+        """
+        import time as _time
+        self._maybe_reconnect()
+        if not self.enabled:
+            self._memory.clear()
+            return None
+        try:
+            generation = int(self.redis_client.incr(GENERATION_KEY))
+            self._generation = str(generation)
+            self._generation_expires = _time.monotonic() + GENERATION_CHECK_INTERVAL
+            return generation
+        except Exception as e:
+            logger.error(f"Erro ao incrementar geração do cache: {e}")
+            return None
+
+    @contextmanager
+    def pinned_generation(self):
+        """
+        Fixa a geração atual para o bloco (leitura do banco + gravação do
+        resultado): as chaves usam essa geração mesmo que o ETL a incremente
+        no meio, e gravações feitas depois do INCR são descartadas
+        (generation_changed).
+        """
+        token = _pinned_generation.set(self.generation())
+        try:
+            yield
+        finally:
+            _pinned_generation.reset(token)
+
+    def generation_changed(self) -> bool:
+        """True se o bloco pinned_generation em andamento é de uma geração que já passou."""
+        pinned = _pinned_generation.get()
+        return pinned is not None and pinned != self.generation()
+
+    def _ns(self, key: str) -> str:
+        """Chave no namespace da geração fixada (pinned_generation) ou da atual."""
+        generation = _pinned_generation.get() or self.generation()
+        return f"g{generation}:{key}" if generation is not None else key
 
     # Lua: INCR e define EXPIRE só na PRIMEIRA requisição da janela. Evita renovar
     # o TTL a cada chamada (que causaria lockout permanente sob tráfego — RL-01).
@@ -91,6 +232,30 @@ class RedisCache:
         "return c"
     )
 
+    _RELEASE_LOCK_LUA = (
+        "if redis.call('GET', KEYS[1]) == ARGV[1] then "
+        "return redis.call('DEL', KEYS[1]) end return 0"
+    )
+
+    def acquire_lock(self, key: str, token: str, ttl_ms: int) -> Optional[bool]:
+        """
+        Lock curto entre workers (SET NX PX). True/False; None sem Redis
+        (o chamador segue sem lock).
+        """
+        self._maybe_reconnect()
+        if not self.enabled:
+            return None
+        try:
+            return bool(self.redis_client.set(self._ns(key), token, nx=True, px=ttl_ms))
+        except Exception as e:
+            logger.error(f"Erro ao obter lock no Redis: {e}")
+            return None
+
+    def release_lock(self, key: str, token: str):
+        """Solta o lock só se ainda for nosso (pode ter expirado e sido pego por outro)."""
+        if self.eval_script(self._RELEASE_LOCK_LUA, [self._ns(key)], [token]) is None:
+            logger.debug(f"Lock {key} não liberado (Redis indisponível); expira sozinho")
+
     def incr_rate(self, key: str, window_seconds: int) -> int:
         """
         Contador atômico para rate limiting, compartilhado entre TODOS os workers.
@@ -107,6 +272,59 @@ class RedisCache:
             logger.error(f"Erro no incr_rate: {e}")
             return -1
     
+    def zincr(self, key: str, member: str, amount: float = 1, ttl_seconds: int = 0) -> bool:
+        """
+        ZINCRBY (+ EXPIRE) num único round trip. Fora do namespace da geração:
+        contadores de acesso sobrevivem às cargas. False sem Redis.
+        """
+        if not self.enabled:
+            return False
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.zincrby(key, amount, member)
+            if ttl_seconds:
+                pipe.expire(key, ttl_seconds)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Erro no zincr: {e}")
+            return False
+
+    def ztop(self, key: str, n: int) -> list:
+        """Os `n` membros de maior score (ZREVRANGE), como str; [] sem Redis."""
+        if not self.enabled or n <= 0:
+            return []
+        try:
+            return [m.decode() if isinstance(m, bytes) else m
+                    for m in self.redis_client.zrevrange(key, 0, n - 1)]
+        except Exception as e:
+            logger.error(f"Erro no ztop: {e}")
+            return []
+
+    def ztrim(self, key: str, keep: int) -> int:
+        """Mantém só os `keep` membros de maior score. Retorna quantos removeu."""
+        if not self.enabled:
+            return 0
+        try:
+            return int(self.redis_client.zremrangebyrank(key, 0, -keep - 1))
+        except Exception as e:
+            logger.error(f"Erro no ztrim: {e}")
+            return 0
+
+    def eval_script(self, script: str, keys: list, args: list):
+        """
+        Executa um script Lua (operações atômicas multi-chave, ex.: cota/contadores).
+        Retorna None se o Redis estiver indisponível ou falhar — o chamador decide o fallback.
+        """
+        self._maybe_reconnect()
+        if not self.enabled:
+            return None
+        try:
+            return self.redis_client.eval(script, len(keys), *keys, *args)
+        except Exception as e:
+            logger.error(f"Erro no eval_script: {e}")
+            return None
+
     def _generate_key(self, prefix: str, *args, **kwargs) -> str:
         """
         Gera chave única baseada nos parâmetros
@@ -119,14 +337,12 @@ class RedisCache:
     
     def _compress(self, data: Any) -> bytes:
         """
-        Comprime dados usando zlib (reduz uso de memória em 70-90%)
+        Serializa em JSON + gzip (ver cabeçalho do módulo)
         """
         try:
-            # Serializar com pickle (suporta qualquer tipo Python)
-            pickled = pickle.dumps(data)
-            # Comprimir com zlib
-            compressed = zlib.compress(pickled, level=6)
-            return compressed
+            if isinstance(data, CachedBody):
+                return _TAG_BODY + data.gzipped
+            return _TAG_JSON + gzip.compress(encode_json(data), compresslevel=CACHE_GZIP_LEVEL)
         except Exception as e:
             logger.error(f"Erro ao comprimir dados: {e}")
             return None
@@ -136,11 +352,13 @@ class RedisCache:
         Descomprime dados
         """
         try:
-            # Descomprimir
-            decompressed = zlib.decompress(data)
-            # Desserializar
-            unpickled = pickle.loads(decompressed)
-            return unpickled
+            tag = data[:1]
+            if tag == _TAG_BODY:
+                return CachedBody(data[1:])
+            if tag == _TAG_JSON:
+                return json.loads(gzip.decompress(data[1:]))
+            logger.warning("Valor do cache em formato desconhecido: tratado como miss")
+            return None
         except Exception as e:
             logger.error(f"Erro ao descomprimir dados: {e}")
             return None
@@ -152,10 +370,10 @@ class RedisCache:
         self._maybe_reconnect()
         if not self.enabled:
             # Fallback: memória
-            return self._memory_cache.get(key)
+            return self._memory.get(key)
         
         try:
-            data = self.redis_client.get(key)
+            data = self.redis_client.get(self._ns(key))
             if data is None:
                 return None
             
@@ -171,9 +389,12 @@ class RedisCache:
         """
         self._maybe_reconnect()
         if not self.enabled:
-            # Fallback: memória (sem TTL automático, com teto de chaves)
-            self._memory_set(key, value)
+            # Fallback: memória (LRU com teto de chaves e bytes)
+            self._memory_set(key, value, ttl_seconds)
             return True
+        if self.generation_changed():
+            logger.debug(f"Geração mudou durante a carga de {key}: gravação descartada")
+            return False
         
         try:
             # Comprimir dados
@@ -183,7 +404,7 @@ class RedisCache:
             
             # Salvar no Redis com TTL
             self.redis_client.setex(
-                name=key,
+                name=self._ns(key),
                 time=ttl_seconds,
                 value=compressed
             )
@@ -192,16 +413,88 @@ class RedisCache:
             logger.error(f"Erro ao salvar no Redis: {e}")
             return False
     
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Busca várias chaves em UM round trip (MGET).
+        Retorna {chave: valor} só das chaves presentes.
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+        self._maybe_reconnect()
+        if not self.enabled:
+            found = {k: self._memory.get(k) for k in keys}
+            return {k: v for k, v in found.items() if v is not None}
+
+        try:
+            found = {}
+            for key, data in zip(keys, self.redis_client.mget([self._ns(k) for k in keys])):
+                if data is not None:
+                    value = self._decompress(data)
+                    if value is not None:
+                        found[key] = value
+            return found
+        except Exception as e:
+            logger.error(f"Erro no MGET do Redis: {e}")
+            return {}
+
+    def set_many(self, mapping: Dict[str, Any], ttl_seconds: int = 3600,
+                 ttls: Optional[Dict[str, int]] = None) -> bool:
+        """
+        Salva várias chaves num único pipeline (UM round trip).
+        `ttls` sobrescreve o TTL por chave ({chave: segundos}).
+        """
+        if not mapping:
+            return True
+        self._maybe_reconnect()
+        if not self.enabled:
+            for key, value in mapping.items():
+                self._memory_set(key, value, (ttls or {}).get(key, ttl_seconds))
+            return True
+        if self.generation_changed():
+            logger.debug(f"Geração mudou durante a carga: {len(mapping)} gravações descartadas")
+            return False
+
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, value in mapping.items():
+                compressed = self._compress(value)
+                if compressed is None:
+                    return False
+                ttl = (ttls or {}).get(key, ttl_seconds)
+                pipe.setex(name=self._ns(key), time=ttl, value=compressed)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Erro no pipeline do Redis: {e}")
+            return False
+
+    def delete_many(self, keys: Iterable[str]) -> int:
+        """
+        Remove várias chaves num único DEL. Retorna quantas existiam.
+        """
+        keys = list(keys)
+        if not keys:
+            return 0
+        if not self.enabled:
+            return sum(self._memory.delete(k) for k in keys)
+
+        try:
+            return self.redis_client.delete(*[self._ns(k) for k in keys])
+        except Exception as e:
+            logger.error(f"Erro ao deletar do Redis: {e}")
+            return 0
+
     def delete(self, key: str) -> bool:
         """
         Remove valor do cache
         """
         if not self.enabled:
-            self._memory_cache.pop(key, None)
+            self._memory.delete(key)
             return True
         
         try:
-            self.redis_client.delete(key)
+            self.redis_client.delete(self._ns(key))
             return True
         except Exception as e:
             logger.error(f"Erro ao deletar do Redis: {e}")
@@ -209,21 +502,24 @@ class RedisCache:
     
     def delete_pattern(self, pattern: str) -> int:
         """
-        Remove todas as chaves que correspondem ao padrão
+        Remove as chaves da geração atual que correspondem ao padrão.
+        SCAN + UNLINK em lotes de SCAN_BATCH: não bloqueia o Redis como KEYS.
+        Para invalidar o dataset inteiro, use bump_generation.
         """
         if not self.enabled:
-            count = 0
-            for key in list(self._memory_cache.keys()):
-                if pattern.replace('*', '') in key:
-                    self._memory_cache.pop(key, None)
-                    count += 1
-            return count
+            return self._memory.delete_pattern(pattern)
         
         try:
-            keys = self.redis_client.keys(pattern)
-            if keys:
-                return self.redis_client.delete(*keys)
-            return 0
+            deleted = 0
+            batch = []
+            for key in self.redis_client.scan_iter(match=self._ns(pattern), count=SCAN_BATCH):
+                batch.append(key)
+                if len(batch) >= SCAN_BATCH:
+                    deleted += self.redis_client.unlink(*batch)
+                    batch = []
+            if batch:
+                deleted += self.redis_client.unlink(*batch)
+            return deleted
         except Exception as e:
             logger.error(f"Erro ao deletar padrão do Redis: {e}")
             return 0
@@ -233,7 +529,7 @@ class RedisCache:
         Limpa TODO o cache (use com cuidado!)
         """
         if not self.enabled:
-            self._memory_cache.clear()
+            self._memory.clear()
             return True
         
         try:
@@ -248,10 +544,10 @@ class RedisCache:
         Verifica se chave existe
         """
         if not self.enabled:
-            return key in self._memory_cache
+            return key in self._memory
         
         try:
-            return bool(self.redis_client.exists(key))
+            return bool(self.redis_client.exists(self._ns(key)))
         except Exception as e:
             logger.error(f"Erro ao verificar existência: {e}")
             return False
@@ -264,7 +560,8 @@ class RedisCache:
             return {
                 'enabled': False,
                 'type': 'memory',
-                'keys': len(self._memory_cache)
+                'keys': len(self._memory),
+                'local': local_cache.stats()
             }
         
         try:
@@ -281,7 +578,8 @@ class RedisCache:
                 'hit_rate': self._calculate_hit_rate(
                     info.get('keyspace_hits', 0),
                     info.get('keyspace_misses', 0)
-                )
+                ),
+                'local': local_cache.stats()
             }
         except Exception as e:
             logger.error(f"Erro ao obter stats: {e}")
@@ -317,10 +615,14 @@ def cache_decorator(ttl_seconds: int = 3600, key_prefix: str = ""):
                 **kwargs
             )
             
-            # Tentar buscar do cache
+            # Tentar buscar do cache (L1 do processo, depois Redis)
+            cached_value = local_cache.get(cache_key)
+            if cached_value is not None:
+                return cached_value
             cached_value = cache.get(cache_key)
             if cached_value is not None:
                 logger.info(f"💾 Cache HIT: {func.__name__}")
+                local_cache.set(cache_key, cached_value, ttl_seconds)
                 return cached_value
             
             # Executar função
@@ -329,6 +631,7 @@ def cache_decorator(ttl_seconds: int = 3600, key_prefix: str = ""):
             
             # Salvar no cache
             if result is not None:
+                local_cache.set(cache_key, result, ttl_seconds)
                 cache.set(cache_key, result, ttl_seconds)
             
             return result
@@ -338,8 +641,6 @@ def cache_decorator(ttl_seconds: int = 3600, key_prefix: str = ""):
 
 
 # Instância global do cache — usa REDIS_URL (Railway) quando disponível.
-import os
-
 cache = RedisCache(
     url=os.getenv('REDIS_URL'),
     host=os.getenv('REDIS_HOST', 'localhost'),
@@ -348,6 +649,9 @@ cache = RedisCache(
     password=os.getenv('REDIS_PASSWORD', None),
 )
 
+# L1 por processo na frente do Redis (routes.get_from_cache/set_cache, cache_decorator)
+local_cache = LocalCache(generation_source=cache.generation)
+
 # Exemplo de uso:
 """
 from src.api.cache_redis import cache
@@ -358,12 +662,19 @@ cache.set('cnpj:00000000000191', {'razao_social': 'EMPRESA TESTE'}, ttl_seconds=
 # Buscar do cache
 data = cache.get('cnpj:00000000000191')
 
+# Várias chaves em um round trip
+found = cache.get_many(['cnpj:00000000000191', 'cnpj:33000167000101'])
+cache.set_many({'a': 1, 'b': 2}, ttl_seconds=3600, ttls={'b': 60})
+
 # Deletar
 cache.delete('cnpj:00000000000191')
 
-# Limpar por padrão
+# Limpar por padrão (SCAN em lotes, só a geração atual)
 cache.delete_pattern('cnpj:*')
 
+# Nova carga no banco: invalida tudo em O(1)
+cache.bump_generation()
+
 # Ver estatísticas
 stats = cache.get_stats()
 print(stats)
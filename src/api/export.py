@@ -0,0 +1,108 @@
+"""
+Exportação da busca (/search/export) sem dependência de banco.
+
+A rota só abre o cursor de servidor; aqui ficam o WHERE (o MESMO construtor
+do /search), a codificação NDJSON/CSV e o controle de slots. O slot é pego
+no PRIMEIRO passo do gerador de stream_export e devolvido no finally: entre
+a validação e o início do stream não há await que possa ser cancelado com o
+slot na mão, e um gerador fechado (cliente desconectou, erro de SQL) sempre
+o libera.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import threading
+from typing import Callable, ContextManager, Iterable, Iterator, Optional
+
+from fastapi import HTTPException
+
+from src.api.search_filters import SEARCH_COLUMNS, SEARCH_SELECT, build_search_conditions, row_to_search_item
+
+logger = logging.getLogger(__name__)
+
+# Cada exportação segura uma conexão do pool enquanto transmite, por isso há
+# um teto por worker
+EXPORT_ITERSIZE = int(os.getenv('EXPORT_ITERSIZE', '5000'))
+EXPORT_MAX_ROWS = int(os.getenv('EXPORT_MAX_ROWS', '1000000'))
+EXPORT_MAX_CONCURRENT = int(os.getenv('EXPORT_MAX_CONCURRENT', '2'))
+export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+
+def export_conditions(filters: dict, municipio_codigos: Optional[list] = None) -> tuple[list, list]:
+    """
+    (conditions, params) da exportação: `filters` com os nomes dos parâmetros
+    do /search (razao_social, q, cnae_secundario, ...). Sem nenhum filtro ou
+    filtro inválido (data, q sem palavras, CNAE não numérico) => HTTP 400.
+    """
+    if not any(value for value in filters.values()):
+        raise HTTPException(status_code=400, detail="Informe ao menos um filtro para exportar")
+    return build_search_conditions(**filters, municipio_codigos=municipio_codigos)
+
+
+def export_query(conditions: list) -> str:
+    """SELECT da exportação: sem ORDER BY (ordem não garantida) e com teto de linhas."""
+    return f"""
+        SELECT {SEARCH_SELECT}
+        FROM vw_estabelecimentos_completos
+        WHERE {" AND ".join(conditions)}
+        LIMIT %s
+    """
+
+
+def export_row_cap(max_rows: Optional[int]) -> int:
+    return min(max_rows or EXPORT_MAX_ROWS, EXPORT_MAX_ROWS)
+
+
+def export_header(fmt: str, columns=SEARCH_COLUMNS) -> bytes:
+    """Cabeçalho do arquivo: linha de colunas no CSV, nada no NDJSON."""
+    return (",".join(columns) + "\n").encode('utf-8') if fmt == 'csv' else b""
+
+
+def encode_items(items: Iterable[dict], fmt: str, columns=SEARCH_COLUMNS) -> bytes:
+    """Itens do /search -> bytes UTF-8 (uma linha por item). CSV: None vira vazio."""
+    if fmt == 'csv':
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for data in items:
+            writer.writerow(['' if data.get(c) is None else data.get(c) for c in columns])
+        return buf.getvalue().encode('utf-8')
+    return "".join(
+        json.dumps(data, ensure_ascii=False, default=str) + "\n" for data in items
+    ).encode('utf-8')
+
+
+def stream_export(open_rows: Callable[[], ContextManager[Iterable]], fmt: str,
+                  slots=export_slots, itersize: int = EXPORT_ITERSIZE,
+                  user_id=None) -> Iterator[bytes]:
+    """
+    Gerador síncrono (o Starlette itera em threadpool). `open_rows()` abre a
+    fonte de linhas do SELECT {SEARCH_SELECT} (cursor de servidor). O primeiro
+    passo pega o slot (HTTP 429 se não houver), abre as linhas e devolve o
+    cabeçalho — executado no handler, erros viram resposta HTTP.
+    """
+    if not slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=429,
+            detail="Muitas exportações simultâneas. Tente novamente em instantes."
+        )
+    sent = 0
+    try:
+        with open_rows() as rows:
+            yield export_header(fmt)
+            batch = []
+            for row in rows:
+                batch.append(row_to_search_item(row))
+                if len(batch) >= itersize:
+                    sent += len(batch)
+                    yield encode_items(batch, fmt)
+                    batch = []
+            if batch:
+                sent += len(batch)
+                yield encode_items(batch, fmt)
+        logger.info(f"📤 Exportação concluída: {sent} linhas ({fmt}) user={user_id}")
+    finally:
+        slots.release()
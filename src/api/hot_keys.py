@@ -0,0 +1,70 @@
+"""
+HotKeys — amostra dos CNPJs e buscas mais pedidos (para o aquecimento pós-ETL).
+
+clientes.query_log não é gravado por requisição e o security log não guarda
+a chave de cache; aqui cada /cnpj e cada 1ª página do /search entra, com
+probabilidade HOT_KEYS_SAMPLE_RATE, num sorted set do Redis (ZINCRBY): o
+score é a popularidade aproximada. warmup_cache.py lê os TOP N depois do swap
+e recarrega o cache antes do tráfego chegar.
+
+Os sorted sets ficam fora do namespace da geração (sobrevivem à carga) e
+expiram se a API ficar HOT_KEYS_TTL sem registrar nada.
+"""
+import json
+import logging
+import os
+import random
+from typing import Optional
+
+from src.api.cache_redis import cache as shared_cache
+
+logger = logging.getLogger(__name__)
+
+HOT_KEYS_SAMPLE_RATE = float(os.getenv('HOT_KEYS_SAMPLE_RATE', '0.1'))
+HOT_KEYS_TTL = int(os.getenv('HOT_KEYS_TTL', str(40 * 24 * 3600)))  # > 1 ciclo mensal
+HOT_KEYS_MAX = int(os.getenv('HOT_KEYS_MAX', '50000'))  # membros mantidos por tipo
+TRIM_PROBABILITY = 0.001  # fração dos registros que também aparam o sorted set
+
+CNPJ = 'cnpj'
+SEARCH = 'search'
+KEY_PREFIX = "hot:"
+
+
+def search_member(filters: dict, limit: int) -> str:
+    """Membro canônico de uma busca: filtros não vazios + tamanho da página."""
+    return json.dumps({'f': {k: v for k, v in filters.items() if v is not None}, 'limit': limit},
+                      sort_keys=True, separators=(',', ':'))
+
+
+def parse_search_member(member: str) -> tuple[dict, int]:
+    data = json.loads(member)
+    return data['f'], int(data['limit'])
+
+
+class HotKeys:
+    def __init__(self, cache=shared_cache, sample_rate: float = HOT_KEYS_SAMPLE_RATE,
+                 ttl: int = HOT_KEYS_TTL, rng: Optional[random.Random] = None):
+        self.cache = cache
+        self.sample_rate = sample_rate
+        self.ttl = ttl
+        self._random = (rng or random.Random()).random
+
+    def record(self, kind: str, member: str):
+        """Conta um acesso (amostrado). Nunca levanta: não pode derrubar a rota."""
+        if self.sample_rate <= 0 or self._random() >= self.sample_rate:
+            return
+        try:
+            self.cache.zincr(KEY_PREFIX + kind, member, 1, ttl_seconds=self.ttl)
+            if self._random() < TRIM_PROBABILITY:
+                self.trim(kind)  # cauda longa de CNPJs vistos uma vez não cresce sem limite
+        except Exception as e:
+            logger.debug(f"HotKeys: falha ao registrar {kind}: {e}")
+
+    def top(self, kind: str, n: int) -> list:
+        return self.cache.ztop(KEY_PREFIX + kind, n)
+
+    def trim(self, kind: str, keep: int = HOT_KEYS_MAX) -> int:
+        return self.cache.ztrim(KEY_PREFIX + kind, keep)
+
+
+hot_keys = HotKeys()
@@ -0,0 +1,73 @@
+"""
+GET condicional (ETag / If-None-Match) para rotas de leitura.
+
+Os dados mudam no máximo uma vez por mês (carga do ETL). O ETag de uma
+resposta é a geração do dataset (RedisCache.generation, incrementada no fim de
+cada carga) + um hash do recurso (path + query string canônica):
+
+    ETag: W/"42-9f2c0e1b7a4d5e6f8a90"
+
+Enquanto a geração não muda, a mesma URL tem o mesmo ETag — o cliente (ou um
+CDN que revalide) manda If-None-Match e recebe 304 sem corpo, sem tocar no
+cache nem no banco. Sem Redis não há geração conhecida: as rotas respondem
+sem ETag (nunca um 304 potencialmente velho).
+
+O ETag é FRACO (W/): a mesma URL sai em gzip ou JSON puro conforme o
+Accept-Encoding (CachedBody, GZipMiddleware), bytes diferentes do mesmo
+conteúdo. Um ETag forte igual para as duas codificações deixaria um cache
+intermediário servir gzip a quem não pediu. Pelo mesmo motivo toda
+resposta condicional leva Vary: Accept-Encoding.
+
+Cache-Control: por padrão `private` (as respostas dependem da API key e da
+cota); com um CDN que revalida cada requisição na origem, configure
+HTTP_CACHE_CONTROL (ex.: "public, no-cache").
+"""
+import hashlib
+import os
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode
+
+from src.api.cache_redis import cache as shared_cache
+
+HTTP_CACHE_CONTROL = os.getenv('HTTP_CACHE_CONTROL', 'private, max-age=3600, must-revalidate')
+
+
+def resource_etag(path: str, query: str = '', generation: Optional[str] = None) -> Optional[str]:
+    """ETag fraco: geração do dataset + hash de path e query (ordem dos parâmetros não importa)."""
+    if generation is None:
+        generation = shared_cache.generation()
+    if generation is None:
+        return None
+    canonical = urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+    digest = hashlib.sha1(f"{path}?{canonical}".encode()).hexdigest()[:20]
+    return f'W/"{generation}-{digest}"'
+
+
+def _opaque(etag: str) -> str:
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """If-None-Match (lista separada por vírgulas de W/"...") casa com `etag`?
+    Comparação fraca (RFC 9110): W/ é ignorado dos dois lados. `*` NÃO casa
+    aqui — ver matches_any."""
+    if not if_none_match or not etag:
+        return False
+    etag = _opaque(etag)
+    return any(_opaque(candidate.strip()) == etag for candidate in if_none_match.split(','))
+
+
+def matches_any(if_none_match: Optional[str]) -> bool:
+    """If-None-Match: * — casa com qualquer representação EXISTENTE. O ETag da
+    URL não diz se o recurso existe (CNPJ malformado ou inexistente tem ETag
+    também), então o 304 só pode sair depois que a rota achou o recurso."""
+    if not if_none_match:
+        return False
+    return any(candidate.strip() == '*' for candidate in if_none_match.split(','))
+
+
+def cache_headers(etag: Optional[str]) -> dict:
+    """Cabeçalhos de uma resposta 200/304 condicional (sem ETag => sem cache no cliente)."""
+    if not etag:
+        return {}
+    return {'ETag': etag, 'Cache-Control': HTTP_CACHE_CONTROL, 'Vary': 'Accept-Encoding'}
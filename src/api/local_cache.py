@@ -0,0 +1,163 @@
+"""
+LocalCache — L1 por processo (LRU + TTL, limitado em entradas E bytes).
+
+Fica na frente do Redis em get_from_cache/set_cache (routes.py) e no
+cache_decorator: um CNPJ quente é servido da memória do worker em
+microssegundos, sem round trip nem descompressão. Também é o fallback do
+RedisCache quando o Redis está fora.
+
+Antes: um dict sem limite em routes.py (só expirava na leitura) e um
+fallback que, cheio, apagava as 5.000 chaves de uma vez. Aqui o despejo é
+do menos usado recentemente, até caber nos dois limites.
+
+Geração do dataset: com `generation_source`, a cada GENERATION_CHECK_INTERVAL
+segundos o L1 confere a geração publicada no Redis (incrementada pelo ETL ao
+fim de cada carga) e, se mudou, descarta tudo — nenhum worker serve dado do
+mês anterior por mais que esse intervalo.
+"""
+import json
+import os
+import time
+import logging
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from threading import Lock
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv('LOCAL_CACHE_MAX_ENTRIES', '20000'))
+LOCAL_CACHE_MAX_BYTES = int(os.getenv('LOCAL_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Teto do TTL no L1: sem geração (Redis fora) é o atraso máximo entre workers
+LOCAL_CACHE_MAX_TTL = int(os.getenv('LOCAL_CACHE_MAX_TTL', '300'))
+GENERATION_CHECK_INTERVAL = 2.0  # segundos
+
+# Custo fixo estimado por entrada (tupla + chave + nó do OrderedDict)
+_ENTRY_OVERHEAD = 200
+
+
+def estimate_size(value: Any) -> int:
+    """Bytes aproximados de um valor (o limite de memória é aproximado, não exato)."""
+    gzipped = getattr(value, 'gzipped', None)  # CachedBody
+    if gzipped is not None:
+        return len(gzipped) + _ENTRY_OVERHEAD
+    if isinstance(value, (bytes, str)):
+        return len(value) + _ENTRY_OVERHEAD
+    try:
+        return len(json.dumps(value, default=str, separators=(',', ':'))) + _ENTRY_OVERHEAD
+    except Exception:
+        return 1024 + _ENTRY_OVERHEAD
+
+
+class LocalCache:
+    def __init__(self, max_entries: int = LOCAL_CACHE_MAX_ENTRIES,
+                 max_bytes: int = LOCAL_CACHE_MAX_BYTES,
+                 max_ttl: Optional[float] = LOCAL_CACHE_MAX_TTL,
+                 generation_source: Optional[Callable[[], Optional[str]]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[str, tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._generation_source = generation_source
+        self.generation: Optional[str] = None
+        self._next_generation_check = 0.0
+
+    def _check_generation(self):
+        now = time.time()
+        if self._generation_source is None or now < self._next_generation_check:
+            return
+        self._next_generation_check = now + GENERATION_CHECK_INTERVAL
+        try:
+            generation = self._generation_source()
+        except Exception as e:
+            logger.debug(f"Geração do cache indisponível: {e}")
+            return
+        if generation is not None and generation != self.generation:
+            # Primeira leitura só adota a geração (nada de outra carga foi guardado ainda)
+            if self.generation is not None:
+                logger.info(f"Geração do dataset mudou ({self.generation} -> {generation}): L1 descartado")
+                self.clear()
+            self.generation = generation
+
+    def get(self, key: str) -> Optional[Any]:
+        self._check_generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                self._bytes -= size
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl_seconds: float = 3600, size: Optional[int] = None):
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_bytes // 4:
+            # Entrada gigante expulsaria meio cache: fica só no Redis
+            self.delete(key)
+            return
+        ttl = min(ttl_seconds, self.max_ttl) if self.max_ttl else ttl_seconds
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (time.time() + ttl, size, value)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            self._bytes -= entry[1]
+            return True
+
+    def delete_pattern(self, pattern: str) -> int:
+        """Padrão glob (mesma sintaxe do Redis KEYS/SCAN MATCH)."""
+        with self._lock:
+            keys = [k for k in self._entries if fnmatchcase(k, pattern)]
+            for k in keys:
+                self._bytes -= self._entries.pop(k)[1]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and time.time() < entry[0]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': f"{(self.hits / total * 100):.2f}%" if total else "0%",
+            'generation': self.generation,
+        }
@@ -193,6 +193,41 @@ app.include_router(batch_router, prefix="/api/v1")
 app.include_router(admin_router, prefix="/api/v1")
 
 
+@app.on_event("startup")
+async def open_async_pool():
+    """ASYNC-DB: abre o pool psycopg 3 usado pelas rotas da API."""
+    from src.database.async_connection import async_db_manager
+    try:
+        await async_db_manager.open()
+    except Exception as e:
+        logging.error(f"⚠️ Pool assíncrono não abriu no startup (abre sob demanda): {e}")
+
+
+@app.on_event("startup")
+async def start_usage_flusher():
+    """WRITE-BEHIND: grava contadores de uso em lote a cada USAGE_FLUSH_INTERVAL s."""
+    from src.api.usage_buffer import usage_buffer
+    usage_buffer.start()
+
+
+@app.on_event("startup")
+async def load_reference_registry():
+    """Tabelas auxiliares em memória antes da 1ª requisição (falha: carrega sob demanda)."""
+    from src.api.reference_registry import reference_registry
+    await reference_registry.ensure_fresh()
+
+
+@app.on_event("shutdown")
+async def close_async_pool():
+    from src.api.usage_buffer import usage_buffer
+    from src.database.async_connection import async_db_manager
+    try:
+        await usage_buffer.stop()  # grava o que restou antes de fechar o pool
+    except Exception as e:
+        logging.error(f"⚠️ Flush final de contadores falhou: {e}")
+    await async_db_manager.close()
+
+
 @app.on_event("startup")
 async def ensure_schema():
     """Migrations idempotentes leves no startup (ex.: coluna de avatar)."""
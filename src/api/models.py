@@ -85,6 +85,14 @@ class PaginatedResponse(BaseModel):
     per_page: int
     total_pages: int
     items: List[EstabelecimentoCompleto]
+    # True quando 'total' é só um piso (contagem limitada, ver /batch/search)
+    total_is_lower_bound: bool = False
+
+# Teto do /cnpj/bulk (um ANY(%s) com 1.000 chaves ainda é um index scan barato)
+CNPJ_BULK_MAX = 1000
+
+class CNPJBulkRequest(BaseModel):
+    cnpjs: List[str] = Field(..., min_length=1, max_length=CNPJ_BULK_MAX)
 
 class HealthCheck(BaseModel):
     status: str
@@ -32,6 +32,19 @@ class RateLimiter:
         'enterprise': 5000,   # Máx 5.000 req/min (customizado)
         'admin': 10000        # Máx 10.000 req/min
     }
+
+    # ⌨️ BALDES SEPARADOS (req/min) para rotas leves que não cobram cota, ex.:
+    # autocomplete (uma requisição por tecla não pode gastar o burst da API)
+    BUCKET_LIMITS = {
+        'autocomplete': {
+            'free': 120,
+            'start': 300,
+            'growth': 600,
+            'pro': 1200,
+            'enterprise': 3000,
+            'admin': 10000
+        }
+    }
     
     def __init__(self):
         # {user_id: [(timestamp, count)]}
@@ -83,6 +96,33 @@ class RateLimiter:
                 detail=f"Limite de {max_requests} requisições por {window_seconds//3600}h excedido. Considere fazer upgrade do plano."
             )
 
+    async def check_bucket_limit(self, user_id: int, bucket: str, user_plan: str = 'free', user_role: str = 'user'):
+        """
+        Limite por minuto de um balde próprio (BUCKET_LIMITS), independente dos
+        contadores por hora/burst da API — não os consome nem é barrado por eles.
+        """
+        plan_key = 'admin' if user_role == 'admin' else user_plan
+        limits = self.BUCKET_LIMITS[bucket]
+        limit = limits.get(plan_key, limits['free'])
+
+        count = shared_cache.incr_rate(f"rl:{bucket}:{user_id}", 60)
+        if count == -1:
+            # Redis indisponível -> fallback em memória do processo
+            now = datetime.now()
+            key = (bucket, user_id)
+            window_start = now - timedelta(seconds=60)
+            self.requests[key] = [(ts, c) for ts, c in self.requests[key] if ts > window_start]
+            count = sum(c for _, c in self.requests[key]) + 1
+            if count <= limit:
+                self.requests[key].append((now, 1))
+
+        if count > limit:
+            logger.warning(f"⌨️ Limite de {bucket} - User {user_id} ({plan_key}): {count}/{limit} req/min")
+            raise HTTPException(
+                status_code=429,
+                detail=f"Limite de {limit} requisições por minuto excedido em {bucket}. Aguarde alguns segundos."
+            )
+
     def _check_rate_limit_memory(self, user_id: int, max_requests: int, window_seconds: int, burst_limit: int):
         """Fallback em memória (válido apenas dentro de um worker; usado se o Redis cair)."""
         now = datetime.now()
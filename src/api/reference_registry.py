@@ -0,0 +1,200 @@
+"""
+ReferenceRegistry — tabelas auxiliares (CNAEs, municípios, qualificações,
+naturezas, motivos, países) em memória, por processo.
+
+Antes, /cnpj e /cnpj/{cnpj}/cnaes-secundarios consultavam `cnaes` a cada
+requisição, /cnaes rodava ILIKE no Postgres e /municipios/{uf} um DISTINCT
+com JOIN em estabelecimentos. Agora as seis tabelas (poucos milhares de
+linhas) são lidas UMA vez (load_reference_tables, o mesmo carregador do ETL)
+e as descrições saem de dicts.
+
+Versão: a geração do dataset publicada no Redis (ver RedisCache.generation).
+A cada GENERATION_CHECK_INTERVAL segundos o registro confere a geração e, se
+mudou (nova carga), recarrega.
+
+Municípios por UF dependem de estabelecimentos (não há UF em `municipios`):
+cada UF é consultada na 1ª vez que é pedida (cache Redis compartilhado entre
+workers, no namespace da geração) e fica em memória até a próxima carga.
+
+O filtro `municipio` por nome da busca é resolvido aqui para códigos
+(resolve_municipio_codigos): a MV filtra pela coluna de código, com índices
+compostos, em vez de ILIKE em municipio_desc.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+
+import anyio.to_thread
+
+from src.api.cache_redis import cache as shared_cache
+from src.api.local_cache import GENERATION_CHECK_INTERVAL
+from src.api.search_filters import normalize_text
+from src.api.single_flight import single_flight
+from src.database.reference_data import REFERENCE_TABLES, load_reference_tables
+
+logger = logging.getLogger(__name__)
+
+MUNICIPIOS_UF_TTL = 35 * 24 * 3600  # a geração invalida antes; TTL só limpa o Redis
+
+
+def _load_from_database() -> Dict[str, Dict[str, str]]:
+    from src.database.connection import db_manager
+    with db_manager.get_connection() as conn:
+        return load_reference_tables(conn)
+
+
+async def _query_municipios_uf(uf: str) -> List[dict]:
+    from src.database.async_connection import async_db_manager
+    rows = await async_db_manager.fetchall("""
+        SELECT DISTINCT m.codigo, m.descricao
+        FROM municipios m
+        INNER JOIN estabelecimentos e ON e.municipio = m.codigo
+        WHERE e.uf = %s
+        ORDER BY m.descricao
+    """, (uf,))
+    return [{"codigo": row[0], "descricao": row[1]} for row in rows]
+
+
+class ReferenceRegistry:
+    def __init__(self, loader=_load_from_database, generation_source=shared_cache.generation,
+                 municipios_uf_loader=_query_municipios_uf):
+        self._loader = loader
+        self._generation_source = generation_source
+        self._municipios_uf_loader = municipios_uf_loader
+        self._tables: Dict[str, Dict[str, str]] = {}
+        self._cnaes_sorted: List[tuple] = []
+        self._municipios_norm: List[tuple] = []
+        self._municipios_uf: Dict[str, List[dict]] = {}
+        self._lock = asyncio.Lock()
+        self.version: Optional[str] = None
+        self.loaded_at: Optional[float] = None
+        self._next_check = 0.0
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def _generation(self) -> Optional[str]:
+        try:
+            return self._generation_source() if self._generation_source else None
+        except Exception as e:
+            logger.debug(f"Geração do dataset indisponível: {e}")
+            return None
+
+    def load(self, tables: Dict[str, Dict[str, str]], version: Optional[str] = None):
+        """Troca o conteúdo de uma vez (leitores nunca veem um registro pela metade)."""
+        cnaes_sorted = sorted(
+            (codigo, descricao, descricao.casefold())
+            for codigo, descricao in tables.get('cnaes', {}).items()
+        )
+        municipios_norm = sorted(
+            (' '.join(normalize_text(descricao).split()), codigo)
+            for codigo, descricao in tables.get('municipios', {}).items()
+        )
+        self._tables, self._cnaes_sorted, self._municipios_uf = tables, cnaes_sorted, {}
+        self._municipios_norm = municipios_norm
+        self.version = version
+        self.loaded_at = time.time()
+        logger.info("📚 Tabelas auxiliares em memória (geração %s): %s", version, ", ".join(
+            f"{t}={len(tables.get(t, {}))}" for t in REFERENCE_TABLES))
+
+    async def ensure_fresh(self) -> bool:
+        """
+        Carrega na 1ª chamada e recarrega quando a geração do dataset muda.
+        Se a recarga falhar, segue servindo a versão anterior. True se há dados.
+        """
+        now = time.time()
+        if self.loaded and now < self._next_check:
+            return True
+        async with self._lock:
+            if self.loaded and time.time() < self._next_check:
+                return True
+            self._next_check = time.time() + GENERATION_CHECK_INTERVAL
+            generation = self._generation()
+            if self.loaded and (generation is None or generation == self.version):
+                return True
+            try:
+                tables = await anyio.to_thread.run_sync(self._loader)
+            except Exception as e:
+                logger.error(f"Falha ao carregar tabelas auxiliares: {e}")
+                return self.loaded
+            self.load(tables, generation)
+            return True
+
+    def describe(self, table: str, codigo) -> Optional[str]:
+        if codigo is None:
+            return None
+        return self._tables.get(table, {}).get(str(codigo))
+
+    def descriptions(self, table: str, codigos: Iterable) -> Dict[str, str]:
+        """{codigo: descricao} dos códigos conhecidos (desconhecidos ficam de fora)."""
+        known = self._tables.get(table, {})
+        return {c: known[c] for c in codigos if c in known}
+
+    def cnaes(self, search: Optional[str] = None, limit: int = 100) -> List[dict]:
+        """CNAEs por código; `search` filtra a descrição (sem diferenciar maiúsculas, como ILIKE)."""
+        needle = search.casefold() if search else None
+        result = []
+        for codigo, descricao, folded in self._cnaes_sorted:
+            if needle is None or needle in folded:
+                result.append({'codigo': codigo, 'descricao': descricao})
+                if len(result) >= limit:
+                    break
+        return result
+
+    def municipio_codigos(self, nome: str) -> List[str]:
+        """
+        Códigos dos municípios com esse nome (sem diferenciar acentos/maiúsculas).
+        Nomes se repetem entre UFs: todos os homônimos entram (a UF, se
+        informada, filtra na consulta). Sem nome exato, os que contêm o
+        trecho — a semântica do antigo ILIKE '%nome%'.
+        """
+        needle = ' '.join(normalize_text(nome).split())
+        if not needle:
+            return []
+        exact = [codigo for norm, codigo in self._municipios_norm if norm == needle]
+        if exact:
+            return sorted(exact)
+        return sorted(codigo for norm, codigo in self._municipios_norm if needle in norm)
+
+    async def municipios_por_uf(self, uf: str) -> List[dict]:
+        uf = uf.upper()
+        cached = self._municipios_uf.get(uf)
+        if cached is not None:
+            return cached
+        key = f"municipios:{uf}"
+        payload = shared_cache.get(key)
+        if payload is None:
+            async def _load():
+                rows = await self._municipios_uf_loader(uf)
+                shared_cache.set(key, rows, ttl_seconds=MUNICIPIOS_UF_TTL)
+                return rows
+            payload = await single_flight.load(key, _load, shared_cache.get)
+        self._municipios_uf[uf] = payload
+        return payload
+
+    def stats(self) -> dict:
+        return {
+            'loaded': self.loaded,
+            'version': self.version,
+            'tables': {t: len(self._tables.get(t, {})) for t in REFERENCE_TABLES},
+            'municipios_ufs': len(self._municipios_uf),
+        }
+
+
+reference_registry = ReferenceRegistry()
+
+
+async def resolve_municipio_codigos(municipio: Optional[str],
+                                    registry: ReferenceRegistry = reference_registry) -> Optional[List[str]]:
+    """
+    Códigos para o filtro `municipio` por nome; None se não se aplica (vazio
+    ou já é código) ou se as tabelas auxiliares não carregaram — aí a busca
+    usa o filtro por texto em municipio_desc.
+    """
+    if not municipio or not municipio.strip() or municipio.strip().isdigit():
+        return None
+    if not await registry.ensure_fresh():
+        return None
+    return registry.municipio_codigos(municipio)
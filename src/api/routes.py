@@ -1,7 +1,12 @@
-from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect, Header, Depends
-from typing import Optional, List, Dict, Any
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect, Header, Depends, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from typing import Optional, List, Dict, Any, NamedTuple
 from sqlalchemy import text, or_, and_
 from src.database.connection import db_manager
+from src.database.async_connection import async_db_manager
+from src.api.auth_cache import auth_cache, load_api_key_context
+from src.api.usage_buffer import usage_buffer
 from src.api.models import (
     EstabelecimentoCompleto,
     PaginatedResponse,
@@ -9,7 +14,8 @@ from src.api.models import (
     StatsResponse,
     SocioModel,
     CNAEModel,
-    MunicipioModel
+    MunicipioModel,
+    CNPJBulkRequest
 )
 from src.api.auth import get_current_admin_user, get_current_user
 from src.api.websocket_manager import ws_manager
@@ -20,13 +26,33 @@ import asyncio
 import anyio.to_thread
 import hashlib
 import json
+import os
+import uuid
+from contextlib import contextmanager
 from functools import lru_cache
 from datetime import datetime, timedelta, timezone
 from src.utils.cnpj_utils import clean_cnpj
-from src.utils.security_utils import mask_cpf_socio as _mask_cpf_socio
+from src.utils.security_utils import mask_cpf_socio as _mask_cpf_socio, hash_api_key
+from src.utils.cursor_utils import (
+    SORT_CNPJ, SORT_RAZAO, SORT_RANK, encode_cursor, decode_cursor, keyset_condition
+)
 from src.api.security_logger import log_query
-from src.api.cache_redis import cache as shared_cache
+from src.api.cache_redis import cache as shared_cache, local_cache, CachedBody
 from src.api.plan_service import plan_service, require_feature
+from src.api.single_flight import single_flight
+from src.api.reference_registry import reference_registry, resolve_municipio_codigos
+from src.api.http_cache import cache_headers, etag_matches, matches_any, resource_etag
+from src.api.hot_keys import CNPJ as HOT_CNPJ, SEARCH as HOT_SEARCH, hot_keys, search_member
+from src.api.search_filters import (
+    SEARCH_SELECT, SEARCH_RANK_CANDIDATES, build_search_conditions, check_rank_offset,
+    build_tsquery, parse_cnae_codes, ranked_page_query, row_to_search_item
+)
+from src.api import autocomplete
+from src.api.export import EXPORT_ITERSIZE, export_conditions, export_query, export_row_cap, stream_export
+from src.api.search_rollup import (
+    FACET_COLUMNS, answerable_facets, build_rollup_conditions, exact_total, facet_counts, label_facets,
+    rollup_group
+)
 
 # ℹ️ A conexão ao banco vem exclusivamente de DATABASE_URL (variável de ambiente).
 
@@ -34,10 +60,6 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Cache em memória para resultados (expira em 1 hora)
-_cache = {}
-_cache_timeout = {}
-
 # QUOTA-TZ: um ÚNICO relógio para o mês de cota (Brasília). Antes o rollover
 # acontecia em UTC (21h de Brasília) e usava dois relógios diferentes.
 try:
@@ -52,34 +74,101 @@ def current_month_year() -> str:
     return datetime.now(_BR_TZ).strftime('%Y-%m')
 
 def get_from_cache(key: str):
-    """Retorna do cache se ainda válido"""
+    """Retorna do cache se ainda válido: L1 do processo, depois Redis"""
+    cached = local_cache.get(key)
+    if cached is not None:
+        return cached
     try:
         cached = shared_cache.get(key)
-        if cached is not None:
-            return cached
     except Exception:
-        pass
+        cached = None
+    if cached is not None:
+        local_cache.set(key, cached)
+    return cached
 
-    if key in _cache:
-        if datetime.now() < _cache_timeout.get(key, datetime.min):
-            return _cache[key]
-        else:
-            _cache.pop(key, None)
-            _cache_timeout.pop(key, None)
-    return None
+def get_many_from_cache(keys: List[str]) -> dict:
+    """
+    {chave: valor} das chaves presentes — L1 primeiro e UM MGET no Redis para
+    o resto, em vez de um GET por chave.
+    """
+    found = {}
+    for key in keys:
+        value = local_cache.get(key)
+        if value is not None:
+            found[key] = value
+    missing = [k for k in keys if k not in found]
+    if missing:
+        try:
+            remote = shared_cache.get_many(missing)
+        except Exception:
+            remote = {}
+        for key, value in remote.items():
+            local_cache.set(key, value)
+        found.update(remote)
+    return found
+
+def set_many_cache(values: dict, minutes: int = 60, minutes_by_key: Optional[dict] = None):
+    """set_cache de várias chaves num único pipeline (um round trip)."""
+    if not values:
+        return
+    if shared_cache.generation_changed():
+        return  # lido da carga anterior (ver RedisCache.pinned_generation)
+    minutes_by_key = minutes_by_key or {}
+    ttls = {k: max(1, int(m * 60)) for k, m in minutes_by_key.items()}
+    ttl_seconds = max(1, int(minutes * 60))
+    for key, value in values.items():
+        local_cache.set(key, value, ttls.get(key, ttl_seconds))
+    try:
+        shared_cache.set_many(values, ttl_seconds=ttl_seconds, ttls=ttls)
+    except Exception:
+        pass
 
 def set_cache(key: str, value, minutes: int = 60):
-    """Salva no cache com tempo de expiração"""
+    """Salva no cache (L1 + Redis) com tempo de expiração"""
+    if shared_cache.generation_changed():
+        return  # lido da carga anterior (ver RedisCache.pinned_generation)
     ttl_seconds = max(1, int(minutes * 60))
+    local_cache.set(key, value, ttl_seconds)
     try:
-        saved = shared_cache.set(key, value, ttl_seconds=ttl_seconds)
-        if saved:
-            return
+        shared_cache.set(key, value, ttl_seconds=ttl_seconds)
     except Exception:
         pass
 
-    _cache[key] = value
-    _cache_timeout[key] = datetime.now() + timedelta(minutes=minutes)
+def not_modified(request: Request) -> Optional[Response]:
+    """304 para If-None-Match: * — só chamado com o recurso encontrado."""
+    if getattr(request.state, 'etag_any', False):
+        return Response(status_code=304, headers=cache_headers(request.state.etag))
+    return None
+
+def cached_json_response(request: Request, cached: CachedBody) -> Response:
+    """
+    Serve um CachedBody como está: gzip direto para quem aceita (o
+    GZipMiddleware não recomprime respostas com Content-Encoding), JSON puro
+    para o resto. Com GET condicional (verify_api_key_conditional), leva ETag.
+    """
+    unchanged = not_modified(request)
+    if unchanged is not None:
+        return unchanged
+    # Vary nas duas codificações: a mesma URL tem corpo gzip e JSON puro
+    headers = {**cache_headers(getattr(request.state, 'etag', None)), 'Vary': 'Accept-Encoding'}
+    if 'gzip' in request.headers.get('accept-encoding', ''):
+        return Response(
+            content=cached.gzipped,
+            media_type='application/json',
+            headers={**headers, 'Content-Encoding': 'gzip'},
+        )
+    return Response(content=cached.body(), media_type='application/json', headers=headers)
+
+def etag_response(request: Request, payload) -> Response:
+    """JSON com os cabeçalhos do GET condicional (ETag/Cache-Control), se houver."""
+    unchanged = not_modified(request)
+    if unchanged is not None:
+        return unchanged
+    return JSONResponse(jsonable_encoder(payload), headers=cache_headers(getattr(request.state, 'etag', None)))
+
+def cached_value(cached):
+    """Valor Python de uma entrada do cache (CachedBody ou valor comum)."""
+    return cached.value() if isinstance(cached, CachedBody) else cached
 
 async def verify_api_key(x_api_key: str = Header(None)):
     """
@@ -88,13 +177,61 @@ async def verify_api_key(x_api_key: str = Header(None)):
     Nota: A API externa da Receita Federal pode demorar 30+ segundos para responder.
     Isso é normal e está fora do nosso controle.
     """
+    return await authorize_api_key(x_api_key)
+
+def verify_api_key_conditional(feature: Optional[str] = None, feature_label: str = ''):
+    """
+    verify_api_key + GET condicional (ver http_cache). If-None-Match igual ao
+    ETag atual (geração do dataset + URL) => 304 aqui mesmo, antes da rota:
+    sem cache nem banco. Senão, o ETag fica em request.state para a resposta.
+
+    Cota: o 304 NÃO consome a cota mensal (cost=0) — o cliente não recebe
+    dado novo. A key continua validada, o rate limit por hora/minuto vale
+    normalmente e `feature` (recurso do plano) é conferido também no 304.
+
+    If-None-Match: * só casa se o recurso existe: a rota roda inteira
+    (validação, busca, cobrança normal) e o 304 sai no lugar da resposta de
+    sucesso (not_modified); CNPJ malformado ou inexistente segue 400/404.
+    """
+    async def dependency(request: Request, x_api_key: str = Header(None)):
+        etag = resource_etag(request.url.path, request.url.query)
+        if_none_match = request.headers.get('if-none-match')
+        if etag_matches(if_none_match, etag):
+            user = await authorize_api_key(x_api_key, cost=0)
+            if feature:
+                require_feature(user, feature, feature_label)
+            raise HTTPException(status_code=304, headers=cache_headers(etag))
+        request.state.etag = etag
+        request.state.etag_any = etag is not None and matches_any(if_none_match)
+        return await authorize_api_key(x_api_key)
+    return dependency
+
+async def verify_api_key_autocomplete(x_api_key: str = Header(None)):
+    """Autocomplete: uma requisição por tecla — balde de rate limit próprio e sem cota."""
+    return await authorize_api_key(x_api_key, cost=0, rate_bucket='autocomplete')
+
+async def authorize_api_key(x_api_key: Optional[str], cost: int = 1, rate_bucket: Optional[str] = None):
+    """
+    Corpo de verify_api_key. `cost` = consultas cobradas da cota mensal numa
+    única operação (o /cnpj/bulk cobra o lote inteiro de uma vez: cabe todo
+    no limite ou a requisição recebe 429 sem cobrar nada).
+    `rate_bucket`: rota leve com limite por minuto próprio (ver
+    RateLimiter.BUCKET_LIMITS) no lugar dos limites por hora/burst do plano.
+    """
     if not x_api_key:
         raise HTTPException(
             status_code=401,
             detail="API Key não fornecida. Use o header 'X-API-Key'"
         )
 
-    user = await db_manager.verify_api_key(x_api_key)
+    # AUTH-1RT: contexto (usuário + assinatura) vem do AuthCache (TTL curto) ou
+    # de UMA consulta; cota mensal + uso diário + last_used da key são UMA escrita.
+    key_hash = hash_api_key(x_api_key)
+    try:
+        user = await load_api_key_context(key_hash)
+    except Exception as e:
+        logger.error(f"Erro ao verificar API key: {e}")
+        user = None
     if not user:
         raise HTTPException(
             status_code=401,
@@ -102,217 +239,84 @@ async def verify_api_key(x_api_key: str = Header(None)):
         )
 
     # VERIFICAÇÃO DE ASSINATURA ATIVA (apenas Stripe Subscriptions)
-    # P0-EVENTLOOP: psycopg2 é síncrono — o bloco roda em threadpool (abaixo)
-    # para uma query lenta não congelar o event loop do worker inteiro.
-    def _check_subscription_and_quota():
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-
-            try:
-                # Buscar assinatura válida e ativa do usuário
-                # Filtra apenas status válidos (active, trialing, canceled) E que ainda estejam no período pago
-                cursor.execute("""
-                    SELECT 
-                        ss.status,
-                        ss.current_period_end,
-                        ss.cancel_at_period_end,
-                        p.name as plan_name,
-                        p.monthly_queries,
-                        p.id as plan_id
-                    FROM clientes.stripe_subscriptions ss
-                    JOIN clientes.plans p ON ss.plan_id = p.id
-                    WHERE ss.user_id = %s 
-                        AND ss.current_period_end > NOW()
-                        AND ss.status IN ('active', 'trialing', 'canceled')
-                    ORDER BY ss.created_at DESC
-                    LIMIT 1
-                """, (user['id'],))
-                subscription = cursor.fetchone()
-
-                # Se não tem assinatura Stripe, verificar se deve usar Free Plan
-                if not subscription:
-                    # Verificar se tem assinatura mas com status problemático (past_due, unpaid, etc)
-                    cursor.execute("""
-                        SELECT ss.status, ss.current_period_end
-                        FROM clientes.stripe_subscriptions ss
-                        WHERE ss.user_id = %s
-                        ORDER BY ss.created_at DESC
-                        LIMIT 1
-                    """, (user['id'],))
-                    any_subscription = cursor.fetchone()
-
-                    if any_subscription:
-                        status = any_subscription[0]
-                        period_end = any_subscription[1]
-
-                        # Status com pagamento pendente
-                        if status == 'past_due':
-                            raise HTTPException(
-                                status_code=402,
-                                detail={
-                                    "error": "payment_past_due",
-                                    "message": "Sua assinatura está com pagamento pendente. Por favor, atualize suas informações de pagamento.",
-                                    "action_url": "/subscription",
-                                    "help": "Acesse a página de assinatura para atualizar seu método de pagamento",
-                                    "suggestions": [
-                                        "Atualize suas informações de pagamento",
-                                        "Verifique se seu cartão não está expirado",
-                                        "Entre em contato com seu banco se o problema persistir"
-                                    ]
-                                }
-                            )
-
-                        # Status não pago
-                        if status == 'unpaid':
-                            raise HTTPException(
-                                status_code=402,
-                                detail={
-                                    "error": "payment_failed",
-                                    "message": "Sua assinatura não foi paga. Por favor, atualize suas informações de pagamento para continuar usando a API.",
-                                    "action_url": "/subscription",
-                                    "help": "Verifique seu método de pagamento e tente novamente",
-                                    "suggestions": [
-                                        "Atualize seu método de pagamento",
-                                        "Verifique se há saldo suficiente",
-                                        "Tente usar outro cartão de crédito"
-                                    ]
-                                }
-                            )
+    if user.get('sub_plan'):  # Tem assinatura Stripe válida
+        user['plan'] = user['sub_plan']
+        user['monthly_queries'] = user['sub_monthly_queries']
+
+        # Avisar se está cancelada mas ainda ativa
+        if user.get('sub_status') == 'canceled':
+            logger.info(f"Usuário {user['id']} tem assinatura cancelada mas ainda válida até {user.get('sub_period_end')}")
+        elif user.get('sub_cancel_at_period_end'):
+            logger.info(f"Usuário {user['id']} tem assinatura marcada para cancelar no final do período")
+    else:
+        # Verificar se tem assinatura mas com status problemático (past_due, unpaid, etc)
+        status = user.get('last_status')
 
-                        # PLAN-02: assinatura expirada NÃO bloqueia para sempre —
-                        # o usuário volta ao plano Free (mesmo comportamento que o
-                        # dashboard mostra). Antes: 403 eterno até assinar de novo.
-                        if period_end:
-                            if period_end.tzinfo is None:
-                                period_end = period_end.replace(tzinfo=timezone.utc)
-                            if period_end < datetime.now(timezone.utc):
-                                logger.info(
-                                    f"Usuário {user['id']}: assinatura expirada em "
-                                    f"{period_end.strftime('%d/%m/%Y')} — caindo para o plano Free"
-                                )
-
-                    # Nenhuma assinatura encontrada ou status inválido
-                    # Plano Free — limites lidos da tabela clientes.plans (configurável no admin)
-                    free_cfg = plan_service.get('free')
-                    user['plan'] = 'free'
-                    user['monthly_queries'] = free_cfg['monthly_queries']
-                    user['queries_remaining'] = free_cfg['monthly_queries']  # Inicialmente
-
-                    logger.info(f"Usuário {user['id']} usando plano Free (sem assinatura Stripe ativa)")
-
-                else: # Tem assinatura Stripe válida
-                    user['plan'] = subscription[3]  # plan_name
-                    user['monthly_queries'] = subscription[4]  # monthly_queries
-                    plan_id = subscription[5]
-
-                    # Avisar se está cancelada mas ainda ativa
-                    if subscription[0] == 'canceled':
-                        logger.info(f"Usuário {user['id']} tem assinatura cancelada mas ainda válida até {subscription[1]}")
-                    elif subscription[2]:  # cancel_at_period_end
-                        logger.info(f"Usuário {user['id']} tem assinatura marcada para cancelar no final do período")
-
-                # VERIFICAÇÃO DE LIMITE MENSAL DE CONSULTAS
-                # 🔓 ADMIN TEM CONSULTAS ILIMITADAS - pular verificação de limite
-                if user.get('role') != 'admin':
-                    month_year = current_month_year()  # QUOTA-TZ: fuso do Brasil
-                    monthly_limit = user.get('monthly_queries') or plan_service.get('free')['monthly_queries']
-
-                    # PLAN-01: checagem + incremento ATÔMICOS (evita corrida sob alta concorrência).
-                    # - 1ª consulta do mês: INSERT entra com 1.
-                    # - Demais: só incrementa se ainda abaixo do limite (cláusula WHERE).
-                    # - Se nada retornar no conflito => já estava no limite (sem incrementar).
-                    cursor.execute("""
-                        INSERT INTO clientes.monthly_usage (user_id, month_year, queries_used, last_query_at)
-                        VALUES (%s, %s, 1, NOW())
-                        ON CONFLICT (user_id, month_year)
-                        DO UPDATE SET
-                            queries_used = clientes.monthly_usage.queries_used + 1,
-                            last_query_at = NOW()
-                        WHERE clientes.monthly_usage.queries_used < %s
-                        RETURNING queries_used
-                    """, (user['id'], month_year, monthly_limit))
-                    incremented = cursor.fetchone()
-
-                    # Verificar se excedeu o limite (nada retornado = já no teto)
-                    if incremented is None:
-                        cursor.execute("""
-                            SELECT queries_used FROM clientes.monthly_usage
-                            WHERE user_id = %s AND month_year = %s
-                        """, (user['id'], month_year))
-                        cur_usage = cursor.fetchone()
-                        queries_used = cur_usage[0] if cur_usage else monthly_limit
-
-                        # Calcular data de renovação
-                        period_end = subscription[1] if subscription else None  # Pega do subscription se existir
-                        renewal_date = "N/A"
-                        if period_end:
-                            if period_end.tzinfo is None:
-                                period_end = period_end.replace(tzinfo=timezone.utc)
-                            renewal_date = period_end.strftime('%d/%m/%Y')
-                        elif user.get('plan') == 'free':
-                            # Para plano Free, renova no início do próximo mês
-                            now = datetime.now(timezone.utc)
-                            next_month = now.replace(day=1, month=now.month % 12 + 1, year=now.year if now.month < 12 else now.year + 1)
-                            renewal_date = next_month.strftime('%d/%m/%Y')
-
-                        raise HTTPException(
-                            status_code=429,
-                            detail={
-                                "error": "monthly_limit_exceeded",
-                                "message": f"Você atingiu o limite mensal de {monthly_limit:,} consultas do plano {user.get('plan', 'free')}.",
-                                "queries_used": queries_used,
-                                "monthly_limit": monthly_limit,
-                                "current_plan": user.get('plan', 'free'),
-                                "renewal_date": renewal_date,
-                                "action_url": "/home#pricing",
-                                "help": f"Seu plano será renovado em {renewal_date}. Para continuar usando a API agora, faça upgrade para um plano superior com mais consultas mensais.",
-                                "suggestions": [
-                                    "Aguarde a renovação do plano",
-                                    "Faça upgrade para um plano com mais consultas",
-                                    "Entre em contato com o suporte para opções personalizadas"
-                                ]
-                            }
-                        )
-
-                    # Armazenar informações de uso para logging
-                    new_used = incremented[0]
-                    user['queries_used'] = new_used
-                    user['queries_remaining'] = max(0, monthly_limit - new_used)
-                else:
-                    # Admin tem acesso ilimitado - configurar valores especiais
-                    logger.info(f"✅ Admin user {user['id']} - unlimited queries (no monthly limit)")
-                    user['queries_used'] = 0
-                    user['queries_remaining'] = 999999999  # Ilimitado
+        # Status com pagamento pendente
+        if status == 'past_due':
+            raise HTTPException(
+                status_code=402,
+                detail={
+                    "error": "payment_past_due",
+                    "message": "Sua assinatura está com pagamento pendente. Por favor, atualize suas informações de pagamento.",
+                    "action_url": "/subscription",
+                    "help": "Acesse a página de assinatura para atualizar seu método de pagamento",
+                    "suggestions": [
+                        "Atualize suas informações de pagamento",
+                        "Verifique se seu cartão não está expirado",
+                        "Entre em contato com seu banco se o problema persistir"
+                    ]
+                }
+            )
 
-            finally:
-                # Garantir que cursor sempre seja fechado
-                cursor.close()
+        # Status não pago
+        if status == 'unpaid':
+            raise HTTPException(
+                status_code=402,
+                detail={
+                    "error": "payment_failed",
+                    "message": "Sua assinatura não foi paga. Por favor, atualize suas informações de pagamento para continuar usando a API.",
+                    "action_url": "/subscription",
+                    "help": "Verifique seu método de pagamento e tente novamente",
+                    "suggestions": [
+                        "Atualize seu método de pagamento",
+                        "Verifique se há saldo suficiente",
+                        "Tente usar outro cartão de crédito"
+                    ]
+                }
+            )
 
-    try:
-        # P0-EVENTLOOP: roda o bloco de banco em threadpool — não bloqueia o event loop
-        await anyio.to_thread.run_sync(_check_subscription_and_quota)
+        # PLAN-02: assinatura expirada NÃO bloqueia para sempre —
+        # o usuário volta ao plano Free (mesmo comportamento que o
+        # dashboard mostra). Antes: 403 eterno até assinar de novo.
+        period_end = user.get('last_period_end')
+        if period_end:
+            if period_end.tzinfo is None:
+                period_end = period_end.replace(tzinfo=timezone.utc)
+            if period_end < datetime.now(timezone.utc):
+                logger.info(
+                    f"Usuário {user['id']}: assinatura expirada em "
+                    f"{period_end.strftime('%d/%m/%Y')} — caindo para o plano Free"
+                )
 
-        # Rastrear uso diario (grafico do dashboard)
-        try:
-            await db_manager.track_usage(user['id'])
-        except Exception as e:
-            logger.error(f"Erro ao rastrear uso diario: {e}")
+        # Nenhuma assinatura encontrada ou status inválido
+        # Plano Free — limites lidos da tabela clientes.plans (configurável no admin)
+        free_cfg = plan_service.get('free')
+        user['plan'] = 'free'
+        user['monthly_queries'] = free_cfg['monthly_queries']
+        user['queries_remaining'] = free_cfg['monthly_queries']  # Inicialmente
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Erro ao verificar assinatura: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail="Erro ao verificar assinatura. Por favor, tente novamente."
-        )
+        logger.info(f"Usuário {user['id']} usando plano Free (sem assinatura Stripe ativa)")
 
-    # Aplicar rate limiting com limites do plano (configuráveis no admin via clientes.plans)
+    # Aplicar rate limiting com limites do plano (configuráveis no admin via clientes.plans).
+    # Antes da cobrança: requisição barrada pelo rate limit não consome cota nem escreve no banco.
     user_plan = user.get('plan', 'free')
     user_role = user.get('role', 'user')
     plan_cfg = plan_service.get(user_plan)
     user['plan_config'] = plan_cfg
-    if user_role == 'admin':
+    if rate_bucket:
+        await rate_limiter.check_bucket_limit(user['id'], rate_bucket, user_plan, user_role)
+    elif user_role == 'admin':
         await rate_limiter.check_rate_limit(user['id'], user_plan, user_role)
     else:
         await rate_limiter.check_rate_limit(
@@ -322,7 +326,82 @@ async def verify_api_key(x_api_key: str = Header(None)):
             burst_limit=plan_cfg['burst_per_min'],
         )
 
-    # O método verify_api_key já incrementa automaticamente os contadores
+    # VERIFICAÇÃO DE LIMITE MENSAL DE CONSULTAS
+    # 🔓 ADMIN TEM CONSULTAS ILIMITADAS - sem cota (só last_used + uso diário)
+    is_admin = user_role == 'admin'
+    monthly_limit = None
+    if not is_admin:
+        monthly_limit = user.get('monthly_queries') or plan_service.get('free')['monthly_queries']
+
+    try:
+        # PLAN-01: checagem + incremento ATÔMICOS da cota (script Lua no Redis;
+        # sem Redis, upsert com WHERE no banco). last_used da key e uso diário
+        # (gráfico do dashboard) vão para o buffer write-behind.
+        charged = await usage_buffer.charge_request(
+            key_hash, user['id'], current_month_year(), monthly_limit, cost
+        )
+    except Exception as e:
+        logger.error(f"Erro ao verificar assinatura: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="Erro ao verificar assinatura. Por favor, tente novamente."
+        )
+
+    if not charged or not charged['key_ok']:
+        # Key revogada depois de entrar no cache
+        auth_cache.invalidate(key_hash)
+        raise HTTPException(
+            status_code=401,
+            detail="API Key inválida ou expirada"
+        )
+
+    if is_admin:
+        # Admin tem acesso ilimitado - configurar valores especiais
+        user['queries_used'] = 0
+        user['queries_remaining'] = 999999999  # Ilimitado
+        return user
+
+    # Verificar se excedeu o limite (nada retornado = já no teto)
+    if charged['queries_used'] is None:
+        queries_used = charged['current_used'] if charged['current_used'] is not None else monthly_limit
+
+        # Calcular data de renovação
+        period_end = user.get('sub_period_end')  # Pega do subscription se existir
+        renewal_date = "N/A"
+        if period_end:
+            if period_end.tzinfo is None:
+                period_end = period_end.replace(tzinfo=timezone.utc)
+            renewal_date = period_end.strftime('%d/%m/%Y')
+        elif user.get('plan') == 'free':
+            # Para plano Free, renova no início do próximo mês
+            now = datetime.now(timezone.utc)
+            next_month = now.replace(day=1, month=now.month % 12 + 1, year=now.year if now.month < 12 else now.year + 1)
+            renewal_date = next_month.strftime('%d/%m/%Y')
+
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "error": "monthly_limit_exceeded",
+                "message": f"Você atingiu o limite mensal de {monthly_limit:,} consultas do plano {user.get('plan', 'free')}.",
+                "queries_used": queries_used,
+                "queries_requested": cost,
+                "monthly_limit": monthly_limit,
+                "current_plan": user.get('plan', 'free'),
+                "renewal_date": renewal_date,
+                "action_url": "/home#pricing",
+                "help": f"Seu plano será renovado em {renewal_date}. Para continuar usando a API agora, faça upgrade para um plano superior com mais consultas mensais.",
+                "suggestions": [
+                    "Aguarde a renovação do plano",
+                    "Faça upgrade para um plano com mais consultas",
+                    "Entre em contato com o suporte para opções personalizadas"
+                ]
+            }
+        )
+
+    # Armazenar informações de uso para logging
+    new_used = charged['queries_used']
+    user['queries_used'] = new_used
+    user['queries_remaining'] = max(0, monthly_limit - new_used)
     return user
 
 @router.get("/", response_model=HealthCheck)
@@ -374,10 +453,117 @@ async def get_stats(current_user: dict = Depends(get_current_user)):
         logger.error(f"Erro ao obter estatísticas: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Colunas da consulta por CNPJ (/cnpj/{cnpj} e /cnpj/bulk); a última é a
+# lista de CNAEs secundários, resolvida em fetch_cnae_descriptions
+CNPJ_COLUMNS = [
+    'cnpj_completo', 'identificador_matriz_filial', 'razao_social',
+    'nome_fantasia', 'situacao_cadastral', 'data_situacao_cadastral',
+    'motivo_situacao_cadastral_desc', 'data_inicio_atividade',
+    'cnae_fiscal_principal', 'cnae_principal_desc',
+    'tipo_logradouro', 'logradouro', 'numero', 'complemento', 'bairro',
+    'cep', 'uf', 'municipio_desc', 'ddd_1', 'telefone_1',
+    'correio_eletronico', 'natureza_juridica', 'natureza_juridica_desc',
+    'porte_empresa', 'capital_social', 'opcao_simples', 'opcao_mei', 'cnae_fiscal_secundaria'
+]
+CNPJ_SELECT = ", ".join(CNPJ_COLUMNS)
+
+def secondary_cnae_codes(value: Optional[str]) -> List[str]:
+    """'6201501,6202300' -> ['6201501', '6202300']"""
+    if not value:
+        return []
+    return [c.strip() for c in value.split(',') if c.strip()]
+
+async def fetch_cnae_descriptions(conn, codigos) -> dict:
+    """
+    {codigo: descricao} dos CNAEs pedidos. Vem do ReferenceRegistry em memória;
+    só se ele não carregou, UMA consulta para N estabelecimentos.
+    """
+    if not codigos:
+        return {}
+    if await reference_registry.ensure_fresh():
+        return reference_registry.descriptions('cnaes', codigos)
+    cursor = conn.cursor()
+    await cursor.execute(
+        "SELECT codigo, descricao FROM cnaes WHERE codigo = ANY(%s)", (list(codigos),)
+    )
+    rows = await cursor.fetchall()
+    await cursor.close()
+    return dict(rows)
+
+def row_to_estabelecimento(row, cnaes: dict) -> EstabelecimentoCompleto:
+    """Linha de CNPJ_SELECT -> EstabelecimentoCompleto (cnaes: {codigo: descricao})."""
+    data = dict(zip(CNPJ_COLUMNS, row))
+    cnpj = data['cnpj_completo']
+    data['cnpj_basico'] = cnpj[:8]
+    data['cnpj_ordem'] = cnpj[8:12]
+    data['cnpj_dv'] = cnpj[12:14]
+
+    # Converter datas para string (formato ISO)
+    if data.get('data_situacao_cadastral'):
+        data['data_situacao_cadastral'] = str(data['data_situacao_cadastral'])
+    if data.get('data_inicio_atividade'):
+        data['data_inicio_atividade'] = str(data['data_inicio_atividade'])
+
+    data['cnae_secundarios_completos'] = [
+        {'codigo': c, 'descricao': cnaes[c]}
+        for c in sorted(set(secondary_cnae_codes(data.get('cnae_fiscal_secundaria'))))
+        if c in cnaes
+    ]
+    return EstabelecimentoCompleto(**data)
+
+async def load_cnpj(cleaned_cnpj: str, cnpj: Optional[str] = None):
+    """
+    Carrega um CNPJ (14 dígitos) da MV e grava o corpo no cache. Misses
+    simultâneos do mesmo CNPJ viram uma consulta só (ver single_flight).
+    HTTPException 404 se não existir. Usado pela rota e pelo warmup_cache.py.
+    """
+    cnpj = cnpj or cleaned_cnpj
+    cache_key = f"cnpj:{cleaned_cnpj}"
+
+    # ASYNC-DB: consulta assíncrona no pool psycopg 3 (não ocupa o event loop)
+    async def _fetch_cnpj():
+        async with async_db_manager.connection() as conn:
+            cursor = conn.cursor()
+            await cursor.execute(
+                f"SELECT {CNPJ_SELECT} FROM vw_estabelecimentos_completos WHERE cnpj_completo = %s",
+                (cleaned_cnpj,)
+            )
+            result = await cursor.fetchone()
+            await cursor.close()
+
+            if not result:
+                raise HTTPException(
+                    status_code=404,
+                    detail={
+                        "error": "cnpj_not_found",
+                        "message": f"CNPJ {cnpj} não foi encontrado em nossa base de dados.",
+                        "cnpj": cnpj,
+                        "help": "Verifique se o CNPJ está correto. Nossa base é atualizada periodicamente com dados oficiais da Receita Federal.",
+                        "suggestions": [
+                            "Confirme se o CNPJ está digitado corretamente",
+                            "Verifique se o estabelecimento está ativo na Receita Federal",
+                            "Entre em contato com o suporte se acredita que este CNPJ deveria estar disponível"
+                        ]
+                    }
+                )
+
+            # CNAEs secundários com descrições
+            cnaes = await fetch_cnae_descriptions(conn, secondary_cnae_codes(result[-1]))
+            return row_to_estabelecimento(result, cnaes)
+
+    async def _load_cnpj():
+        resultado = CachedBody.from_value(await _fetch_cnpj())
+        # Salva no cache (1 hora) o corpo JSON final, já comprimido
+        set_cache(cache_key, resultado, minutes=60)
+        return resultado
+
+    return await single_flight.load(cache_key, _load_cnpj, get_from_cache)
+
 @router.get("/cnpj/{cnpj}")
 async def get_cnpj_data(
     cnpj: str,
-    user: dict = Depends(verify_api_key)
+    request: Request,
+    user: dict = Depends(verify_api_key_conditional())
 ):
     """
     Consulta dados de CNPJ
@@ -429,120 +615,326 @@ async def get_cnpj_data(
                 }
             )
 
+        # Popularidade (amostrada) para o aquecimento pós-ETL
+        hot_keys.record(HOT_CNPJ, cleaned_cnpj)
+
         # Verifica cache primeiro
         cache_key = f"cnpj:{cleaned_cnpj}"
         cached = get_from_cache(cache_key)
         if cached:
             logger.info(f"Cache hit para CNPJ {cleaned_cnpj}")
-            return cached
+            if isinstance(cached, CachedBody):
+                return cached_json_response(request, cached)
+            return etag_response(request, cached)
 
-        # P0-EVENTLOOP: banco em threadpool (closure síncrona)
-        def _fetch_cnpj():
-            with db_manager.get_connection() as conn:
-                cursor = conn.cursor()
+        resultado = await load_cnpj(cleaned_cnpj, cnpj)
+        if isinstance(resultado, CachedBody):
+            return cached_json_response(request, resultado)
+        return etag_response(request, resultado)
 
-                query = """
-                SELECT 
-                    cnpj_completo, identificador_matriz_filial, razao_social,
-                    nome_fantasia, situacao_cadastral, data_situacao_cadastral,
-                    motivo_situacao_cadastral_desc, data_inicio_atividade,
-                    cnae_fiscal_principal, cnae_principal_desc,
-                    tipo_logradouro, logradouro, numero, complemento, bairro,
-                    cep, uf, municipio_desc, ddd_1, telefone_1,
-                    correio_eletronico, natureza_juridica, natureza_juridica_desc,
-                    porte_empresa, capital_social, opcao_simples, opcao_mei, cnae_fiscal_secundaria
-                FROM vw_estabelecimentos_completos
-                WHERE cnpj_completo = %s
-            """
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro ao buscar CNPJ {cleaned_cnpj}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-                cursor.execute(query, (cleaned_cnpj,))
-                result = cursor.fetchone()
-                cursor.close()
-
-                if not result:
-                    raise HTTPException(
-                        status_code=404,
-                        detail={
-                            "error": "cnpj_not_found",
-                            "message": f"CNPJ {cnpj} não foi encontrado em nossa base de dados.",
-                            "cnpj": cnpj,
-                            "help": "Verifique se o CNPJ está correto. Nossa base é atualizada periodicamente com dados oficiais da Receita Federal.",
-                            "suggestions": [
-                                "Confirme se o CNPJ está digitado corretamente",
-                                "Verifique se o estabelecimento está ativo na Receita Federal",
-                                "Entre em contato com o suporte se acredita que este CNPJ deveria estar disponível"
-                            ]
-                        }
-                    )
-
-                columns = [
-                    'cnpj_completo', 'identificador_matriz_filial', 'razao_social',
-                    'nome_fantasia', 'situacao_cadastral', 'data_situacao_cadastral',
-                    'motivo_situacao_cadastral_desc', 'data_inicio_atividade',
-                    'cnae_fiscal_principal', 'cnae_principal_desc',
-                    'tipo_logradouro', 'logradouro', 'numero', 'complemento', 'bairro',
-                    'cep', 'uf', 'municipio_desc', 'ddd_1', 'telefone_1',
-                    'correio_eletronico', 'natureza_juridica', 'natureza_juridica_desc',
-                    'porte_empresa', 'capital_social', 'opcao_simples', 'opcao_mei', 'cnae_fiscal_secundaria'
-                ]
+@router.post("/cnpj/bulk")
+async def get_cnpj_bulk(
+    body: CNPJBulkRequest,
+    x_api_key: str = Header(None)
+):
+    """
+    Consulta até 1.000 CNPJs numa requisição (enriquecimento de CRM).
+    Cache: UM MGET; faltantes: UMA consulta com ANY(%s) + UMA de CNAEs
+    secundários; backfill do cache num pipeline. A cota é cobrada uma vez,
+    pelo número de CNPJs válidos distintos (como se fossem N consultas
+    avulsas); CNPJs malformados voltam em 'invalid' sem cobrança.
+    """
+    valid, invalid, seen = [], [], set()
+    for raw in body.cnpjs:
+        cleaned = clean_cnpj(raw)
+        if len(cleaned) != 14 or not cleaned.isdigit():
+            invalid.append(raw)
+        elif cleaned not in seen:
+            seen.add(cleaned)
+            valid.append(cleaned)
+
+    if not valid:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "invalid_cnpj_format",
+                "message": "Nenhum CNPJ válido na lista.",
+                "invalid": invalid,
+                "help": "Forneça CNPJs com 14 dígitos numéricos. Exemplo: 00000000000191 ou 00.000.000/0001-91"
+            }
+        )
 
-                data = dict(zip(columns, result))
-                data['cnpj_basico'] = cleaned_cnpj[:8]
-                data['cnpj_ordem'] = cleaned_cnpj[8:12]
-                data['cnpj_dv'] = cleaned_cnpj[12:14]
-
-                # Converter datas para string (formato ISO)
-                if data.get('data_situacao_cadastral'):
-                    data['data_situacao_cadastral'] = str(data['data_situacao_cadastral'])
-                if data.get('data_inicio_atividade'):
-                    data['data_inicio_atividade'] = str(data['data_inicio_atividade'])
-
-                # Buscar CNAEs secundários com descrições
-                cnae_secundarios = []
-                if data.get('cnae_fiscal_secundaria'):
-                    codigos = data['cnae_fiscal_secundaria'].split(',')
-                    codigos = [c.strip() for c in codigos if c.strip()]
-
-                    if codigos:
-                        placeholders = ','.join(['%s'] * len(codigos))
-                        query_cnaes = f"""
-                            SELECT codigo, descricao
-                            FROM cnaes
-                            WHERE codigo IN ({placeholders})
-                            ORDER BY codigo
-                        """
-                        cursor = conn.cursor()
-                        cursor.execute(query_cnaes, codigos)
-                        cnaes_results = cursor.fetchall()
-                        cursor.close()
-
-                        cnae_secundarios = [
-                            {'codigo': row[0], 'descricao': row[1]}
-                            for row in cnaes_results
-                        ]
+    user = await authorize_api_key(x_api_key, cost=len(valid))
 
-                data['cnae_secundarios_completos'] = cnae_secundarios
+    try:
+        await log_query(
+            user_id=user['id'],
+            action='cnpj_bulk_query',
+            resource='cnpj/bulk',
+            details={'plan': user.get('plan', 'free'), 'cnpjs': len(valid)}
+        )
+
+        found = {
+            key[len('cnpj:'):]: cached_value(value)
+            for key, value in get_many_from_cache([f"cnpj:{c}" for c in valid]).items()
+        }
+        misses = [c for c in valid if c not in found]
+
+        if misses:
+            async with async_db_manager.connection() as conn:
+                cursor = conn.cursor()
+                await cursor.execute(
+                    f"SELECT {CNPJ_SELECT} FROM vw_estabelecimentos_completos WHERE cnpj_completo = ANY(%s)",
+                    (misses,)
+                )
+                rows = await cursor.fetchall()
+                await cursor.close()
 
-                return EstabelecimentoCompleto(**data)
+                codigos = {c for row in rows for c in secondary_cnae_codes(row[-1])}
+                cnaes = await fetch_cnae_descriptions(conn, sorted(codigos))
 
-        resultado = await anyio.to_thread.run_sync(_fetch_cnpj)
+            fetched = {row[0]: row_to_estabelecimento(row, cnaes) for row in rows}
+            found.update(fetched)
+            # Mesmas chaves/TTL do /cnpj/{cnpj}: o cache é compartilhado
+            set_many_cache({f"cnpj:{c}": CachedBody.from_value(v) for c, v in fetched.items()}, minutes=60)
 
-        # Salva no cache (1 hora)
-        set_cache(cache_key, resultado, minutes=60)
+        logger.info(f"CNPJ bulk: user_id={user['id']}, pedidos={len(valid)}, "
+                    f"cache={len(valid) - len(misses)}, encontrados={len(found)}")
 
-        return resultado
+        return {
+            'total': len(valid),
+            'found': len(found),
+            'items': [found[c] for c in valid if c in found],
+            'not_found': [c for c in valid if c not in found],
+            'invalid': invalid,
+        }
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Erro ao buscar CNPJ {cleaned_cnpj}: {e}")
+        logger.error(f"Erro na consulta em lote de CNPJs: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+class SearchKeys(NamedTuple):
+    filters_key: str
+    sort_kind: str
+    cursor_key: Optional[list]
+    offset: int
+    page_key: str
+    count_key: str
+
+
+def search_keys(filters: dict, limit: int, offset: int = 0, cursor: Optional[str] = None) -> SearchKeys:
+    """
+    Chaves de cache e ordenação de uma página do /search.
+    Com cursor (keyset), o offset é ignorado; cursor inválido => 400.
+    """
+    # CACHE-SEARCH: a base muda 1x/mês — buscas idênticas não repetem scans trigram.
+    # As chaves vivem no namespace da geração do dataset (bump no fim do ETL).
+    uf = filters.get('uf')
+    filters_norm = {
+        'rs': filters.get('razao_social'), 'nf': filters.get('nome_fantasia'),
+        'cnae': filters.get('cnae'), 'mun': filters.get('municipio'),
+        'uf': uf.upper() if uf else None, 'sit': filters.get('situacao'),
+        'dmin': filters.get('data_inicio_atividade_min'), 'dmax': filters.get('data_inicio_atividade_max'),
+    }
+    for name, field in (('cnae2', 'cnae_secundario'), ('cnaeq', 'cnae_qualquer')):
+        if filters.get(field) is not None:
+            filters_norm[name] = parse_cnae_codes(filters[field], field)
+    if filters.get('q') is not None:
+        filters_norm['q'] = build_tsquery(filters['q'])  # "Construção" e "construcao": mesma chave
+        if filters_norm['q'] is None:
+            raise HTTPException(status_code=400, detail="q deve conter ao menos uma palavra (letras ou números)")
+    filters_key = hashlib.md5(
+        json.dumps(filters_norm, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    # KEYSET: com cursor, page/offset são ignorados — a página começa logo após
+    # a chave (razao_social, cnpj_completo) ou (cnpj_completo) da última linha.
+    if filters.get('q') is not None:
+        sort_kind = SORT_RANK
+    elif filters.get('razao_social') or filters.get('nome_fantasia'):
+        sort_kind = SORT_RAZAO
+    else:
+        sort_kind = SORT_CNPJ
+    cursor_key = None
+    if cursor and sort_kind == SORT_RANK:
+        raise HTTPException(status_code=400, detail="cursor não é suportado na busca por relevância (q): use page/offset")
+    if sort_kind == SORT_RANK:
+        check_rank_offset(offset)
+    if cursor:
+        try:
+            decoded = decode_cursor(cursor, filters_key)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"cursor inválido: {e}")
+        if decoded['sort'] != sort_kind:
+            raise HTTPException(status_code=400, detail="cursor inválido: ordenação não corresponde aos filtros")
+        cursor_key = decoded['values']
+        offset = 0
+        page_key = f"search:{filters_key}:{limit}:k:{hashlib.md5(cursor.encode()).hexdigest()}"
+    else:
+        page_key = f"search:{filters_key}:{limit}:{offset}"
+    return SearchKeys(filters_key, sort_kind, cursor_key, offset, page_key, f"search:count:{filters_key}")
+
+
+async def load_search_page(filters: dict, effective_limit: int, keys: SearchKeys, cached_total=None):
+    """
+    Executa a busca (total + página) e grava os dois no cache. `filters` usa
+    os nomes dos parâmetros da rota (razao_social, uf, ...). Misses
+    simultâneos da mesma página viram uma consulta só (ver single_flight).
+    Usado pela rota e pelo warmup_cache.py.
+    """
+    _filters_key, sort_kind, cursor_key = keys.filters_key, keys.sort_kind, keys.cursor_key
+    effective_offset, search_cache_key, count_key = keys.offset, keys.page_key, keys.count_key
+    to_cache = {}
+
+    # ASYNC-DB: todo o trabalho de banco é await no pool assíncrono
+    async def _do_search():
+        # Município por nome -> códigos (tabela auxiliar em memória) antes de pegar conexão
+        municipio_codigos = await resolve_municipio_codigos(filters.get('municipio'))
+        async with async_db_manager.connection() as conn:
+            cursor = conn.cursor()
+
+            conditions, params = build_search_conditions(**filters, municipio_codigos=municipio_codigos)
+
+            where_clause = " AND ".join(conditions) if conditions else "1=1"
+
+            # CONTAGEM RÁPIDA (P0-502): NUNCA usar COUNT(*) na MV aqui.
+            # Na MV de ~72M linhas, COUNT(*) com filtro varre milhões de linhas e
+            # ESTOURA o statement_timeout (60s) -> o cliente (ex: imobpro, fetch 25s)
+            # recebe 502. Filtros só por igualdade (uf, cnae, município por código,
+            # situação, anos inteiros) têm total EXATO no rollup search_facet_counts
+            # (construído no ETL). Com filtros de texto, usamos a ESTIMATIVA do
+            # planner (instantânea, mas pode errar muito em filtros combinados).
+            # Cache por filtros (TTL 6h; base muda ~1x/mês).
+            total_exact = False
+            if isinstance(cached_total, dict):
+                total, total_exact = int(cached_total['total']), bool(cached_total['exact'])
+            elif cached_total is not None:
+                total = int(cached_total)
+            else:
+                total = None
+                rollup = build_rollup_conditions(**filters, municipio_codigos=municipio_codigos)
+                if rollup is not None:
+                    total = await exact_total(conn, *rollup)
+                    total_exact = total is not None
+                if total is None:
+                    try:
+                        import json as _json
+                        # EXPLAIN não aceita bind no servidor: parâmetros interpolados no cliente.
+                        # Savepoint: se a estimativa falhar, a transação segue válida para a busca.
+                        async with conn.transaction():
+                            explain_cursor = async_db_manager.client_cursor(conn)
+                            await explain_cursor.execute(
+                                f"EXPLAIN (FORMAT JSON) SELECT 1 FROM vw_estabelecimentos_completos WHERE {where_clause}",
+                                params,
+                            )
+                            er = await explain_cursor.fetchone()
+                            await explain_cursor.close()
+                        raw = er[0] if er else None
+                        plan = (_json.loads(raw) if isinstance(raw, str) else raw) or []
+                        total = int(plan[0]['Plan'].get('Plan Rows', 0)) if plan else 0
+                        logger.info(f"⚡ Total estimado (planner): ~{total} registros")
+                    except Exception as e:
+                        logger.warning(f"Estimativa de total falhou: {e}; usando 0")
+                        total = 0
+                to_cache[count_key] = {'total': total, 'exact': total_exact}
+
+            if sort_kind == SORT_RANK and total > SEARCH_RANK_CANDIDATES:
+                # Só até essa profundidade é paginável (check_rank_offset)
+                total, total_exact = SEARCH_RANK_CANDIDATES, False
+
+            # Evitar ORDER BY pesado em buscas amplas (ex: UF+município sem texto),
+            # que pode estourar statement timeout ao ordenar centenas de milhares de linhas.
+            # cnpj_completo desempata razao_social: ordem total e estável (exigida pelo keyset).
+            if sort_kind == SORT_RAZAO:
+                order_clause = "ORDER BY razao_social, cnpj_completo"
+            else:
+                order_clause = "ORDER BY cnpj_completo"
+
+            page_where, page_params = where_clause, list(params)
+            if cursor_key is not None:
+                ks_sql, ks_params = keyset_condition(sort_kind, cursor_key)
+                page_where = f"({where_clause}) AND {ks_sql}"
+                page_params += ks_params
+
+            if sort_kind == SORT_RANK:
+                # Busca textual: todas as linhas que casam, ordenadas por relevância
+                data_query = ranked_page_query(SEARCH_SELECT, page_where)
+                page_params = [build_tsquery(filters['q'])] + page_params
+            else:
+                data_query = f"""
+                    SELECT {SEARCH_SELECT}
+                    FROM vw_estabelecimentos_completos
+                    WHERE {page_where}
+                    {order_clause}
+                    LIMIT %s OFFSET %s
+                """
+
+            logger.debug(f"📊 Query WHERE: {page_where} | Params: {page_params} | "
+                         f"Limit: {effective_limit}, Offset: {effective_offset}")
+
+            await cursor.execute(data_query, page_params + [effective_limit, effective_offset])
+            results = await cursor.fetchall()
+            await cursor.close()
+
+            # Dicts puros (sem overhead de validação Pydantic em até 1.000 linhas)
+            items = []
+            for row in results:
+                data = row_to_search_item(row)
+                # CNAEs secundários têm endpoint próprio (mantém a busca leve)
+                data['cnae_secundarios_completos'] = []
+                items.append(data)
+
+            total_pages = (total + effective_limit - 1) // effective_limit
+
+            # Página cheia => pode haver próxima; cursor aponta para a última linha
+            next_cursor = None
+            if items and len(items) == effective_limit and sort_kind != SORT_RANK:
+                last = items[-1]
+                if sort_kind == SORT_RAZAO:
+                    key_values = [last['razao_social'], last['cnpj_completo']]
+                else:
+                    key_values = [last['cnpj_completo']]
+                next_cursor = encode_cursor(sort_kind, key_values, _filters_key)
+
+            return {
+                'total': total,
+                'total_exact': total_exact,
+                'page': None if cursor_key is not None else effective_offset // effective_limit + 1,
+                'per_page': effective_limit,
+                'total_pages': total_pages,
+                'items': items,
+                'next_cursor': next_cursor,
+            }
+
+    async def _load_search():
+        try:
+            # Página guardada como corpo JSON final (gzip): hits não re-serializam
+            body = CachedBody.from_value(await _do_search())
+            to_cache[search_cache_key] = body
+            return body
+        finally:
+            # Total calculado fica no cache mesmo se a página falhou (retry barato)
+            set_many_cache(to_cache, minutes=60, minutes_by_key={count_key: 360})
+
+    return await single_flight.load(search_cache_key, _load_search, get_from_cache)
+
+
 @router.get("/search")
 async def search_companies(
+    request: Request,
     razao_social: str = Query(None, description="Razão social da empresa"),
     nome_fantasia: str = Query(None, description="Nome fantasia da empresa"),
+    q: str = Query(None, description="Busca textual em razão social + nome fantasia (sem acentos, por relevância)"),
     cnae: str = Query(None, description="CNAE principal"),
+    cnae_secundario: str = Query(None, description="CNAE secundário (um ou vários, separados por vírgula)"),
+    cnae_qualquer: str = Query(None, description="CNAE principal OU secundário (um ou vários, separados por vírgula)"),
     municipio: str = Query(None, description="Município"),
     uf: str = Query(None, description="UF"),
     situacao: str = Query(None, description="Situação cadastral"),
@@ -552,11 +944,20 @@ async def search_companies(
     per_page: int = Query(None, ge=1, le=1000, description="Itens por página (compatível com integrações legadas)"),
     limit: int = Query(100, ge=1, le=1000),
     offset: int = Query(0, ge=0),
+    cursor: str = Query(None, description="Cursor opaco (next_cursor da página anterior) — paginação keyset"),
     current_user: dict = Depends(verify_api_key)
 ):
     """
     Pesquisa empresas por múltiplos critérios
     Acesso controlado por rate limiting baseado no plano do usuário
+
+    Paginação: page/per_page e limit/offset continuam funcionando, mas ficam
+    caros em páginas profundas (OFFSET lê e descarta as linhas anteriores).
+    Para varrer muitos resultados, use `cursor` com o `next_cursor` retornado.
+
+    `q`: busca textual (todas as palavras, sem diferenciar acentos) ordenada
+    por relevância (ts_rank; desempate por CNPJ); offset até
+    SEARCH_RANK_CANDIDATES, sem cursor. razao_social/nome_fantasia seguem como filtro por trecho.
     """
     # Gate por plano: busca avançada + tamanho máximo de página (config no admin)
     require_feature(current_user, 'can_search', 'Busca avançada')
@@ -572,19 +973,26 @@ async def search_companies(
     if page is not None:
         effective_offset = (page - 1) * effective_limit
 
-    # CACHE-SEARCH: a base muda 1x/mês — buscas idênticas não repetem scans trigram.
-    # O ETL invalida 'search:*' no fim de cada carga.
-    _filters_norm = {
-        'rs': razao_social, 'nf': nome_fantasia, 'cnae': cnae, 'mun': municipio,
-        'uf': uf.upper() if uf else None, 'sit': situacao,
-        'dmin': data_inicio_atividade_min, 'dmax': data_inicio_atividade_max,
+    filters = {
+        'razao_social': razao_social, 'nome_fantasia': nome_fantasia, 'cnae': cnae,
+        'municipio': municipio, 'uf': uf, 'situacao': situacao,
+        'data_inicio_atividade_min': data_inicio_atividade_min,
+        'data_inicio_atividade_max': data_inicio_atividade_max,
+        'q': q,
+        'cnae_secundario': cnae_secundario,
+        'cnae_qualquer': cnae_qualquer,
     }
-    _filters_key = hashlib.md5(
-        json.dumps(_filters_norm, sort_keys=True, default=str).encode()
-    ).hexdigest()
-    search_cache_key = f"search:{_filters_key}:{effective_limit}:{effective_offset}"
-    cached = get_from_cache(search_cache_key)
+    keys = search_keys(filters, effective_limit, effective_offset, cursor)
+    if cursor is None and effective_offset == 0:
+        # Popularidade (amostrada) das 1as páginas para o aquecimento pós-ETL
+        hot_keys.record(HOT_SEARCH, search_member(filters, effective_limit))
+    # Página e total no MESMO round trip (MGET); num miss, os dois voltam ao
+    # cache num único pipeline no fim.
+    cached_many = get_many_from_cache([keys.page_key, keys.count_key])
+    cached = cached_many.get(keys.page_key)
     if cached is not None:
+        if isinstance(cached, CachedBody):
+            return cached_json_response(request, cached)
         return cached
 
     # Log de auditoria (não pode derrubar a busca)
@@ -597,7 +1005,10 @@ async def search_companies(
                 'email': current_user.get('email'),
                 'filters': {
                     'razao_social': razao_social,
+                    'q': q,
                     'cnae': cnae,
+                    'cnae_secundario': cnae_secundario,
+                    'cnae_qualquer': cnae_qualquer,
                     'municipio': municipio,
                     'data_inicio_atividade_min': data_inicio_atividade_min,
                     'data_inicio_atividade_max': data_inicio_atividade_max
@@ -607,182 +1018,201 @@ async def search_companies(
     except Exception as e:
         logger.warning(f"log_query falhou (seguindo): {e}")
 
-    # P0-EVENTLOOP: todo o trabalho de banco roda em threadpool (closure síncrona)
-    def _do_search():
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-
-            conditions = []
-            params = []
-
-            if razao_social:
-                conditions.append("razao_social ILIKE %s")
-                params.append(f"%{razao_social}%")
-
-            if nome_fantasia:
-                conditions.append("nome_fantasia ILIKE %s")
-                params.append(f"%{nome_fantasia}%")
-
-            if cnae:
-                conditions.append("cnae_fiscal_principal = %s")
-                params.append(cnae)
-
-            if municipio:
-                municipio_clean = municipio.strip()
-                if municipio_clean.isdigit():
-                    conditions.append("municipio_desc = (SELECT descricao FROM municipios WHERE codigo = %s LIMIT 1)")
-                    params.append(municipio_clean)
-                else:
-                    conditions.append("municipio_desc ILIKE %s")
-                    params.append(f"%{municipio_clean}%")
-
-            if uf:
-                conditions.append("uf = %s")
-                params.append(uf.upper())
-
-            if situacao:
-                conditions.append("situacao_cadastral = %s")
-                params.append(situacao)
-
-            if data_inicio_atividade_min:
-                # Validar formato YYYY-MM-DD
-                try:
-                    from datetime import datetime
-                    datetime.strptime(data_inicio_atividade_min, '%Y-%m-%d')
-                    logger.info(f"🔍 Filtro data_inicio_atividade_min: {data_inicio_atividade_min}")
-                    conditions.append("data_inicio_atividade >= %s")
-                    params.append(data_inicio_atividade_min)
-                except ValueError:
-                    logger.error(f"❌ Data mínima inválida: {data_inicio_atividade_min} (esperado YYYY-MM-DD)")
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"data_inicio_atividade_min deve estar no formato YYYY-MM-DD (ex: 2025-09-01)"
-                    )
-
-            if data_inicio_atividade_max:
-                # Validar formato YYYY-MM-DD
-                try:
-                    from datetime import datetime
-                    datetime.strptime(data_inicio_atividade_max, '%Y-%m-%d')
-                    logger.info(f"🔍 Filtro data_inicio_atividade_max: {data_inicio_atividade_max}")
-                    conditions.append("data_inicio_atividade <= %s")
-                    params.append(data_inicio_atividade_max)
-                except ValueError:
-                    logger.error(f"❌ Data máxima inválida: {data_inicio_atividade_max} (esperado YYYY-MM-DD)")
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"data_inicio_atividade_max deve estar no formato YYYY-MM-DD (ex: 2025-09-02)"
-                    )
+    try:
+        body = await load_search_page(filters, effective_limit, keys, cached_many.get(keys.count_key))
+        if isinstance(body, CachedBody):
+            return cached_json_response(request, body)
+        return body
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro na busca: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
+@router.get("/search/facets")
+async def search_facets(
+    cnae: str = Query(None, description="CNAE principal"),
+    municipio: str = Query(None, description="Código do município (Receita)"),
+    uf: str = Query(None, description="UF"),
+    situacao: str = Query(None, description="Situação cadastral"),
+    data_inicio_atividade_min: str = Query(None, description="Início do ano mínimo (YYYY-01-01)"),
+    data_inicio_atividade_max: str = Query(None, description="Fim do ano máximo (YYYY-12-31)"),
+    facets: str = Query(None, description=f"Facetas separadas por vírgula ({', '.join(FACET_COLUMNS)}); padrão: todas"),
+    limit: int = Query(50, ge=1, le=1000, description="Máximo de valores por faceta"),
+    current_user: dict = Depends(verify_api_key)
+):
+    """
+    Contagens EXATAS por valor (uf, município, cnae, situação, porte, Simples,
+    MEI, ano de início) para os filtros informados, lidas do rollup da carga
+    mensal. Aceita só filtros por igualdade e anos inteiros. Sem `facets`,
+    devolve as facetas que o rollup responde junto com os filtros informados.
+    Município vem pelo código (`value`), com o nome em `label`.
+    """
+    require_feature(current_user, 'can_search', 'Busca avançada')
 
-            # CONTAGEM RÁPIDA (P0-502): NUNCA usar COUNT(*) exato aqui.
-            # Na MV de ~72M linhas, COUNT(*) com filtro varre milhões de linhas e
-            # ESTOURA o statement_timeout (60s) -> o cliente (ex: imobpro, fetch 25s)
-            # recebe 502. Usamos a ESTIMATIVA do planner (instantânea e ~precisa: a MV
-            # tem stats frescas do ANALYZE pós-ETL). Vale p/ QUALQUER filtro
-            # (uf, cnae, município, situação...). Cache por filtros (TTL 6h; base muda ~1x/mês).
-            count_key = f"search:count:{_filters_key}"
-            cached_total = get_from_cache(count_key)
-            if cached_total is not None:
-                total = int(cached_total)
-            else:
-                try:
-                    import json as _json
-                    cursor.execute(
-                        f"EXPLAIN (FORMAT JSON) SELECT 1 FROM vw_estabelecimentos_completos WHERE {where_clause}",
-                        params,
-                    )
-                    er = cursor.fetchone()
-                    raw = er[0] if er else None
-                    plan = (_json.loads(raw) if isinstance(raw, str) else raw) or []
-                    total = int(plan[0]['Plan'].get('Plan Rows', 0)) if plan else 0
-                    logger.info(f"⚡ Total estimado (planner): ~{total} registros")
-                except Exception as e:
-                    logger.warning(f"Estimativa de total falhou: {e}; usando 0")
-                    total = 0
-                set_cache(count_key, total, minutes=360)
+    names = [f.strip() for f in facets.split(',') if f.strip()] if facets else list(FACET_COLUMNS)
+    unknown = [f for f in names if f not in FACET_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Facetas inválidas: {', '.join(unknown)}")
+
+    # Mesma validação de datas da busca
+    build_search_conditions(data_inicio_atividade_min=data_inicio_atividade_min,
+                            data_inicio_atividade_max=data_inicio_atividade_max)
+    rollup = build_rollup_conditions(
+        None, None, cnae, municipio, uf, situacao,
+        data_inicio_atividade_min, data_inicio_atividade_max,
+        municipio_codigos=await resolve_municipio_codigos(municipio),
+    )
+    if rollup is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Facetas aceitam município por código (ou nome, com as tabelas auxiliares "
+                   "carregadas) e datas em anos inteiros (YYYY-01-01 a YYYY-12-31)"
+        )
+    # Rollup em agrupamentos estreitos: nem toda combinação filtro + faceta existe
+    if rollup_group(rollup[0]) is None:
+        raise HTTPException(status_code=400, detail="Combinação de filtros sem contagem pronta (ex.: cnae + município)")
+    answerable = answerable_facets(rollup[0], names)
+    if facets:
+        missing = [f for f in names if f not in answerable]
+        if missing:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Facetas indisponíveis com esses filtros: {', '.join(missing)}"
+            )
+    names = answerable
 
-            # Evitar ORDER BY pesado em buscas amplas (ex: UF+município sem texto),
-            # que pode estourar statement timeout ao ordenar centenas de milhares de linhas.
-            order_clause = "ORDER BY razao_social" if (razao_social or nome_fantasia) else "ORDER BY cnpj_completo"
+    _facets_norm = {
+        'cnae': cnae, 'mun': municipio, 'uf': uf.upper() if uf else None, 'sit': situacao,
+        'dmin': data_inicio_atividade_min, 'dmax': data_inicio_atividade_max,
+        'facets': names, 'limit': limit,
+    }
+    cache_key = "search:facets:" + hashlib.md5(
+        json.dumps(_facets_norm, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    cached = get_from_cache(cache_key)
+    if cached is not None:
+        return cached
 
-            data_query = f"""
-                SELECT 
-                    cnpj_completo, identificador_matriz_filial, razao_social,
-                    nome_fantasia, situacao_cadastral, data_situacao_cadastral,
-                    data_inicio_atividade, cnae_fiscal_principal, cnae_principal_desc,
-                    tipo_logradouro, logradouro, numero, complemento, bairro,
-                    cep, uf, municipio_desc, ddd_1, telefone_1,
-                    correio_eletronico, porte_empresa, capital_social,
-                    opcao_simples, opcao_mei
-                FROM vw_estabelecimentos_completos
-                WHERE {where_clause}
-                {order_clause}
-                LIMIT %s OFFSET %s
-            """
+    try:
+        async with async_db_manager.connection() as conn:
+            total = await exact_total(conn, *rollup)
+            if total is None:
+                raise HTTPException(status_code=503, detail="Contagens indisponíveis (rollup em construção)")
+            counts = await facet_counts(conn, *rollup, names, limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro nas facetas: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-            logger.debug(f"📊 Query WHERE: {where_clause} | Params: {params} | "
-                         f"Limit: {effective_limit}, Offset: {effective_offset}")
+    # Município vem agrupado pelo código; o nome sai da tabela auxiliar
+    await reference_registry.ensure_fresh()
+    label_facets(counts, reference_registry.describe)
 
-            cursor.execute(data_query, params + [effective_limit, effective_offset])
-            results = cursor.fetchall()
-            cursor.close()
+    payload = {'total': total, 'facets': counts}
+    set_cache(cache_key, payload, minutes=360)
+    return payload
 
-            columns = [
-                'cnpj_completo', 'identificador_matriz_filial', 'razao_social',
-                'nome_fantasia', 'situacao_cadastral', 'data_situacao_cadastral',
-                'data_inicio_atividade', 'cnae_fiscal_principal', 'cnae_principal_desc',
-                'tipo_logradouro', 'logradouro', 'numero', 'complemento', 'bairro',
-                'cep', 'uf', 'municipio_desc', 'ddd_1', 'telefone_1',
-                'correio_eletronico', 'porte_empresa', 'capital_social',
-                'opcao_simples', 'opcao_mei'
-            ]
 
-            # Dicts puros (sem overhead de validação Pydantic em até 1.000 linhas)
-            items = []
-            for row in results:
-                data = dict(zip(columns, row))
-                cnpj = data['cnpj_completo']
-                data['cnpj_basico'] = cnpj[:8] if cnpj else ''
-                data['cnpj_ordem'] = cnpj[8:12] if cnpj and len(cnpj) >= 12 else ''
-                data['cnpj_dv'] = cnpj[12:14] if cnpj and len(cnpj) >= 14 else ''
-
-                # Converter datas para string (formato ISO)
-                if data.get('data_situacao_cadastral'):
-                    data['data_situacao_cadastral'] = str(data['data_situacao_cadastral'])
-                if data.get('data_inicio_atividade'):
-                    data['data_inicio_atividade'] = str(data['data_inicio_atividade'])
-                if data.get('capital_social') is not None:
-                    try:
-                        data['capital_social'] = float(data['capital_social'])
-                    except (TypeError, ValueError):
-                        pass
+# EXPORT: varredura completa por cursor de servidor (named cursor) — memória
+# constante no worker, independente do tamanho do resultado. Filtros,
+# codificação e slots por worker em src/api/export.py.
+@router.get("/search/export")
+async def export_search(
+    razao_social: str = Query(None, description="Razão social da empresa"),
+    nome_fantasia: str = Query(None, description="Nome fantasia da empresa"),
+    q: str = Query(None, description="Busca textual em razão social + nome fantasia (sem acentos)"),
+    cnae: str = Query(None, description="CNAE principal"),
+    cnae_secundario: str = Query(None, description="CNAE secundário (um ou vários, separados por vírgula)"),
+    cnae_qualquer: str = Query(None, description="CNAE principal OU secundário (um ou vários, separados por vírgula)"),
+    municipio: str = Query(None, description="Município"),
+    uf: str = Query(None, description="UF"),
+    situacao: str = Query(None, description="Situação cadastral"),
+    data_inicio_atividade_min: str = Query(None, description="Data início atividade mínima (YYYY-MM-DD)"),
+    data_inicio_atividade_max: str = Query(None, description="Data início atividade máxima (YYYY-MM-DD)"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="ndjson (1 JSON por linha) ou csv"),
+    max_rows: int = Query(None, ge=1, description="Teto de linhas exportadas"),
+    current_user: dict = Depends(verify_api_key)
+):
+    """
+    Exporta TODO o resultado de uma busca em streaming (NDJSON ou CSV).
 
-                # CNAEs secundários têm endpoint próprio (mantém a busca leve)
-                data['cnae_secundarios_completos'] = []
+    Mesmos filtros do /search, sem paginação: as linhas saem de um cursor de
+    servidor em lotes de EXPORT_ITERSIZE. A ordem das linhas não é garantida
+    (com `q`, todas as que casam, sem ranquear).
+    """
+    require_feature(current_user, 'can_export', 'Exportação')
+
+    filters = {
+        'razao_social': razao_social, 'nome_fantasia': nome_fantasia, 'cnae': cnae,
+        'municipio': municipio, 'uf': uf, 'situacao': situacao,
+        'data_inicio_atividade_min': data_inicio_atividade_min,
+        'data_inicio_atividade_max': data_inicio_atividade_max,
+        'q': q, 'cnae_secundario': cnae_secundario, 'cnae_qualquer': cnae_qualquer,
+    }
+    # Valida filtros antes de ocupar um slot/conexão
+    conditions, params = export_conditions(filters, await resolve_municipio_codigos(municipio))
+    query = export_query(conditions)
+    row_cap = export_row_cap(max_rows)
 
-                items.append(data)
+    try:
+        await log_query(
+            user_id=current_user['id'],
+            action='export',
+            resource='/search/export',
+            details={'email': current_user.get('email'), 'format': format,
+                     'filters': {k: v for k, v in filters.items() if v}}
+        )
+    except Exception as e:
+        logger.warning(f"log_query falhou (seguindo): {e}")
 
-            total_pages = (total + effective_limit - 1) // effective_limit
+    @contextmanager
+    def _open_rows():
+        with db_manager.get_connection() as conn:
+            setup = conn.cursor()
+            # Cliente lento entre lotes não pode derrubar a transação do cursor
+            setup.execute("SET LOCAL idle_in_transaction_session_timeout = '10min'")
+            setup.close()
 
-            return {
-                'total': total,
-                'page': effective_offset // effective_limit + 1,
-                'per_page': effective_limit,
-                'total_pages': total_pages,
-                'items': items,
-            }
+            named = conn.cursor(name=f"export_{uuid.uuid4().hex}")
+            named.itersize = EXPORT_ITERSIZE
+            try:
+                named.execute(query, params + [row_cap])
+                yield named
+            finally:
+                named.close()
 
+    # O slot é pego no 1º passo do gerador (429 sai daqui) e solto no finally dele
+    gen = stream_export(_open_rows, format, user_id=current_user['id'])
     try:
-        payload = await anyio.to_thread.run_sync(_do_search)
-        set_cache(search_cache_key, payload, minutes=60)
-        return payload
+        first_chunk = await anyio.to_thread.run_sync(next, gen)
     except HTTPException:
+        gen.close()
         raise
     except Exception as e:
-        logger.error(f"Erro na busca: {e}")
+        gen.close()
+        logger.error(f"Erro na exportação: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    except BaseException:
+        # Cancelamento com o cabeçalho já gerado: fecha o gerador (solta o slot)
+        gen.close()
+        raise
+
+    def _body():
+        try:
+            yield first_chunk
+            yield from gen
+        finally:
+            gen.close()
+
+    media_type = "text/csv; charset=utf-8" if format == 'csv' else "application/x-ndjson"
+    filename = f"empresas_{datetime.now(_BR_TZ).strftime('%Y%m%d_%H%M%S')}.{'csv' if format == 'csv' else 'ndjson'}"
+    return StreamingResponse(
+        _body(),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
 
 @router.get("/cnpj/{cnpj}/cnaes-secundarios", response_model=List[CNAEModel])
 async def get_cnaes_secundarios(cnpj: str, user: dict = Depends(verify_api_key)):
@@ -805,7 +1235,8 @@ async def get_cnaes_secundarios(cnpj: str, user: dict = Depends(verify_api_key))
         return cached
 
     try:
-        with db_manager.get_connection() as conn:
+        # ASYNC-DB: await no pool assíncrono — não trava o event loop
+        async with async_db_manager.connection() as conn:
             cursor = conn.cursor()
 
             # Buscar CNAEs secundários do estabelecimento
@@ -815,11 +1246,11 @@ async def get_cnaes_secundarios(cnpj: str, user: dict = Depends(verify_api_key))
                 WHERE cnpj_completo = %s
             """
 
-            cursor.execute(query, (cnpj_clean,))
-            result = cursor.fetchone()
+            await cursor.execute(query, (cnpj_clean,))
+            result = await cursor.fetchone()
 
             if not result or not result[0]:
-                cursor.close()
+                await cursor.close()
                 return []
 
             # Processar códigos de CNAE
@@ -827,23 +1258,14 @@ async def get_cnaes_secundarios(cnpj: str, user: dict = Depends(verify_api_key))
             codigos = [c.strip() for c in codigos if c.strip()]
 
             if not codigos:
-                cursor.close()
+                await cursor.close()
                 return []
 
-            # Buscar descrições
-            placeholders = ','.join(['%s'] * len(codigos))
-            query_cnaes = f"""
-                SELECT codigo, descricao
-                FROM cnaes
-                WHERE codigo IN ({placeholders})
-                ORDER BY codigo
-            """
-
-            cursor.execute(query_cnaes, codigos)
-            cnaes_results = cursor.fetchall()
-            cursor.close()
+            await cursor.close()
 
-            cnaes = [CNAEModel(codigo=row[0], descricao=row[1]) for row in cnaes_results]
+            # Descrições (ReferenceRegistry em memória)
+            descricoes = await fetch_cnae_descriptions(conn, codigos)
+            cnaes = [CNAEModel(codigo=c, descricao=descricoes[c]) for c in sorted(descricoes)]
 
             # Salva no cache (1 hora)
             set_cache(cache_key, cnaes, minutes=60)
@@ -857,7 +1279,11 @@ async def get_cnaes_secundarios(cnpj: str, user: dict = Depends(verify_api_key))
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/cnpj/{cnpj}/socios")
-async def get_socios(cnpj: str, user: dict = Depends(verify_api_key)):
+async def get_socios(
+    cnpj: str,
+    request: Request,
+    user: dict = Depends(verify_api_key_conditional('can_socios', 'Consulta de sócios'))
+):
     """
     Consulta sócios de um CNPJ
     Requer autenticação via API Key no header 'X-API-Key'
@@ -883,9 +1309,11 @@ async def get_socios(cnpj: str, user: dict = Depends(verify_api_key)):
         cached = get_from_cache(cache_key)
         if cached:
             logger.info(f"✓ Cache hit para sócios do CNPJ {cnpj_basico}")
-            return cached
+            return etag_response(request, cached)
 
-        with db_manager.get_connection() as conn:
+        # ASYNC-DB: socios pode ser lento (empresas com centenas de sócios) —
+        # com await o worker segue atendendo as demais requisições
+        async with async_db_manager.connection() as conn:
             cursor = conn.cursor()
 
             # Query completa com JOIN para trazer descrições
@@ -930,12 +1358,12 @@ async def get_socios(cnpj: str, user: dict = Depends(verify_api_key)):
                 LIMIT 1000
             """
 
-            cursor.execute(query, (cnpj_basico,))
-            results = cursor.fetchall()
+            await cursor.execute(query, (cnpj_basico,))
+            results = await cursor.fetchall()
 
             logger.info(f"📊 Encontrados {len(results)} sócios para CNPJ básico {cnpj_basico}")
 
-            cursor.close()
+            await cursor.close()
 
             columns = [
                 'cnpj_basico', 'identificador_socio', 'identificador_socio_desc',
@@ -960,7 +1388,7 @@ async def get_socios(cnpj: str, user: dict = Depends(verify_api_key)):
                 # Salva no cache (30 minutos)
                 set_cache(cache_key, socios, minutes=30)
 
-            return socios
+            return etag_response(request, socios)
 
     except Exception as e:
         logger.error(f"❌ Erro ao buscar sócios do CNPJ {cnpj_basico}: {e}")
@@ -978,7 +1406,8 @@ async def search_socios(
 ):
     require_feature(user, 'can_socios', 'Busca de sócios')
     try:
-        with db_manager.get_connection() as conn:
+        # ASYNC-DB: ILIKE em ~25M sócios pode levar segundos — sem travar o loop
+        async with async_db_manager.connection() as conn:
             cursor = conn.cursor()
 
             conditions = []
@@ -1017,9 +1446,9 @@ async def search_socios(
                 LIMIT %s
             """
 
-            cursor.execute(query, params + [limit])
-            results = cursor.fetchall()
-            cursor.close()
+            await cursor.execute(query, params + [limit])
+            results = await cursor.fetchall()
+            await cursor.close()
 
             columns = [
                 'cnpj_basico', 'identificador_socio', 'nome_socio',
@@ -1041,69 +1470,55 @@ async def search_socios(
 
 @router.get("/cnaes", response_model=List[CNAEModel])
 async def list_cnaes(
-    user: dict = Depends(verify_api_key),
+    request: Request,
+    user: dict = Depends(verify_api_key_conditional()),
     search: Optional[str] = Query(None, description="Buscar na descrição"),
     limit: int = Query(100, ge=1, le=1000)
 ):
-    try:
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-
-            if search:
-                query = """
-                    SELECT codigo, descricao
-                    FROM cnaes
-                    WHERE descricao ILIKE %s
-                    ORDER BY codigo
-                    LIMIT %s
-                """
-                cursor.execute(query, (f"%{search}%", limit))
-            else:
-                query = """
-                    SELECT codigo, descricao
-                    FROM cnaes
-                    ORDER BY codigo
-                    LIMIT %s
-                """
-                cursor.execute(query, (limit,))
-
-            results = cursor.fetchall()
-            cursor.close()
-
-            return [CNAEModel(codigo=row[0], descricao=row[1]) for row in results]
+    # Tabela auxiliar em memória (ReferenceRegistry): sem ida ao Postgres
+    if not await reference_registry.ensure_fresh():
+        raise HTTPException(status_code=503, detail="Tabelas auxiliares indisponíveis")
+    return etag_response(request, reference_registry.cnaes(search, limit))
 
+@router.get("/municipios/{uf}", response_model=List[MunicipioModel])
+async def list_municipios(uf: str, request: Request, user: dict = Depends(verify_api_key_conditional())):
+    # DISTINCT+JOIN em 70M linhas só na 1ª vez de cada UF por carga (ver ReferenceRegistry)
+    try:
+        await reference_registry.ensure_fresh()
+        payload = await reference_registry.municipios_por_uf(uf)
     except Exception as e:
-        logger.error(f"Erro ao listar CNAEs: {e}")
+        logger.error(f"Erro ao listar municípios: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    return etag_response(request, payload)
 
-@router.get("/municipios/{uf}", response_model=List[MunicipioModel])
-async def list_municipios(uf: str, user: dict = Depends(verify_api_key)):
-    # CACHE: DISTINCT+JOIN em 70M linhas — resultado só muda na carga mensal
-    mun_key = f"municipios:{uf.upper()}"
-    cached = get_from_cache(mun_key)
+@router.get("/autocomplete")
+async def autocomplete_companies(
+    q: str = Query(..., description="Início do nome da empresa (mín. 2 caracteres; sem diferenciar acentos)"),
+    limit: int = Query(autocomplete.DEFAULT_LIMIT, ge=1, le=autocomplete.MAX_LIMIT),
+    user: dict = Depends(verify_api_key_autocomplete)
+):
+    """
+    Sugestões de empresas (matrizes) cujo nome começa com `q`, em ordem
+    alfabética. Não consome a cota mensal; tem limite por minuto próprio.
+    Para busca por palavras em qualquer posição, use /search?q=.
+    """
+    prefix = autocomplete.normalize_prefix(q)
+    if prefix is None:
+        return {'items': []}
+    key = autocomplete.cache_key(prefix, limit)
+    cached = get_from_cache(key)
     if cached is not None:
         return cached
 
-    def _list_municipios():
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT DISTINCT m.codigo, m.descricao
-                FROM municipios m
-                INNER JOIN estabelecimentos e ON e.municipio = m.codigo
-                WHERE e.uf = %s
-                ORDER BY m.descricao
-            """, (uf.upper(),))
-            results = cursor.fetchall()
-            cursor.close()
-            return [{"codigo": row[0], "descricao": row[1]} for row in results]
+    async def _load():
+        payload = {'items': await autocomplete.fetch_suggestions(prefix, limit)}
+        set_cache(key, payload, minutes=24 * 60)
+        return payload
 
     try:
-        payload = await anyio.to_thread.run_sync(_list_municipios)
-        set_cache(mun_key, payload, minutes=24 * 60)
-        return payload
+        return await single_flight.load(key, _load, get_from_cache)
     except Exception as e:
-        logger.error(f"Erro ao listar municípios: {e}")
+        logger.error(f"Erro no autocomplete: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.websocket("/ws")
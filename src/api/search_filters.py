@@ -0,0 +1,238 @@
+"""
+Filtros de busca compartilhados sobre vw_estabelecimentos_completos.
+
+Um ÚNICO construtor de WHERE para /search, /search/export (e quem mais filtrar
+a MV): a mesma entrada gera exatamente o mesmo SQL, então paginação, contagem
+e exportação nunca divergem.
+"""
+import logging
+import os
+import re
+import unicodedata
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Colunas devolvidas pela busca (mesma ordem do SELECT)
+SEARCH_COLUMNS = [
+    'cnpj_completo', 'identificador_matriz_filial', 'razao_social',
+    'nome_fantasia', 'situacao_cadastral', 'data_situacao_cadastral',
+    'data_inicio_atividade', 'cnae_fiscal_principal', 'cnae_principal_desc',
+    'tipo_logradouro', 'logradouro', 'numero', 'complemento', 'bairro',
+    'cep', 'uf', 'municipio_desc', 'ddd_1', 'telefone_1',
+    'correio_eletronico', 'porte_empresa', 'capital_social',
+    'opcao_simples', 'opcao_mei'
+]
+SEARCH_SELECT = ", ".join(SEARCH_COLUMNS)
+
+# Busca textual (q): coluna nome_busca da MV = tsvector 'simple' sem acentos de
+# razão social (peso A) + nome fantasia (peso B), com índice GIN. A página é
+# ordenada por ts_rank sobre TODAS as linhas que casam (desempate por
+# cnpj_completo: ordem total e estável entre páginas). O GIN não devolve em
+# ordem de rank, então o custo cresce com o número de linhas que casam — termos
+# comuns ("COMERCIO") sem outros filtros são os mais caros; a página fica no
+# cache. O ORDER BY ... LIMIT vira top-N heapsort: a memória é limitada pela
+# profundidade, e offset + limit nunca passa de SEARCH_RANK_CANDIDATES (400).
+SEARCH_RANK_CANDIDATES = int(os.getenv('SEARCH_RANK_CANDIDATES', '5000'))
+MAX_QUERY_TOKENS = 8
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+TEXT_SEARCH_CONDITION = "nome_busca @@ to_tsquery('simple', %s)"
+
+# CNAEs secundários: a MV guarda cnaes_secundarios (text[], GIN). Pertinência
+# exata no array — LIKE '%6201501%' no texto separado por vírgulas não usa
+# índice e casa trechos de outros códigos.
+MAX_CNAE_CODES = 50
+CNAE_SECONDARY_CONDITION = "cnaes_secundarios && %s::text[]"
+CNAE_ANY_CONDITION = "(cnae_fiscal_principal = ANY(%s::text[]) OR cnaes_secundarios && %s::text[])"
+
+
+def _validate_date(value: str, field: str, example: str):
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        logger.error(f"❌ {field} inválida: {value} (esperado YYYY-MM-DD)")
+        raise HTTPException(
+            status_code=400,
+            detail=f"{field} deve estar no formato YYYY-MM-DD (ex: {example})"
+        )
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas e sem acentos — a mesma forma do unaccent + 'simple' na MV."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def build_tsquery(text: Optional[str], prefix_last: bool = False) -> Optional[str]:
+    """
+    Texto livre -> tsquery 'simple' (todos os termos, AND). Só [a-z0-9] chega
+    ao SQL, então a entrada do usuário nunca quebra a sintaxe do tsquery.
+    prefix_last: o último termo casa por prefixo (digitação incompleta).
+    None se não sobrar termo.
+    """
+    tokens = _TOKEN_RE.findall(normalize_text(text or ''))[:MAX_QUERY_TOKENS]
+    if not tokens:
+        return None
+    if prefix_last:
+        tokens[-1] += ':*'
+    return ' & '.join(tokens)
+
+
+def municipio_condition(municipio: str, codigos: Optional[list] = None) -> tuple[str, list]:
+    """Filtro de município na MV: pelo código (índices compostos) sempre que possível."""
+    municipio_clean = municipio.strip()
+    if municipio_clean.isdigit():
+        return "municipio = %s", [municipio_clean]
+    if codigos is not None:
+        if len(codigos) == 1:
+            return "municipio = %s", [codigos[0]]
+        return "municipio = ANY(%s::text[])", [list(codigos)]
+    return "municipio_desc ILIKE %s", [f"%{municipio_clean}%"]
+
+
+def parse_cnae_codes(value: Optional[str], field: str) -> Optional[list]:
+    """'6201501, 6202300' -> ['6201501', '6202300'] (ordenado, sem repetição). Não numérico => HTTP 400."""
+    if value is None:
+        return None
+    codes = sorted({c.strip() for c in value.split(',') if c.strip()})
+    if not codes or len(codes) > MAX_CNAE_CODES or not all(c.isdigit() for c in codes):
+        raise HTTPException(
+            status_code=400,
+            detail=f"{field} deve ser uma lista de 1 a {MAX_CNAE_CODES} códigos CNAE numéricos separados por vírgula"
+        )
+    return codes
+
+
+def check_rank_offset(offset: int, max_depth: int = SEARCH_RANK_CANDIDATES):
+    """Busca por relevância pagina só até `max_depth` linhas: offset além disso => HTTP 400."""
+    if offset >= max_depth:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Na busca por relevância (q) o offset máximo é {max_depth - 1}; refine os termos ou filtros"
+        )
+
+
+def ranked_page_query(select: str, where_clause: str) -> str:
+    """
+    Página ordenada por relevância de uma busca textual. Parâmetros, em ordem:
+    tsquery (para o rank), params do WHERE, LIMIT, OFFSET.
+    Ranqueia todas as linhas que casam e ordena por rank DESC, cnpj_completo
+    (o Postgres achata a subconsulta; ela só mantém a ordem dos parâmetros e
+    as colunas de saída iguais às de `select`).
+    """
+    return f"""
+        SELECT {select}
+        FROM (
+            SELECT {select}, ts_rank(nome_busca, to_tsquery('simple', %s), 1) AS rank
+            FROM vw_estabelecimentos_completos
+            WHERE {where_clause}
+        ) casados
+        ORDER BY rank DESC, cnpj_completo
+        LIMIT %s OFFSET %s
+    """
+
+
+def build_search_conditions(
+    razao_social: Optional[str] = None,
+    nome_fantasia: Optional[str] = None,
+    cnae: Optional[str] = None,
+    municipio: Optional[str] = None,
+    uf: Optional[str] = None,
+    situacao: Optional[str] = None,
+    data_inicio_atividade_min: Optional[str] = None,
+    data_inicio_atividade_max: Optional[str] = None,
+    q: Optional[str] = None,
+    cnae_secundario: Optional[str] = None,
+    cnae_qualquer: Optional[str] = None,
+    municipio_codigos: Optional[list] = None,
+) -> tuple[list, list]:
+    """
+    Monta (conditions, params) para a MV. Datas fora de YYYY-MM-DD => HTTP 400.
+    `q`: busca textual sem acentos em razão social + nome fantasia (full-text).
+    `cnae_secundario` / `cnae_qualquer`: listas de CNAEs (qualquer um casa);
+    o segundo aceita o código como principal OU secundário.
+    `municipio`: código => coluna municipio da MV; nome => `municipio_codigos`
+    (resolvidos pelo ReferenceRegistry) ou, sem eles, ILIKE em municipio_desc.
+    """
+    conditions = []
+    params = []
+
+    if q is not None:
+        tsquery = build_tsquery(q)
+        if tsquery is None:
+            raise HTTPException(status_code=400, detail="q deve conter ao menos uma palavra (letras ou números)")
+        conditions.append(TEXT_SEARCH_CONDITION)
+        params.append(tsquery)
+
+    if razao_social:
+        conditions.append("razao_social ILIKE %s")
+        params.append(f"%{razao_social}%")
+
+    if nome_fantasia:
+        conditions.append("nome_fantasia ILIKE %s")
+        params.append(f"%{nome_fantasia}%")
+
+    if cnae:
+        conditions.append("cnae_fiscal_principal = %s")
+        params.append(cnae)
+
+    secundarios = parse_cnae_codes(cnae_secundario, 'cnae_secundario')
+    if secundarios:
+        conditions.append(CNAE_SECONDARY_CONDITION)
+        params.append(secundarios)
+
+    qualquer = parse_cnae_codes(cnae_qualquer, 'cnae_qualquer')
+    if qualquer:
+        conditions.append(CNAE_ANY_CONDITION)
+        params.extend([qualquer, qualquer])
+
+    if municipio:
+        condition, municipio_params = municipio_condition(municipio, municipio_codigos)
+        conditions.append(condition)
+        params.extend(municipio_params)
+
+    if uf:
+        conditions.append("uf = %s")
+        params.append(uf.upper())
+
+    if situacao:
+        conditions.append("situacao_cadastral = %s")
+        params.append(situacao)
+
+    if data_inicio_atividade_min:
+        _validate_date(data_inicio_atividade_min, 'data_inicio_atividade_min', '2025-09-01')
+        logger.info(f"🔍 Filtro data_inicio_atividade_min: {data_inicio_atividade_min}")
+        conditions.append("data_inicio_atividade >= %s")
+        params.append(data_inicio_atividade_min)
+
+    if data_inicio_atividade_max:
+        _validate_date(data_inicio_atividade_max, 'data_inicio_atividade_max', '2025-09-02')
+        logger.info(f"🔍 Filtro data_inicio_atividade_max: {data_inicio_atividade_max}")
+        conditions.append("data_inicio_atividade <= %s")
+        params.append(data_inicio_atividade_max)
+
+    return conditions, params
+
+
+def row_to_search_item(row) -> dict:
+    """Linha do SELECT {SEARCH_SELECT} -> dict puro (sem Pydantic) no formato do /search."""
+    data = dict(zip(SEARCH_COLUMNS, row))
+    cnpj = data['cnpj_completo']
+    data['cnpj_basico'] = cnpj[:8] if cnpj else ''
+    data['cnpj_ordem'] = cnpj[8:12] if cnpj and len(cnpj) >= 12 else ''
+    data['cnpj_dv'] = cnpj[12:14] if cnpj and len(cnpj) >= 14 else ''
+
+    # Converter datas para string (formato ISO)
+    if data.get('data_situacao_cadastral'):
+        data['data_situacao_cadastral'] = str(data['data_situacao_cadastral'])
+    if data.get('data_inicio_atividade'):
+        data['data_inicio_atividade'] = str(data['data_inicio_atividade'])
+    if data.get('capital_social') is not None:
+        try:
+            data['capital_social'] = float(data['capital_social'])
+        except (TypeError, ValueError):
+            pass
+    return data
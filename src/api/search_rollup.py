@@ -0,0 +1,226 @@
+"""
+Contagens exatas da busca a partir do rollup search_facet_counts.
+
+O rollup (src/database/setup/04_search_rollup.sql, reconstruído a cada carga
+mensal) guarda count(*) da MV em agrupamentos estreitos (ROLLUP_SETS, via
+GROUPING SETS): cada filtro por IGUALDADE do /search vira um SUM sobre o
+MENOR agrupamento que contém todas as colunas filtradas — poucas linhas,
+exato e rápido. Combinações que nenhum agrupamento cobre (ex.: cnae +
+município), filtros de texto (razão social, nome fantasia, município por
+nome sem códigos resolvidos) e datas que não caem em anos inteiros não são
+respondíveis aqui: o /search volta à estimativa do planner.
+"""
+import logging
+from datetime import date
+from typing import Optional
+
+from src.api.search_filters import municipio_condition
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_TABLE = "search_facet_counts"
+
+# Ordem dos argumentos de GROUPING(...) no 04_search_rollup.sql
+ROLLUP_DIMENSIONS = (
+    'uf', 'municipio', 'cnae_fiscal_principal', 'situacao_cadastral',
+    'porte_empresa', 'opcao_simples', 'opcao_mei', 'ano_inicio',
+)
+
+# GROUPING SETS do rollup, do menor (menos linhas) para o maior: o primeiro
+# que cobre as colunas filtradas é o escolhido
+ROLLUP_SETS = (
+    ('uf', 'situacao_cadastral'),
+    ('uf', 'situacao_cadastral', 'ano_inicio'),
+    ('uf', 'situacao_cadastral', 'porte_empresa', 'opcao_simples', 'opcao_mei'),
+    ('uf', 'municipio', 'situacao_cadastral'),
+    ('uf', 'cnae_fiscal_principal', 'situacao_cadastral'),
+)
+
+# nome público da faceta -> coluna do rollup
+FACET_COLUMNS = {
+    'uf': 'uf',
+    'municipio': 'municipio',
+    'cnae': 'cnae_fiscal_principal',
+    'situacao': 'situacao_cadastral',
+    'porte': 'porte_empresa',
+    'opcao_simples': 'opcao_simples',
+    'opcao_mei': 'opcao_mei',
+    'ano_inicio': 'ano_inicio',
+}
+
+# Facetas agrupadas por código: o nome vem da tabela auxiliar (reference_registry)
+FACET_LABELS = {
+    'municipio': 'municipios',
+}
+
+
+def grouping_id(columns) -> int:
+    """Valor de GROUPING(ROLLUP_DIMENSIONS...) no Postgres para um agrupamento:
+    bit 1 = dimensão fora dele (1º argumento = bit mais significativo)."""
+    n = len(ROLLUP_DIMENSIONS)
+    return sum(1 << (n - 1 - i) for i, dim in enumerate(ROLLUP_DIMENSIONS) if dim not in columns)
+
+
+def condition_columns(conditions: list) -> set:
+    """Colunas do rollup usadas por condições de build_rollup_conditions ("uf = %s" -> uf)."""
+    return {condition.split()[0] for condition in conditions}
+
+
+def rollup_group(conditions: list, extra_columns=()) -> Optional[int]:
+    """`grupo` do menor agrupamento com todas as colunas filtradas (+ extra); None se nenhum cobre."""
+    needed = condition_columns(conditions) | set(extra_columns)
+    for columns in ROLLUP_SETS:
+        if needed <= set(columns):
+            return grouping_id(columns)
+    return None
+
+
+def _year_bounds(date_min: Optional[str], date_max: Optional[str]) -> Optional[tuple]:
+    """(ano_min, ano_max) se o intervalo cobre anos inteiros; None caso contrário.
+    Datas já validadas (YYYY-MM-DD) por build_search_conditions."""
+    lo = hi = None
+    if date_min:
+        d = date.fromisoformat(date_min)
+        if (d.month, d.day) != (1, 1):
+            return None
+        lo = d.year
+    if date_max:
+        d = date.fromisoformat(date_max)
+        if (d.month, d.day) != (12, 31):
+            return None
+        hi = d.year
+    return lo, hi
+
+
+def build_rollup_conditions(
+    razao_social: Optional[str] = None,
+    nome_fantasia: Optional[str] = None,
+    cnae: Optional[str] = None,
+    municipio: Optional[str] = None,
+    uf: Optional[str] = None,
+    situacao: Optional[str] = None,
+    data_inicio_atividade_min: Optional[str] = None,
+    data_inicio_atividade_max: Optional[str] = None,
+    porte: Optional[str] = None,
+    opcao_simples: Optional[str] = None,
+    opcao_mei: Optional[str] = None,
+    q: Optional[str] = None,
+    cnae_secundario: Optional[str] = None,
+    cnae_qualquer: Optional[str] = None,
+    municipio_codigos: Optional[list] = None,
+) -> Optional[tuple[list, list]]:
+    """
+    (conditions, params) sobre o rollup com a MESMA semântica de
+    build_search_conditions (e dos filtros porte/Simples/MEI do /batch/search),
+    ou None se algum filtro não é respondível aqui.
+    """
+    # O rollup só tem o CNAE principal
+    if razao_social or nome_fantasia or q or cnae_secundario or cnae_qualquer:
+        return None
+    years = _year_bounds(data_inicio_atividade_min, data_inicio_atividade_max)
+    if years is None:
+        return None
+
+    conditions = []
+    params = []
+
+    if cnae:
+        conditions.append("cnae_fiscal_principal = %s")
+        params.append(cnae)
+
+    if municipio:
+        if not municipio.strip().isdigit() and municipio_codigos is None:
+            return None
+        condition, municipio_params = municipio_condition(municipio, municipio_codigos)
+        conditions.append(condition)
+        params.extend(municipio_params)
+
+    if uf:
+        conditions.append("uf = %s")
+        params.append(uf.upper())
+
+    if situacao:
+        conditions.append("situacao_cadastral = %s")
+        params.append(situacao)
+
+    if porte:
+        conditions.append("porte_empresa = %s")
+        params.append(porte)
+
+    if opcao_simples:
+        conditions.append("opcao_simples = %s")
+        params.append(opcao_simples.upper())
+
+    if opcao_mei:
+        conditions.append("opcao_mei = %s")
+        params.append(opcao_mei.upper())
+
+    ano_min, ano_max = years
+    if ano_min is not None:
+        conditions.append("ano_inicio >= %s")
+        params.append(ano_min)
+    if ano_max is not None:
+        conditions.append("ano_inicio <= %s")
+        params.append(ano_max)
+
+    return conditions, params
+
+
+async def exact_total(conn, conditions: list, params: list) -> Optional[int]:
+    """SUM(total) do rollup para os filtros; None se nenhum agrupamento cobre os
+    filtros ou se o rollup não existe (ainda não construído) — o chamador cai
+    para a estimativa."""
+    grupo = rollup_group(conditions)
+    if grupo is None:
+        return None
+    where_clause = " AND ".join(["grupo = %s"] + conditions)
+    try:
+        # Savepoint: rollup ausente não invalida a transação da busca
+        async with conn.transaction():
+            cur = conn.cursor()
+            await cur.execute(
+                f"SELECT coalesce(sum(total), 0) FROM {ROLLUP_TABLE} WHERE {where_clause}",
+                [grupo] + params,
+            )
+            row = await cur.fetchone()
+            await cur.close()
+        return int(row[0])
+    except Exception as e:
+        logger.warning(f"Total exato pelo rollup falhou: {e}; usando estimativa")
+        return None
+
+
+def answerable_facets(conditions: list, facets: list) -> list:
+    """Facetas que algum agrupamento do rollup responde junto com os filtros."""
+    return [name for name in facets if rollup_group(conditions, (FACET_COLUMNS[name],)) is not None]
+
+
+async def facet_counts(conn, conditions: list, params: list, facets: list, limit: int) -> dict:
+    """{faceta: [{'value': v, 'count': n}, ...]} — top `limit` valores por contagem
+    (município pelo código; o nome entra depois, em label_facets).
+    Só facetas de answerable_facets (as demais são ignoradas)."""
+    out = {}
+    cur = conn.cursor()
+    for name in facets:
+        col = FACET_COLUMNS[name]
+        grupo = rollup_group(conditions, (col,))
+        if grupo is None:
+            continue
+        where_clause = " AND ".join(["grupo = %s"] + conditions)
+        await cur.execute(
+            f"SELECT {col}, sum(total) AS n FROM {ROLLUP_TABLE} WHERE {where_clause} "
+            f"GROUP BY {col} ORDER BY n DESC, {col} LIMIT %s",
+            [grupo] + params + [limit],
+        )
+        out[name] = [{'value': v, 'count': int(n)} for v, n in await cur.fetchall()]
+    await cur.close()
+    return out
+
+
+def label_facets(counts: dict, describe) -> dict:
+    """Acrescenta 'label' (describe(tabela, codigo)) às facetas de FACET_LABELS.
+    Código sem descrição conhecida fica com label None."""
+    for name, table in FACET_LABELS.items():
+        for entry in counts.get(name, ()):
+            entry['label'] = describe(table, entry['value'])
+    return counts
@@ -0,0 +1,131 @@
+"""
+SingleFlight — coalescência de cache misses (/cnpj e /search).
+
+Quando um CNPJ popular ou uma busca comum (ex.: uf=SP&situacao=02) expira,
+todas as requisições simultâneas erravam o cache e rodavam a MESMA consulta
+na MV — o pool de 5 conexões secava.
+
+Agora, por chave de cache:
+- No worker: só a primeira requisição carrega; as outras aguardam o mesmo
+  future.
+- Entre workers: lock curto no Redis (SET NX PX). Quem não pegou o lock serve
+  a cópia stale (última versão carregada, guardada por SINGLE_FLIGHT_STALE_TTL)
+  se houver — stale-while-revalidate — ou espera o dono do lock preencher o
+  cache. Se o dono demorar mais que o lock, carrega por conta própria.
+- Sem Redis: só a coalescência dentro do worker.
+- A geração do cache é fixada antes da consulta (pinned_generation): se o
+  ETL trocar a geração no meio, o resultado (e a cópia stale) não vai para
+  o namespace novo.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Optional
+
+from src.api.cache_redis import cache as shared_cache
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_LOCK_MS = int(os.getenv('SINGLE_FLIGHT_LOCK_MS', '10000'))
+SINGLE_FLIGHT_STALE_TTL = int(os.getenv('SINGLE_FLIGHT_STALE_TTL', str(24 * 3600)))
+POLL_INTERVAL = 0.05  # segundos entre leituras do cache enquanto outro worker carrega
+
+LOCK_PREFIX = "sf:lock:"
+STALE_PREFIX = "sf:stale:"
+
+
+class SingleFlight:
+    def __init__(self, cache=shared_cache, lock_ms: int = SINGLE_FLIGHT_LOCK_MS,
+                 stale_ttl: int = SINGLE_FLIGHT_STALE_TTL):
+        self.cache = cache
+        self.lock_ms = lock_ms
+        self.stale_ttl = stale_ttl
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.loads = 0             # consultas de fato executadas
+        self.coalesced_local = 0   # aguardaram outra requisição do mesmo worker
+        self.coalesced_remote = 0  # aguardaram outro worker preencher o cache
+        self.stale_served = 0      # receberam a cópia stale enquanto outro worker recarrega
+        self.lock_timeouts = 0     # dono do lock não terminou a tempo: carregaram sozinhas
+
+    async def load(self, key: str, loader: Callable[[], Awaitable[Any]],
+                   lookup: Callable[[str], Optional[Any]]) -> Any:
+        """
+        Valor de `key` carregado UMA vez. `loader` consulta o banco E grava o
+        cache; `lookup` lê o cache (usado enquanto outro worker carrega).
+        Exceções do loader (inclusive HTTPException 404) chegam a todos os
+        que aguardavam.
+        """
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced_local += 1
+            try:
+                return await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                if fut.cancelled():
+                    # Quem carregava foi cancelado (cliente desconectou): tenta de novo
+                    return await self.load(key, loader, lookup)
+                raise
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            with self.cache.pinned_generation():
+                value = await self._load_shared(key, loader, lookup)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # sem aguardando: evita "exception was never retrieved"
+            raise
+        else:
+            fut.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _load_shared(self, key, loader, lookup):
+        token = uuid.uuid4().hex
+        locked = self.cache.acquire_lock(LOCK_PREFIX + key, token, self.lock_ms)
+        if locked is False:
+            stale = self.cache.get(STALE_PREFIX + key)
+            if stale is not None:
+                self.stale_served += 1
+                return stale
+            deadline = time.monotonic() + self.lock_ms / 1000
+            while time.monotonic() < deadline:
+                await asyncio.sleep(POLL_INTERVAL)
+                value = lookup(key)
+                if value is not None:
+                    self.coalesced_remote += 1
+                    return value
+                if not self.cache.exists(LOCK_PREFIX + key):
+                    break  # dono terminou sem gravar (ex.: 404): carrega aqui
+            else:
+                self.lock_timeouts += 1
+                logger.warning(f"SingleFlight: lock de {key} expirou sem valor; carregando neste worker")
+
+        try:
+            self.loads += 1
+            value = await loader()
+            if locked is not None:  # cópia stale só faz sentido entre workers (Redis)
+                self.cache.set(STALE_PREFIX + key, value, ttl_seconds=self.stale_ttl)
+            return value
+        finally:
+            if locked:
+                self.cache.release_lock(LOCK_PREFIX + key, token)
+
+    def stats(self) -> dict:
+        return {
+            'inflight': len(self._inflight),
+            'loads': self.loads,
+            'coalesced_local': self.coalesced_local,
+            'coalesced_remote': self.coalesced_remote,
+            'stale_served': self.stale_served,
+            'lock_timeouts': self.lock_timeouts,
+        }
+
+
+single_flight = SingleFlight()
@@ -8,6 +8,7 @@ import os
 from datetime import datetime
 from typing import Optional
 from src.database.connection import db_manager
+from src.api.auth_cache import auth_cache
 
 logger = logging.getLogger(__name__)
 
@@ -143,6 +144,8 @@ async def handle_checkout_session_completed(event_data: dict):
                         logger.error(f"Erro ao enviar email de assinatura criada: {e}")
                 
                 logger.info(f"✅ Assinatura criada: {subscription_id} para user_id: {user_id}")
+                # Novo plano vale já neste worker (demais: após AUTH_CACHE_TTL)
+                auth_cache.invalidate_user(user_id)
             else:
                 logger.info(f"Assinatura {subscription_id} já existe no banco")
             
@@ -0,0 +1,333 @@
+"""
+UsageBuffer — contadores de uso com write-behind (api_keys, user_usage, monthly_usage).
+
+Antes: TODA requisição fazia UPDATE em clientes.api_keys (total_requests+1) e
+UPSERT em clientes.user_usage — a mesma linha quente para um cliente pesado.
+Sob rajada isso serializa em row locks e enche as tabelas de tuplas mortas.
+
+Agora:
+- Incrementos acumulam no Redis (HINCRBY) — ou em memória do processo quando o
+  Redis está fora — e são gravados em lote a cada USAGE_FLUSH_INTERVAL segundos
+  com UM UPSERT multi-linha por tabela.
+- A cota mensal continua ATÔMICA: contador Redis `quota:{user}:{mês}` semeado
+  de clientes.monthly_usage, incrementado só abaixo do limite (script Lua).
+  O valor absoluto é reconciliado no banco com GREATEST no flush.
+- Sem Redis, a cota cai para o upsert atômico no banco (charge_monthly_quota)
+  e os contadores ficam em memória do processo até o flush.
+
+Revogação de key: `auth:epoch` é incrementado ao apagar uma key; o script de
+cobrança recusa quando o epoch conhecido pelo worker está velho, e o worker
+limpa o AuthCache e revalida a key no banco.
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import Optional
+
+from src.api.cache_redis import cache as shared_cache
+
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_INTERVAL = int(os.getenv('USAGE_FLUSH_INTERVAL', '5'))
+# TTL do contador de cota: renovado a cada uso; só expira após 1h sem uso,
+# muito depois do último flush — a próxima requisição re-semeia do banco.
+QUOTA_KEY_TTL = 3600
+
+K_KEYS = "usage:buf:keys"            # hash key_hash -> incremento de total_requests
+K_LASTUSED = "usage:buf:lastused"    # hash key_hash -> epoch (s) do último uso
+K_DAILY = "usage:buf:daily"          # hash "user_id|YYYY-MM-DD" -> incremento de requests
+K_QUOTA_DIRTY = "usage:buf:quota"    # set "user_id|YYYY-MM" com cota alterada desde o flush
+K_AUTH_EPOCH = "auth:epoch"
+
+# Status devolvidos pelo script de cobrança
+CHARGE_OK = 0
+CHARGE_AT_LIMIT = -1
+CHARGE_NEEDS_SEED = -2
+CHARGE_STALE_EPOCH = -3
+
+try:
+    from zoneinfo import ZoneInfo
+    _BR_TZ = ZoneInfo("America/Sao_Paulo")
+except Exception:
+    _BR_TZ = timezone(timedelta(hours=-3))
+
+# KEYS: quota, keys, lastused, daily, dirty, epoch
+# ARGV: epoch conhecido, limite (-1 = sem cota), key_hash, agora, campo diário, membro dirty, ttl,
+#       consultas cobradas (1; N no /cnpj/bulk — tudo ou nada contra o limite;
+#       0 = requisição gratuita: nunca recusada pela cota, mesmo acima do teto)
+_CHARGE_LUA = """
+local epoch = redis.call('GET', KEYS[6]) or '0'
+if epoch ~= ARGV[1] then return {-3, epoch, 0} end
+local limit = tonumber(ARGV[2])
+local amount = tonumber(ARGV[8])
+local used = 0
+if limit >= 0 then
+    local cur = redis.call('GET', KEYS[1])
+    if not cur then return {-2, epoch, 0} end
+    cur = tonumber(cur)
+    if amount == 0 then
+        used = cur
+    elseif cur + amount > limit then
+        redis.call('HINCRBY', KEYS[2], ARGV[3], 1)
+        redis.call('HSET', KEYS[3], ARGV[3], ARGV[4])
+        return {-1, epoch, cur}
+    else
+        used = redis.call('INCRBY', KEYS[1], amount)
+        redis.call('EXPIRE', KEYS[1], ARGV[7])
+        redis.call('SADD', KEYS[5], ARGV[6])
+    end
+end
+redis.call('HINCRBY', KEYS[2], ARGV[3], 1)
+redis.call('HSET', KEYS[3], ARGV[3], ARGV[4])
+redis.call('HINCRBY', KEYS[4], ARGV[5], amount)
+return {0, epoch, used}
+"""
+
+# Drena um hash/set de forma atômica: RENAME para chave temporária + leitura + DEL.
+# Dois workers drenando juntos não contam em dobro (só um acha a chave).
+_DRAIN_LUA = """
+local out = {}
+for i, k in ipairs(KEYS) do
+    if redis.call('EXISTS', k) == 1 then
+        local tmp = k .. ':draining'
+        redis.call('RENAME', k, tmp)
+        if redis.call('TYPE', tmp)['ok'] == 'set' then
+            out[i] = redis.call('SMEMBERS', tmp)
+        else
+            out[i] = redis.call('HGETALL', tmp)
+        end
+        redis.call('DEL', tmp)
+    else
+        out[i] = {}
+    end
+end
+return out
+"""
+
+# Cota: nunca abaixo do valor já gravado no banco (ex.: período com Redis fora)
+_RAISE_LUA = """
+for i, k in ipairs(KEYS) do
+    local cur = redis.call('GET', k)
+    if cur and tonumber(cur) < tonumber(ARGV[i]) then
+        redis.call('SET', k, ARGV[i], 'KEEPTTL')
+    end
+end
+return 1
+"""
+
+
+def _today_br() -> str:
+    return datetime.now(_BR_TZ).strftime('%Y-%m-%d')
+
+
+def quota_key(user_id: int, month_year: str) -> str:
+    return f"quota:{user_id}:{month_year}"
+
+
+def _pairs(flat: list) -> dict:
+    """HGETALL do Lua vem como lista plana [campo, valor, ...] (bytes)."""
+    return {_s(flat[i]): _s(flat[i + 1]) for i in range(0, len(flat), 2)}
+
+
+def _s(v) -> str:
+    return v.decode() if isinstance(v, bytes) else str(v)
+
+
+class UsageBuffer:
+    def __init__(self, cache=shared_cache):
+        self.cache = cache
+        self._lock = Lock()
+        # Fallback em memória do processo (Redis indisponível)
+        self._mem_keys: dict[str, int] = {}
+        self._mem_lastused: dict[str, float] = {}
+        self._mem_daily: dict[tuple, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # ------------------------------------------------------------------
+    # Caminho quente (por requisição)
+    # ------------------------------------------------------------------
+    def charge(self, key_hash: str, user_id: int, month_year: str,
+               monthly_limit: Optional[int], known_epoch: Optional[str],
+               amount: int = 1) -> Optional[tuple]:
+        """
+        Cobra a requisição no Redis (cota + contadores) em UM round trip.
+        `amount` consultas saem da cota de uma vez (a requisição conta 1 em
+        total_requests). Retorna (status, epoch, valor) ou None se o Redis
+        estiver indisponível.
+        """
+        res = self.cache.eval_script(
+            _CHARGE_LUA,
+            [quota_key(user_id, month_year), K_KEYS, K_LASTUSED, K_DAILY, K_QUOTA_DIRTY, K_AUTH_EPOCH],
+            [known_epoch or '', -1 if monthly_limit is None else monthly_limit, key_hash,
+             int(time.time()), f"{user_id}|{_today_br()}", f"{user_id}|{month_year}", QUOTA_KEY_TTL,
+             amount],
+        )
+        if res is None:
+            return None
+        return int(res[0]), _s(res[1]), int(res[2])
+
+    def seed_quota(self, user_id: int, month_year: str, used: int):
+        """Semeia o contador com o valor do banco (NX: não sobrescreve quem chegou antes)."""
+        client = self.cache.redis_client
+        if client is None:
+            return
+        try:
+            client.set(quota_key(user_id, month_year), int(used), nx=True, ex=QUOTA_KEY_TTL)
+        except Exception as e:
+            logger.error(f"Erro ao semear cota no Redis: {e}")
+
+    def bump_auth_epoch(self):
+        """Key revogada: todos os workers descartam o AuthCache na próxima requisição."""
+        self.cache.eval_script("return redis.call('INCR', KEYS[1])", [K_AUTH_EPOCH], [])
+
+    def record_local(self, key_hash: str, user_id: int, count_daily: bool = True, amount: int = 1):
+        """Fallback sem Redis: acumula em memória do processo até o próximo flush."""
+        with self._lock:
+            self._mem_keys[key_hash] = self._mem_keys.get(key_hash, 0) + 1
+            self._mem_lastused[key_hash] = time.time()
+            if count_daily:
+                k = (user_id, _today_br())
+                self._mem_daily[k] = self._mem_daily.get(k, 0) + amount
+
+    # ------------------------------------------------------------------
+    # Flush (write-behind)
+    # ------------------------------------------------------------------
+    def drain(self) -> dict:
+        """
+        Retira TUDO que está pendente (memória + Redis). Formato:
+        {'keys': {hash: n}, 'lastused': {hash: ts}, 'daily': {(uid, data): n},
+         'quota': {(uid, mês): usado}}
+        """
+        with self._lock:
+            keys, self._mem_keys = self._mem_keys, {}
+            lastused, self._mem_lastused = self._mem_lastused, {}
+            daily, self._mem_daily = self._mem_daily, {}
+        quota: dict[tuple, int] = {}
+
+        res = self.cache.eval_script(_DRAIN_LUA, [K_KEYS, K_LASTUSED, K_DAILY, K_QUOTA_DIRTY], [])
+        if res is not None:
+            r_keys, r_last, r_daily, r_dirty = res
+            for h, n in _pairs(r_keys).items():
+                keys[h] = keys.get(h, 0) + int(n)
+            for h, ts in _pairs(r_last).items():
+                lastused[h] = max(lastused.get(h, 0), float(ts))
+            for field, n in _pairs(r_daily).items():
+                uid, day = field.split('|', 1)
+                k = (int(uid), day)
+                daily[k] = daily.get(k, 0) + int(n)
+            members = [_s(m) for m in r_dirty]
+            if members:
+                values = self.cache.redis_client.mget(
+                    [quota_key(*m.split('|', 1)) for m in members]
+                )
+                for m, v in zip(members, values):
+                    if v is not None:
+                        uid, month = m.split('|', 1)
+                        quota[(int(uid), month)] = int(v)
+        return {'keys': keys, 'lastused': lastused, 'daily': daily, 'quota': quota}
+
+    def restore(self, pending: dict):
+        """Flush falhou: devolve os incrementos para a memória (próximo ciclo tenta de novo)."""
+        with self._lock:
+            for h, n in pending['keys'].items():
+                self._mem_keys[h] = self._mem_keys.get(h, 0) + n
+            for h, ts in pending['lastused'].items():
+                self._mem_lastused[h] = max(self._mem_lastused.get(h, 0), ts)
+            for k, n in pending['daily'].items():
+                self._mem_daily[k] = self._mem_daily.get(k, 0) + n
+        # Cota: valor absoluto continua no Redis; só re-marca como pendente
+        if pending['quota']:
+            self.cache.eval_script(
+                "for i, m in ipairs(ARGV) do redis.call('SADD', KEYS[1], m) end return 1",
+                [K_QUOTA_DIRTY], [f"{uid}|{month}" for uid, month in pending['quota']],
+            )
+
+    async def flush(self) -> int:
+        """Grava os pendentes no banco (1 UPSERT multi-linha por tabela). Retorna nº de linhas."""
+        pending = self.drain()
+        total = sum(len(pending[k]) for k in ('keys', 'daily', 'quota'))
+        if not total:
+            return 0
+        from src.database.async_connection import async_db_manager
+        try:
+            db_quota = await async_db_manager.flush_usage_counters(
+                pending['keys'], pending['lastused'], pending['daily'], pending['quota']
+            )
+        except Exception as e:
+            logger.error(f"⚠️ Flush de contadores de uso falhou (nova tentativa no próximo ciclo): {e}")
+            self.restore(pending)
+            return 0
+        if db_quota:
+            keys = [quota_key(uid, month) for uid, month in db_quota]
+            self.cache.eval_script(_RAISE_LUA, keys, list(db_quota.values()))
+        logger.debug(f"Contadores de uso gravados: {total} linhas")
+        return total
+
+    async def charge_request(self, key_hash: str, user_id: int, month_year: str,
+                             monthly_limit: Optional[int], amount: int = 1) -> dict:
+        """
+        Cobra uma requisição autenticada (`amount` consultas da cota; 0 =
+        gratuita, nunca recusada pelo limite).
+        Retorna {'key_ok' (False = key revogada), 'queries_used' (novo valor;
+        None = no teto ou sem cota), 'current_used' (uso antes desta cobrança)}.
+        """
+        from src.api.auth_cache import auth_cache, load_api_key_context
+        from src.database.async_connection import async_db_manager
+
+        for _ in range(3):
+            res = self.charge(key_hash, user_id, month_year, monthly_limit, auth_cache.epoch, amount)
+            if res is None:
+                break  # Redis fora: fallback abaixo
+            status, epoch, value = res
+            if status == CHARGE_OK:
+                return {'key_ok': True, 'queries_used': value if monthly_limit is not None else None,
+                        'current_used': value - amount}
+            if status == CHARGE_AT_LIMIT:
+                return {'key_ok': True, 'queries_used': None, 'current_used': value}
+            if status == CHARGE_NEEDS_SEED:
+                used = await async_db_manager.get_monthly_queries_used(user_id, month_year)
+                self.seed_quota(user_id, month_year, used)
+            elif status == CHARGE_STALE_EPOCH:
+                # Alguma key foi revogada: revalida ESTA key no banco antes de cobrar
+                stale = auth_cache.epoch is not None
+                auth_cache.sync_epoch(epoch)
+                if stale and await load_api_key_context(key_hash) is None:
+                    return {'key_ok': False, 'queries_used': None, 'current_used': None}
+
+        # Sem Redis: contadores em memória do processo; cota atômica no banco
+        if monthly_limit is None:
+            self.record_local(key_hash, user_id, amount=amount)
+            return {'key_ok': True, 'queries_used': None, 'current_used': None}
+        if amount == 0:
+            # Gratuita (304, autocomplete): só lê o uso, não passa pelo limite
+            used = await async_db_manager.get_monthly_queries_used(user_id, month_year)
+            self.record_local(key_hash, user_id, count_daily=False)
+            return {'key_ok': True, 'queries_used': used, 'current_used': used}
+        charged = await async_db_manager.charge_monthly_quota(user_id, month_year, monthly_limit, amount)
+        self.record_local(key_hash, user_id, count_daily=charged['queries_used'] is not None, amount=amount)
+        return charged
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Erro no flush de contadores: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Shutdown: para o laço e grava o que restou."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+usage_buffer = UsageBuffer()
@@ -4,6 +4,8 @@ from typing import List
 from datetime import datetime, timedelta
 from src.database.connection import db_manager
 from src.api.auth import get_current_user
+from src.api.auth_cache import auth_cache
+from src.api.usage_buffer import usage_buffer
 import logging
 import random
 
@@ -183,6 +185,8 @@ async def delete_api_key(
         success = await db_manager.delete_api_key(current_user['id'], key_id)
         if not success:
             raise HTTPException(status_code=500, detail="Error deleting API key")
+        auth_cache.invalidate_user(current_user['id'])
+        usage_buffer.bump_auth_epoch()  # demais workers revalidam suas keys
         return {"message": "API key deleted successfully"}
     except HTTPException:
         raise
@@ -0,0 +1,257 @@
+"""
+AsyncDatabaseManager — acesso ao Postgres 100% assíncrono (psycopg 3) para as
+rotas da API.
+
+Por quê: psycopg2 é síncrono. Qualquer `with db_manager.get_connection()` dentro
+de um `async def` trava o event loop do worker inteiro enquanto a query roda —
+uma consulta de sócios lenta congela TODAS as requisições daquele worker.
+Aqui cada query é um `await`: enquanto o Postgres trabalha, o loop atende
+outras requisições.
+
+Pool próprio (AsyncConnectionPool), com os MESMOS timeouts do pool síncrono.
+O DatabaseManager (psycopg2) continua servindo ETL, scripts e o admin.
+"""
+import os
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional, Dict
+
+from psycopg import AsyncClientCursor
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+# ESC-01: mesmos timeouts do pool psycopg2 (query pesada não segura o worker)
+_CONN_OPTIONS = '-c statement_timeout=60000 -c idle_in_transaction_session_timeout=30000 -c lock_timeout=5000'
+
+
+class AsyncDatabaseManager:
+    def __init__(self, conninfo: Optional[str] = None):
+        self.conninfo = conninfo or settings.database_url
+        # Mesmo dimensionamento enxuto do pool síncrono (RIGHT-SIZED): 1-5 por worker
+        self.min_size = int(os.getenv('DB_ASYNC_POOL_MIN', '1'))
+        self.max_size = int(os.getenv('DB_ASYNC_POOL_MAX', '5'))
+        self.pool: Optional[AsyncConnectionPool] = None
+
+    async def open(self):
+        """Abre o pool (chamado no startup; também aberto sob demanda)."""
+        if self.pool is not None:
+            return
+        self.pool = AsyncConnectionPool(
+            self.conninfo,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            kwargs={'options': _CONN_OPTIONS},
+            # Pre-ping no checkout: conexão derrubada pelo servidor é descartada
+            check=AsyncConnectionPool.check_connection,
+            # Espera por conexão livre antes de desistir (equivale ao _getconn_with_wait)
+            timeout=5.0,
+            open=False,
+        )
+        await self.pool.open(wait=False)
+        logger.info(f"✅ Pool assíncrono inicializado: {self.min_size}-{self.max_size} conexões/worker")
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Conexão do pool dentro de uma transação: COMMIT na saída normal,
+        ROLLBACK se o bloco levantar exceção (mesma semântica do get_connection).
+        """
+        if self.pool is None:
+            await self.open()
+        async with self.pool.connection() as conn:
+            yield conn
+
+    # ------------------------------------------------------------------
+    # Helpers de consulta única (uma conexão, uma transação)
+    # ------------------------------------------------------------------
+    async def fetchone(self, query: str, params=None, as_dict: bool = False):
+        async with self.connection() as conn:
+            cur = conn.cursor(row_factory=dict_row) if as_dict else conn.cursor()
+            async with cur:
+                await cur.execute(query, params)
+                return await cur.fetchone()
+
+    async def fetchall(self, query: str, params=None, as_dict: bool = False) -> list:
+        async with self.connection() as conn:
+            cur = conn.cursor(row_factory=dict_row) if as_dict else conn.cursor()
+            async with cur:
+                await cur.execute(query, params)
+                return await cur.fetchall()
+
+    async def execute(self, query: str, params=None) -> int:
+        async with self.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, params)
+                return cur.rowcount
+
+    @staticmethod
+    def client_cursor(conn):
+        """
+        Cursor com parâmetros interpolados no cliente. Necessário para EXPLAIN:
+        comandos utilitários não aceitam bind de parâmetros no servidor ($1).
+        """
+        return AsyncClientCursor(conn)
+
+    # ------------------------------------------------------------------
+    # Usuários / API keys (só o que as rotas assíncronas usam)
+    # ------------------------------------------------------------------
+    async def get_user_by_username(self, username: str) -> Optional[Dict]:
+        try:
+            row = await self.fetchone("""
+                SELECT id, username, email, phone, cpf, password, role, created_at, last_login, is_active, avatar_url
+                FROM clientes.users
+                WHERE username = %s
+            """, (username,), as_dict=True)
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Erro ao buscar usuário: {e}")
+            return None
+
+    async def resolve_api_key(self, key_hash: str) -> Optional[Dict]:
+        """
+        AUTH-1RT: dono da key + assinatura vigente + última assinatura (para
+        past_due/unpaid) em UMA consulta, sem escrita. Resultado vai para o AuthCache.
+        """
+        try:
+            row = await self.fetchone("""
+                SELECT
+                    u.id, u.username, u.email, u.role, u.is_active,
+                    s.status AS sub_status,
+                    s.current_period_end AS sub_period_end,
+                    s.cancel_at_period_end AS sub_cancel_at_period_end,
+                    s.plan_name AS sub_plan,
+                    s.monthly_queries AS sub_monthly_queries,
+                    l.status AS last_status,
+                    l.current_period_end AS last_period_end
+                FROM clientes.api_keys k
+                JOIN clientes.users u ON u.id = k.user_id
+                LEFT JOIN LATERAL (
+                    SELECT ss.status, ss.current_period_end, ss.cancel_at_period_end,
+                           p.name AS plan_name, p.monthly_queries
+                    FROM clientes.stripe_subscriptions ss
+                    JOIN clientes.plans p ON ss.plan_id = p.id
+                    WHERE ss.user_id = u.id
+                        AND ss.current_period_end > NOW()
+                        AND ss.status IN ('active', 'trialing', 'canceled')
+                    ORDER BY ss.created_at DESC
+                    LIMIT 1
+                ) s ON TRUE
+                LEFT JOIN LATERAL (
+                    SELECT ss.status, ss.current_period_end
+                    FROM clientes.stripe_subscriptions ss
+                    WHERE ss.user_id = u.id
+                    ORDER BY ss.created_at DESC
+                    LIMIT 1
+                ) l ON s.status IS NULL
+                WHERE k.key = %s AND k.is_active = TRUE
+            """, (key_hash,), as_dict=True)
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Erro ao resolver API key: {e}")
+            return None
+
+    async def charge_monthly_quota(self, user_id: int, month_year: str, monthly_limit: int,
+                                   amount: int = 1) -> Dict:
+        """
+        Só a cota mensal (atômica), sem contadores — usado quando os contadores
+        vão para o UsageBuffer mas o Redis está fora. `amount` consultas de uma
+        vez: cabem todas no limite ou nenhuma é cobrada.
+
+        Retorna {'key_ok': True, 'queries_used' (novo valor; None se não coube),
+        'current_used' (valor no banco antes da instrução)}.
+        """
+        row = await self.fetchone("""
+            WITH q AS (
+                INSERT INTO clientes.monthly_usage (user_id, month_year, queries_used, last_query_at)
+                SELECT %(uid)s, %(month)s, %(n)s, NOW()
+                WHERE %(n)s <= %(limit)s
+                ON CONFLICT (user_id, month_year)
+                DO UPDATE SET
+                    queries_used = clientes.monthly_usage.queries_used + %(n)s,
+                    last_query_at = NOW()
+                WHERE clientes.monthly_usage.queries_used + %(n)s <= %(limit)s
+                RETURNING queries_used
+            )
+            SELECT TRUE AS key_ok,
+                   (SELECT queries_used FROM q) AS queries_used,
+                   (SELECT mu.queries_used FROM clientes.monthly_usage mu
+                     WHERE mu.user_id = %(uid)s AND mu.month_year = %(month)s) AS current_used
+        """, {'uid': user_id, 'month': month_year, 'limit': monthly_limit, 'n': amount}, as_dict=True)
+        return dict(row)
+
+    async def get_monthly_queries_used(self, user_id: int, month_year: str) -> int:
+        row = await self.fetchone("""
+            SELECT queries_used FROM clientes.monthly_usage
+            WHERE user_id = %s AND month_year = %s
+        """, (user_id, month_year))
+        return int(row[0] or 0) if row else 0
+
+    async def flush_usage_counters(self, keys: Dict[str, int], lastused: Dict[str, float],
+                                   daily: Dict[tuple, int], quota: Dict[tuple, int]) -> Dict[tuple, int]:
+        """
+        WRITE-BEHIND: grava os contadores acumulados com UM UPSERT multi-linha
+        por tabela (unnest de arrays), numa transação. Linhas em ordem fixa para
+        dois workers nunca travarem em ordem cruzada.
+
+        Cota: valor ABSOLUTO do Redis, com GREATEST (idempotente; nunca reduz).
+        Retorna {(user_id, mês): queries_used} como ficou no banco.
+        """
+        db_quota: Dict[tuple, int] = {}
+        async with self.connection() as conn:
+            async with conn.cursor() as cur:
+                if keys:
+                    hashes = sorted(keys)
+                    await cur.execute("""
+                        UPDATE clientes.api_keys k
+                        SET total_requests = k.total_requests + v.n,
+                            last_used = GREATEST(k.last_used, to_timestamp(v.ts))
+                        FROM unnest(%s::text[], %s::int[], %s::float8[]) AS v(key, n, ts)
+                        WHERE k.key = v.key
+                    """, (hashes, [keys[h] for h in hashes],
+                          [lastused.get(h, 0.0) for h in hashes]))
+
+                if daily:
+                    rows = sorted(daily)
+                    await cur.execute("""
+                        INSERT INTO clientes.user_usage (user_id, date, requests)
+                        SELECT * FROM unnest(%s::int[], %s::date[], %s::int[])
+                        ON CONFLICT (user_id, date)
+                        DO UPDATE SET requests = clientes.user_usage.requests + EXCLUDED.requests
+                    """, ([r[0] for r in rows], [r[1] for r in rows], [daily[r] for r in rows]))
+
+                if quota:
+                    rows = sorted(quota)
+                    await cur.execute("""
+                        INSERT INTO clientes.monthly_usage (user_id, month_year, queries_used, last_query_at)
+                        SELECT u, m, q, NOW() FROM unnest(%s::int[], %s::text[], %s::int[]) AS v(u, m, q)
+                        ON CONFLICT (user_id, month_year)
+                        DO UPDATE SET
+                            queries_used = GREATEST(clientes.monthly_usage.queries_used, EXCLUDED.queries_used),
+                            last_query_at = NOW()
+                        RETURNING user_id, month_year, queries_used
+                    """, ([r[0] for r in rows], [r[1] for r in rows], [quota[r] for r in rows]))
+                    for uid, month, used in await cur.fetchall():
+                        db_quota[(uid, month)] = used
+        return db_quota
+
+    async def touch_api_key(self, key_hash: str) -> bool:
+        """last_used/total_requests da key (sem cota). False = key revogada."""
+        row = await self.fetchone("""
+            UPDATE clientes.api_keys
+            SET last_used = CURRENT_TIMESTAMP, total_requests = total_requests + 1
+            WHERE key = %s AND is_active = TRUE
+            RETURNING user_id
+        """, (key_hash,))
+        return row is not None
+
+
+async_db_manager = AsyncDatabaseManager()
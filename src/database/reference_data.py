@@ -0,0 +1,35 @@
+"""
+Tabelas auxiliares da Receita (códigos -> descrições).
+
+São seis tabelas pequenas (poucos milhares de linhas no total) que só mudam
+na carga mensal. Um único carregador serve ao ETL (validação de FKs em
+CNPJImporter) e à API (ReferenceRegistry em memória).
+"""
+from typing import Dict, Iterable
+
+REFERENCE_TABLES = (
+    'cnaes',
+    'municipios',
+    'motivos_situacao_cadastral',
+    'naturezas_juridicas',
+    'paises',
+    'qualificacoes_socios',
+)
+
+
+def load_reference_tables(conn, tables: Iterable[str] = REFERENCE_TABLES) -> Dict[str, Dict[str, str]]:
+    """
+    {tabela: {codigo: descricao}} de cada tabela auxiliar pedida, lidas numa
+    conexão psycopg2 já aberta (uma consulta por tabela).
+    """
+    data = {}
+    cursor = conn.cursor()
+    try:
+        for table in tables:
+            if table not in REFERENCE_TABLES:
+                raise ValueError(f"Tabela auxiliar desconhecida: {table}")
+            cursor.execute(f"SELECT codigo, descricao FROM {table}")
+            data[table] = {str(codigo): descricao for codigo, descricao in cursor.fetchall()}
+    finally:
+        cursor.close()
+    return data
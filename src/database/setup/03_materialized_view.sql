@@ -5,6 +5,9 @@
 -- O índice UNIQUE em cnpj_completo é OBRIGATÓRIO para REFRESH CONCURRENTLY.
 -- =====================================================================
 
+-- nome_busca usa unaccent (também criada no estágio core)
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
 DROP MATERIALIZED VIEW IF EXISTS vw_estabelecimentos_completos CASCADE;
 DROP VIEW IF EXISTS vw_estabelecimentos_completos CASCADE;
 
@@ -20,6 +23,8 @@ SELECT
     e.data_inicio_atividade,
     e.cnae_fiscal_principal,
     e.cnae_fiscal_secundaria,
+    -- CNAEs secundários como array (filtros cnae_secundario / cnae_qualquer com &&, GIN)
+    regexp_split_to_array(nullif(btrim(e.cnae_fiscal_secundaria), ''), '\s*,\s*') AS cnaes_secundarios,
     cnae.descricao AS cnae_principal_desc,
     e.tipo_logradouro,
     e.logradouro,
@@ -28,6 +33,7 @@ SELECT
     e.bairro,
     e.cep,
     e.uf,
+    e.municipio,
     mun.descricao AS municipio_desc,
     e.ddd_1,
     e.telefone_1,
@@ -38,7 +44,10 @@ SELECT
     emp.capital_social,
     emp.ente_federativo_responsavel,
     sn.opcao_simples,
-    sn.opcao_mei
+    sn.opcao_mei,
+    -- Busca textual (parâmetro q): sem acentos, razão social pesa mais que fantasia
+    setweight(to_tsvector('simple', unaccent(coalesce(emp.razao_social, ''))), 'A') ||
+    setweight(to_tsvector('simple', unaccent(coalesce(e.nome_fantasia, ''))), 'B') AS nome_busca
 FROM estabelecimentos e
 INNER JOIN empresas emp ON e.cnpj_basico = emp.cnpj_basico
 LEFT JOIN motivos_situacao_cadastral msc ON e.motivo_situacao_cadastral = msc.codigo
@@ -60,12 +69,25 @@ CREATE INDEX IF NOT EXISTS idx_mv_estab_fantasia_trgm
 CREATE INDEX IF NOT EXISTS idx_mv_estab_municipio_desc_trgm
     ON vw_estabelecimentos_completos USING gin (municipio_desc gin_trgm_ops);
 
+-- Busca textual por relevância (q) -> full-text sobre o tsvector sem acentos
+CREATE INDEX IF NOT EXISTS idx_mv_estab_nome_busca
+    ON vw_estabelecimentos_completos USING gin (nome_busca);
+
 -- Filtros comuns
 CREATE INDEX IF NOT EXISTS idx_mv_estab_uf
     ON vw_estabelecimentos_completos (uf);
 CREATE INDEX IF NOT EXISTS idx_mv_estab_situacao
     ON vw_estabelecimentos_completos (situacao_cadastral);
-CREATE INDEX IF NOT EXISTS idx_mv_estab_cnae
-    ON vw_estabelecimentos_completos (cnae_fiscal_principal);
+-- Formas quentes da busca, com cnpj_completo no fim (ORDER BY cnpj_completo /
+-- keyset sem sort). O município filtra pelo CÓDIGO: nomes se repetem entre UFs
+-- e o nome é resolvido para códigos na API (ReferenceRegistry).
+-- (cnae, uf, situação, cnpj) também atende o filtro só por cnae.
+CREATE INDEX IF NOT EXISTS idx_mv_estab_mun_sit_cnpj
+    ON vw_estabelecimentos_completos (municipio, situacao_cadastral, cnpj_completo);
+CREATE INDEX IF NOT EXISTS idx_mv_estab_cnae_uf_sit_cnpj
+    ON vw_estabelecimentos_completos (cnae_fiscal_principal, uf, situacao_cadastral, cnpj_completo);
+-- CNAE secundário: pertinência no array (&&), não LIKE no texto separado por vírgulas
+CREATE INDEX IF NOT EXISTS idx_mv_estab_cnaes_secundarios
+    ON vw_estabelecimentos_completos USING gin (cnaes_secundarios);
 
 ANALYZE vw_estabelecimentos_completos;
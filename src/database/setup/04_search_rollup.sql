@@ -0,0 +1,55 @@
+-- =====================================================================
+-- ESTÁGIO 4 — Rollup de contagens da busca (rodar DEPOIS da materialized view)
+-- O /search devolvia 'total' pela estimativa do planner (EXPLAIN), que erra
+-- por ordens de grandeza com filtros combinados (uf + cnae + situação).
+-- Aqui ficam as contagens EXATAS da MV em vários agrupamentos ESTREITOS
+-- (GROUPING SETS, uma única passada na MV). Um GROUP BY por todas as
+-- dimensões juntas teria milhões de grupos (quase a cardinalidade da MV) e
+-- um filtro amplo (uf='SP') somaria milhões de linhas a cada miss.
+-- `grupo` = GROUPING(...) das dimensões: identifica o agrupamento de cada
+-- linha (as colunas fora dele ficam NULL). A API escolhe o menor agrupamento
+-- que cobre os filtros (ROLLUP_SETS em src/api/search_rollup.py — mesma
+-- ordem de dimensões do GROUPING abaixo). Município entra só pelo código:
+-- agrupar também pela descrição dobraria a chave sem mudar os grupos, e o
+-- nome vem da tabela auxiliar na API.
+-- Reconstruído a cada carga mensal; a base não muda entre cargas.
+-- =====================================================================
+
+DROP TABLE IF EXISTS search_facet_counts;
+
+CREATE TABLE search_facet_counts AS
+SELECT
+    GROUPING(uf, municipio, cnae_fiscal_principal, situacao_cadastral,
+             porte_empresa, opcao_simples, opcao_mei, ano_inicio)::int AS grupo,
+    uf,
+    municipio,
+    cnae_fiscal_principal,
+    situacao_cadastral,
+    porte_empresa,
+    opcao_simples,
+    opcao_mei,
+    ano_inicio,
+    count(*)::bigint AS total
+FROM (
+    SELECT uf, municipio, cnae_fiscal_principal, situacao_cadastral,
+           porte_empresa, opcao_simples, opcao_mei,
+           extract(year FROM data_inicio_atividade)::smallint AS ano_inicio
+    FROM vw_estabelecimentos_completos
+) mv
+GROUP BY GROUPING SETS (
+    (uf, situacao_cadastral),
+    (uf, situacao_cadastral, ano_inicio),
+    (uf, situacao_cadastral, porte_empresa, opcao_simples, opcao_mei),
+    (uf, municipio, situacao_cadastral),
+    (uf, cnae_fiscal_principal, situacao_cadastral)
+);
+
+-- Toda consulta filtra por grupo; depois pelas dimensões mais seletivas
+CREATE INDEX IF NOT EXISTS idx_facet_grupo_uf_situacao
+    ON search_facet_counts (grupo, uf, situacao_cadastral);
+CREATE INDEX IF NOT EXISTS idx_facet_grupo_cnae
+    ON search_facet_counts (grupo, cnae_fiscal_principal);
+CREATE INDEX IF NOT EXISTS idx_facet_grupo_municipio
+    ON search_facet_counts (grupo, municipio);
+
+ANALYZE search_facet_counts;
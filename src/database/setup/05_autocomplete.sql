@@ -0,0 +1,33 @@
+-- =====================================================================
+-- ESTÁGIO 5 — Índice de prefixos do autocomplete (rodar DEPOIS da MV)
+-- O /autocomplete sugere empresas enquanto o usuário digita. ILIKE '%x%'
+-- na MV (72M linhas, ~linhas largas) é lento demais para cada tecla; aqui fica
+-- uma tabela ESTREITA só com as matrizes: nome normalizado (minúsculas, sem
+-- acentos, espaços colapsados — a mesma forma de normalize_prefix em
+-- src/api/autocomplete.py) + o que a sugestão mostra. Gravada já ordenada
+-- por nome_norm: um prefixo é uma faixa contígua do btree E do heap.
+-- Reconstruída a cada carga mensal; a base não muda entre cargas.
+-- =====================================================================
+
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+DROP TABLE IF EXISTS autocomplete_nomes;
+
+CREATE TABLE autocomplete_nomes AS
+SELECT
+    regexp_replace(lower(unaccent(btrim(razao_social))), '\s+', ' ', 'g') AS nome_norm,
+    razao_social,
+    cnpj_completo,
+    uf,
+    situacao_cadastral
+FROM vw_estabelecimentos_completos
+WHERE identificador_matriz_filial = '1'
+  AND coalesce(btrim(razao_social), '') <> ''
+ORDER BY 1, 3;
+
+-- text_pattern_ops: comparação byte a byte (sem collation), a que casa com
+-- busca por prefixo (operadores ~>=~ / ~<~ usados pela rota)
+CREATE INDEX IF NOT EXISTS idx_autocomplete_nome
+    ON autocomplete_nomes (nome_norm text_pattern_ops);
+
+ANALYZE autocomplete_nomes;
@@ -12,11 +12,23 @@ Acesso programático via WebDAV do share público:
   estrutura: pastas mensais AAAA-MM/ contendo os 37 .zip
 
 O TOKEN é configurável por env RFB_SHARE_TOKEN (caso a Receita rotacione o link).
+
+Motor de download (download_url): arquivos grandes são divididos em N segmentos
+HTTP Range baixados em paralelo (DOWNLOAD_SEGMENTS, padrão 4) e vários arquivos
+são baixados ao mesmo tempo (DOWNLOAD_WORKERS, padrão 3). Mantém o resume por
+.part (cada segmento retoma de onde parou) e confere o tamanho final. O
+particionamento em uso fica em .part.meta: um .part.N só é retomado se foi
+gravado com o mesmo tamanho/segmentos/passo.
 """
+import json
 import os
 import re
 import time
+import shutil
 import logging
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import unquote, quote
 
@@ -28,13 +40,179 @@ logger = logging.getLogger(__name__)
 WEBDAV_BASE = "https://arquivos.receitafederal.gov.br/public.php/webdav"
 DEFAULT_TOKEN = "YggdBLfdninEJX9"
 
+CORE_PREFIXES = ("Empresas", "Estabelecimentos", "Socios", "Simples")
+
+
+CHUNK = 1024 * 1024
+# abaixo disso, 1 stream só (segmentar arquivo pequeno não compensa as conexões extras)
+SEGMENT_MIN_BYTES = 64 * 1024 * 1024
+
+
+def _probe(url: str, auth=None):
+    """(tamanho, aceita_range) via HEAD. (None, False) se o servidor não informar."""
+    try:
+        r = requests.head(url, auth=auth, timeout=60, allow_redirects=True)
+        r.raise_for_status()
+    except requests.RequestException:
+        return None, False
+    size = r.headers.get("Content-Length")
+    return (int(size) if size and size.isdigit() else None,
+            r.headers.get("Accept-Ranges", "").lower() == "bytes")
+
+
+def _fetch_range(url: str, part: Path, start: int, end: int = None, auth=None):
+    """Baixa bytes [start, end] (end inclusivo; None = até o fim) anexando em `part`,
+    retomando do tamanho atual do arquivo."""
+    expected = None if end is None else end - start + 1
+    pos = part.stat().st_size if part.exists() else 0
+    if expected is not None and pos > expected:
+        part.unlink()  # .part de 1 stream ou de uma junção interrompida — recomeça o segmento
+        pos = 0
+    if expected is not None and pos == expected:
+        return
+    ranged = start + pos > 0 or end is not None
+    headers = {"Range": f"bytes={start + pos}-{'' if end is None else end}"} if ranged else {}
+    with requests.get(url, auth=auth, stream=True, timeout=1800, headers=headers) as r:
+        r.raise_for_status()
+        mode = "ab" if pos else "wb"
+        if ranged and r.status_code != 206:
+            # Servidor ignorou o Range (200): só dá para recomeçar o arquivo inteiro
+            if start or end is not None:
+                raise RuntimeError("servidor ignorou o Range de um segmento")
+            mode = "wb"
+        with open(part, mode) as f:
+            for chunk in r.iter_content(CHUNK):
+                if chunk:
+                    f.write(chunk)
+
+
+def _segment_files(tmp: Path) -> list:
+    """Arquivos .part.N (segmentos 1..N-1) de `tmp` em disco."""
+    prefix = tmp.name + "."
+    return [p for p in tmp.parent.iterdir()
+            if p.name.startswith(prefix) and p.name[len(prefix):].isdigit()]
+
+
+def _prepare_parts(tmp: Path, size, n: int, step) -> Path:
+    """Confere os .part em disco contra o particionamento atual e grava-o em
+    .part.meta ({size, segments, step}); devolve o caminho do .part.meta.
+
+    - 1 stream: .part.N de uma tentativa segmentada anterior são descartados;
+      o .part (sempre começa no byte 0) só é descartado se o tamanho mudou.
+    - N segmentos: layout diferente do gravado (outro DOWNLOAD_SEGMENTS,
+      arquivo trocado no servidor) descarta .part e todos os .part.N; sem
+      .part.meta, o .part sozinho é resume de 1 stream e os .part.N órfãos
+      são descartados.
+    """
+    meta = tmp.with_suffix(tmp.suffix + ".meta")
+    layout = {"size": size, "segments": n, "step": step}
+    saved = None
+    if meta.exists():
+        try:
+            saved = json.loads(meta.read_text())
+        except (OSError, ValueError):
+            saved = {}
+    if n == 1:
+        stale = _segment_files(tmp)
+        discard_part = saved is not None and size is not None and saved.get("size") != size
+    else:
+        stale = _segment_files(tmp) if saved != layout else []
+        discard_part = saved is not None and saved != layout
+    if discard_part:
+        logger.info("  particionamento mudou (%s -> %s): recomeçando %s", saved, layout, tmp.name)
+        stale.append(tmp)
+    for p in stale:
+        p.unlink(missing_ok=True)
+    if size is not None:
+        meta.write_text(json.dumps(layout))
+    return meta
+
+
+def download_url(url: str, dest: Path, auth=None, segments: int = 1, max_retries: int = 5) -> Path:
+    """Baixa `url` para `dest` com retentativas, resume por .part e conferência
+    de tamanho. Com segments > 1 e servidor com Range, divide o arquivo em
+    `segments` faixas baixadas em paralelo: o segmento 0 vai no próprio .part
+    (compatível com o resume de 1 stream) e os demais em .part.N, anexados ao
+    .part no fim; o particionamento fica em .part.meta (ver _prepare_parts).
+    Levanta RuntimeError se esgotar as retentativas."""
+    dest = Path(dest)
+    tmp = dest.with_suffix(dest.suffix + ".part")
+    last_err = None
+    for attempt in range(1, max_retries + 1):
+        try:
+            size, ranges = _probe(url, auth)
+            n = segments if ranges and size and size >= SEGMENT_MIN_BYTES * 2 else 1
+            step = -(-size // n) if n > 1 else None
+            meta = _prepare_parts(tmp, size, n, step)
+            if n == 1:
+                pos = tmp.stat().st_size if tmp.exists() else 0
+                logger.info("  baixando: %s (tentativa %d/%d, offset %.1f MB)",
+                            dest.name, attempt, max_retries, pos / 1e6)
+                _fetch_range(url, tmp, 0, None, auth)
+            else:
+                bounds = [(i * step, min(size, (i + 1) * step) - 1) for i in range(n)]
+                parts = [tmp] + [tmp.with_suffix(tmp.suffix + f".{i}") for i in range(1, n)]
+                logger.info("  baixando: %s em %d segmentos (tentativa %d/%d, %.1f MB)",
+                            dest.name, n, attempt, max_retries, size / 1e6)
+                with ThreadPoolExecutor(max_workers=n, thread_name_prefix="segment") as pool:
+                    for fut in [pool.submit(_fetch_range, url, p, a, b, auth)
+                                for p, (a, b) in zip(parts, bounds)]:
+                        fut.result()
+                with open(tmp, "ab") as out:
+                    for p in parts[1:]:
+                        with open(p, "rb") as fh:
+                            shutil.copyfileobj(fh, out, CHUNK)
+                        p.unlink()
+            got = tmp.stat().st_size
+            if size is not None and got != size:
+                tmp.unlink()
+                meta.unlink(missing_ok=True)
+                raise RuntimeError(f"tamanho final {got} != {size} esperado")
+            tmp.rename(dest)
+            meta.unlink(missing_ok=True)
+            logger.info("  ✓ %s (%.1f MB)", dest.name, dest.stat().st_size / 1e6)
+            return dest
+        except Exception as e:
+            last_err = e
+            logger.warning("  ⚠ falha parcial em %s (tentativa %d/%d): %s",
+                           dest.name, attempt, max_retries, str(e)[:100])
+            if attempt < max_retries:
+                time.sleep(min(8 * attempt, 40))
+    raise RuntimeError(f"Falha ao baixar {dest.name} após {max_retries} tentativas: {last_err}")
+
+
+def download_concurrently(download_one, files, workers: int):
+    """Gera o resultado de download_one(fn) na ORDEM de `files`, com até
+    `workers` downloads em andamento. O próximo só é disparado quando um
+    resultado é consumido — a fila limitada do consumidor segura a rede."""
+    files, workers = iter(files), max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download") as pool:
+        window = deque(pool.submit(download_one, fn) for fn in islice(files, workers))
+        while window:
+            result = window.popleft().result()
+            nxt = next(files, None)
+            if nxt is not None:
+                window.append(pool.submit(download_one, nxt))
+            yield result
+
+
+def load_order(filename: str):
+    """Chave de ordenação pela dependência da carga:
+    auxiliares (Cnaes, Municipios...) → Empresas → Estabelecimentos/Socios/Simples."""
+    if filename.startswith("Empresas"):
+        return (1, filename)
+    return (2 if filename.startswith(CORE_PREFIXES) else 0, filename)
+
 
 class SerproDownloader:
-    def __init__(self, token: str = None, download_dir: str = "downloads"):
+    def __init__(self, token: str = None, download_dir: str = "downloads",
+                 workers: int = None, segments: int = None):
         self.token = token or os.getenv("RFB_SHARE_TOKEN", DEFAULT_TOKEN)
         self.auth = HTTPBasicAuth(self.token, "")
         self.download_dir = Path(download_dir)
         self.download_dir.mkdir(parents=True, exist_ok=True)
+        self.workers = workers or int(os.getenv("DOWNLOAD_WORKERS", "3"))
+        self.segments = segments or int(os.getenv("DOWNLOAD_SEGMENTS", "4"))
 
     def _propfind(self, url: str):
         r = requests.request("PROPFIND", url, auth=self.auth,
@@ -61,34 +239,22 @@ class SerproDownloader:
             logger.info("  já existe (pulando): %s", filename)
             return dest
         url = f"{WEBDAV_BASE}/{folder}/{quote(filename)}"
-        tmp = dest.with_suffix(dest.suffix + ".part")
-        last_err = None
-        for attempt in range(1, max_retries + 1):
-            try:
-                # Retoma de onde parou (HTTP Range) se já houver um .part parcial
-                pos = tmp.stat().st_size if tmp.exists() else 0
-                headers = {"Range": f"bytes={pos}-"} if pos else {}
-                logger.info("  baixando: %s (tentativa %d/%d, offset %.1f MB)",
-                            filename, attempt, max_retries, pos / 1e6)
-                with requests.get(url, auth=self.auth, stream=True, timeout=1800, headers=headers) as r:
-                    mode = "ab" if pos else "wb"
-                    # Se o servidor ignorou o Range (200 em vez de 206), recomeça do zero
-                    if pos and r.status_code == 200:
-                        mode = "wb"
-                    r.raise_for_status()
-                    with open(tmp, mode) as f:
-                        for chunk in r.iter_content(1024 * 1024):
-                            if chunk:
-                                f.write(chunk)
-                tmp.rename(dest)
-                logger.info("  ✓ %s (%.1f MB)", filename, dest.stat().st_size / 1e6)
-                return dest
-            except Exception as e:
-                last_err = e
-                logger.warning("  ⚠ falha parcial em %s (tentativa %d/%d): %s",
-                               filename, attempt, max_retries, str(e)[:100])
-                time.sleep(min(8 * attempt, 40))
-        raise RuntimeError(f"Falha ao baixar {filename} após {max_retries} tentativas: {last_err}")
+        return download_url(url, dest, auth=self.auth, segments=self.segments,
+                            max_retries=max_retries)
+
+    def iter_latest(self, only: list = None, folder: str = None):
+        """Gera o Path de cada .zip da pasta mais recente assim que termina de baixar,
+        em ordem de dependência (load_order) — alimenta o pipeline download → carga.
+        Falha definitiva em qualquer arquivo levanta exceção no consumidor."""
+        folder = folder or self.get_latest_folder()
+        files = self.list_zip_files(folder)
+        if only:
+            files = [f for f in files if any(f.startswith(p) for p in only)]
+        logger.info("Pasta %s: %d arquivo(s) a baixar", folder, len(files))
+        # lança se esgotar as retentativas
+        yield from download_concurrently(lambda fn: self.download_file(folder, fn),
+                                         sorted(files, key=load_order), self.workers)
+        logger.info("✓ Todos os %d arquivos baixados com sucesso", len(files))
 
     def download_latest(self, only: list = None) -> dict:
         """Baixa todos os .zip da pasta mais recente. only = lista de prefixos (ex.: ['Empresas']).
@@ -97,16 +263,7 @@ class SerproDownloader:
         atualização aborta ANTES de truncar o banco, evitando carga incompleta.
         """
         folder = self.get_latest_folder()
-        files = self.list_zip_files(folder)
-        if only:
-            files = [f for f in files if any(f.startswith(p) for p in only)]
-        logger.info("Pasta %s: %d arquivo(s) a baixar", folder, len(files))
-        out = {"folder": folder, "files": []}
-        for fn in files:
-            p = self.download_file(folder, fn)  # lança se esgotar as retentativas
-            out["files"].append(str(p))
-        logger.info("✓ Todos os %d arquivos baixados com sucesso", len(files))
-        return out
+        return {"folder": folder, "files": [str(p) for p in self.iter_latest(only, folder)]}
 
 
 class CasaDosDadosDownloader:
@@ -119,10 +276,12 @@ class CasaDosDadosDownloader:
     """
     BASE = "https://dados-abertos-rf-cnpj.casadosdados.com.br/arquivos"
 
-    def __init__(self, download_dir: str = "downloads"):
+    def __init__(self, download_dir: str = "downloads", workers: int = None, segments: int = None):
         self.download_dir = Path(download_dir)
         self.download_dir.mkdir(parents=True, exist_ok=True)
         self._dated_folder = None
+        self.workers = workers or int(os.getenv("DOWNLOAD_WORKERS", "3"))
+        self.segments = segments or int(os.getenv("DOWNLOAD_SEGMENTS", "4"))
 
     def _html(self, url: str) -> str:
         r = requests.get(url, timeout=60)
@@ -152,45 +311,23 @@ class CasaDosDadosDownloader:
             logger.info("  já existe (pulando): %s", filename)
             return dest
         url = f"{self.BASE}/{dated_folder}/{quote(filename)}"
-        tmp = dest.with_suffix(dest.suffix + ".part")
-        last_err = None
-        for attempt in range(1, max_retries + 1):
-            try:
-                pos = tmp.stat().st_size if tmp.exists() else 0
-                headers = {"Range": f"bytes={pos}-"} if pos else {}
-                logger.info("  baixando: %s (tentativa %d/%d, offset %.1f MB)",
-                            filename, attempt, max_retries, pos / 1e6)
-                with requests.get(url, stream=True, timeout=1800, headers=headers) as r:
-                    mode = "ab" if pos else "wb"
-                    if pos and r.status_code == 200:
-                        mode = "wb"
-                    r.raise_for_status()
-                    with open(tmp, mode) as f:
-                        for chunk in r.iter_content(1024 * 1024):
-                            if chunk:
-                                f.write(chunk)
-                tmp.rename(dest)
-                logger.info("  ✓ %s (%.1f MB)", filename, dest.stat().st_size / 1e6)
-                return dest
-            except Exception as e:
-                last_err = e
-                logger.warning("  ⚠ falha parcial em %s (tentativa %d/%d): %s",
-                               filename, attempt, max_retries, str(e)[:100])
-                time.sleep(min(8 * attempt, 40))
-        raise RuntimeError(f"Falha ao baixar {filename} após {max_retries} tentativas: {last_err}")
+        return download_url(url, dest, segments=self.segments, max_retries=max_retries)
 
-    def download_latest(self, only: list = None) -> dict:
+    def iter_latest(self, only: list = None):
+        """Como SerproDownloader.iter_latest: um Path por zip, em load_order."""
         dated = self._dated_folder or self._latest_dated()
         files = self.list_zip_files(dated)
         if only:
             files = [f for f in files if any(f.startswith(p) for p in only)]
         logger.info("Casa dos Dados %s: %d arquivo(s) a baixar", dated, len(files))
-        out = {"folder": dated[:7], "files": []}
-        for fn in files:
-            p = self.download_file(dated, fn)  # lança se esgotar as retentativas
-            out["files"].append(str(p))
+        # lança se esgotar as retentativas
+        yield from download_concurrently(lambda fn: self.download_file(dated, fn),
+                                         sorted(files, key=load_order), self.workers)
         logger.info("✓ Todos os %d arquivos baixados (Casa dos Dados)", len(files))
-        return out
+
+    def download_latest(self, only: list = None) -> dict:
+        files = [str(p) for p in self.iter_latest(only)]
+        return {"folder": self._dated_folder[:7], "files": files}
 
 
 def main():
@@ -8,8 +8,10 @@ from tqdm import tqdm
 import pandas as pd
 from io import StringIO
 from src.database.connection import db_manager
+from src.database.reference_data import load_reference_tables
 from src.config import settings
 from src.etl.etl_tracker import ETLTracker
+from src.etl.transform import filter_valid_codes, format_rfb_dates
 import asyncio
 
 logging.basicConfig(
@@ -47,29 +49,16 @@ class CNPJImporter:
     def preload_all_valid_codes(self):
         """Pré-carrega TODOS os códigos válidos de uma vez (otimização para VPS remota)"""
         logger.info("🔄 Pré-carregando códigos de validação...")
-        
-        tables_to_load = [
-            'cnaes', 
-            'municipios', 
-            'motivos_situacao_cadastral', 
-            'naturezas_juridicas', 
-            'paises', 
-            'qualificacoes_socios'
-        ]
-        
+
         try:
+            # Mesmo carregador do ReferenceRegistry da API
             with db_manager.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                for table in tables_to_load:
-                    logger.info(f"  → Carregando {table}...")
-                    cursor.execute(f"SELECT codigo FROM {table}")
-                    codes = {row[0] for row in cursor.fetchall()}
-                    self.valid_codes_cache[table] = codes
-                    logger.info(f"  ✓ {table}: {len(codes):,} códigos carregados")
-                
-                cursor.close()
-            
+                tables = load_reference_tables(conn)
+
+            for table, descriptions in tables.items():
+                self.valid_codes_cache[table] = set(descriptions)
+                logger.info(f"  ✓ {table}: {len(descriptions):,} códigos carregados")
+
             logger.info("✅ Pré-carregamento completo!")
             return True
         except Exception as e:
@@ -83,10 +72,7 @@ class CNPJImporter:
 
         try:
             with db_manager.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(f"SELECT codigo FROM {table_name}")
-                codes = {row[0] for row in cursor.fetchall()}
-                cursor.close()
+                codes = set(load_reference_tables(conn, (table_name,))[table_name])
                 self.valid_codes_cache[table_name] = codes
                 logger.info(f"✓ Cache carregado: {table_name} ({len(codes):,} códigos)")
                 return codes
@@ -104,6 +90,10 @@ class CNPJImporter:
             return ''
         return value
 
+    def validate_foreign_keys(self, series: pd.Series, table_name: str) -> pd.Series:
+        """Versão vetorizada de validate_foreign_key para uma coluna inteira do chunk"""
+        return filter_valid_codes(series, self.load_valid_codes(table_name))
+
     def validate_zip_file(self, zip_path: Path) -> tuple[bool, str]:
         """Valida se o arquivo ZIP está íntegro e contém dados válidos"""
         try:
@@ -367,14 +357,10 @@ class CNPJImporter:
                         chunk = chunk.fillna('')
 
                         # Validar qualificacao_responsavel
-                        chunk['qualificacao_responsavel'] = chunk['qualificacao_responsavel'].apply(
-                            lambda x: self.validate_foreign_key(x, 'qualificacoes_socios')
-                        )
+                        chunk['qualificacao_responsavel'] = self.validate_foreign_keys(chunk['qualificacao_responsavel'], 'qualificacoes_socios')
 
                         # Validar natureza_juridica
-                        chunk['natureza_juridica'] = chunk['natureza_juridica'].apply(
-                            lambda x: self.validate_foreign_key(x, 'naturezas_juridicas')
-                        )
+                        chunk['natureza_juridica'] = self.validate_foreign_keys(chunk['natureza_juridica'], 'naturezas_juridicas')
 
                         capital_social_series = pd.to_numeric(
                             chunk['capital_social'].str.replace(',', '.'),
@@ -497,27 +483,12 @@ class CNPJImporter:
                         chunk = chunk.fillna('')
 
                         # Validar foreign keys
-                        chunk['motivo_situacao_cadastral'] = chunk['motivo_situacao_cadastral'].apply(
-                            lambda x: self.validate_foreign_key(x, 'motivos_situacao_cadastral')
-                        )
-                        chunk['pais'] = chunk['pais'].apply(
-                            lambda x: self.validate_foreign_key(x, 'paises')
-                        )
-                        chunk['cnae_fiscal_principal'] = chunk['cnae_fiscal_principal'].apply(
-                            lambda x: self.validate_foreign_key(x, 'cnaes')
-                        )
-                        chunk['municipio'] = chunk['municipio'].apply(
-                            lambda x: self.validate_foreign_key(x, 'municipios')
-                        )
+                        chunk['motivo_situacao_cadastral'] = self.validate_foreign_keys(chunk['motivo_situacao_cadastral'], 'motivos_situacao_cadastral')
+                        chunk['pais'] = self.validate_foreign_keys(chunk['pais'], 'paises')
+                        chunk['cnae_fiscal_principal'] = self.validate_foreign_keys(chunk['cnae_fiscal_principal'], 'cnaes')
+                        chunk['municipio'] = self.validate_foreign_keys(chunk['municipio'], 'municipios')
 
-                        for date_col in ['data_situacao_cadastral', 'data_inicio_atividade', 'data_situacao_especial']:
-                            chunk[date_col] = pd.to_datetime(
-                                chunk[date_col],
-                                format='%Y%m%d',
-                                errors='coerce'
-                            )
-                            chunk[date_col] = chunk[date_col].dt.strftime('%Y-%m-%d')
-                            chunk[date_col] = chunk[date_col].replace('NaT', '')
+                        format_rfb_dates(chunk, ['data_situacao_cadastral', 'data_inicio_atividade', 'data_situacao_especial'])
 
                         # Selecionar apenas as colunas que podem ser inseridas no banco (sem cnpj_completo)
                         chunk_to_insert = chunk[db_columns]
@@ -644,23 +615,11 @@ class CNPJImporter:
                         chunk = chunk.fillna('')
 
                         # Validar foreign keys
-                        chunk['qualificacao_socio'] = chunk['qualificacao_socio'].apply(
-                            lambda x: self.validate_foreign_key(x, 'qualificacoes_socios')
-                        )
-                        chunk['qualificacao_representante'] = chunk['qualificacao_representante'].apply(
-                            lambda x: self.validate_foreign_key(x, 'qualificacoes_socios')
-                        )
-                        chunk['pais'] = chunk['pais'].apply(
-                            lambda x: self.validate_foreign_key(x, 'paises')
-                        )
+                        chunk['qualificacao_socio'] = self.validate_foreign_keys(chunk['qualificacao_socio'], 'qualificacoes_socios')
+                        chunk['qualificacao_representante'] = self.validate_foreign_keys(chunk['qualificacao_representante'], 'qualificacoes_socios')
+                        chunk['pais'] = self.validate_foreign_keys(chunk['pais'], 'paises')
 
-                        chunk['data_entrada_sociedade'] = pd.to_datetime(
-                            chunk['data_entrada_sociedade'],
-                            format='%Y%m%d',
-                            errors='coerce'
-                        )
-                        chunk['data_entrada_sociedade'] = chunk['data_entrada_sociedade'].dt.strftime('%Y-%m-%d')
-                        chunk['data_entrada_sociedade'] = chunk['data_entrada_sociedade'].replace('NaT', '')
+                        format_rfb_dates(chunk, ['data_entrada_sociedade'])
 
                         output = StringIO()
                         chunk.to_csv(output, sep=';', header=False, index=False)
@@ -756,14 +715,7 @@ class CNPJImporter:
                     ):
                         chunk = chunk.fillna('')
 
-                        for date_col in ['data_opcao_simples', 'data_exclusao_simples', 'data_opcao_mei', 'data_exclusao_mei']:
-                            chunk[date_col] = pd.to_datetime(
-                                chunk[date_col],
-                                format='%Y%m%d',
-                                errors='coerce'
-                            )
-                            chunk[date_col] = chunk[date_col].dt.strftime('%Y-%m-%d')
-                            chunk[date_col] = chunk[date_col].replace('NaT', '')
+                        format_rfb_dates(chunk, ['data_opcao_simples', 'data_exclusao_simples', 'data_opcao_mei', 'data_exclusao_mei'])
 
                         output = StringIO()
                         chunk.to_csv(output, sep=';', header=False, index=False)
@@ -0,0 +1,34 @@
+"""
+Transformações vetorizadas dos chunks do ETL (pandas) — sem dependência de banco.
+
+Substituem o `.apply(lambda)` por célula do CNPJImporter: com ~60M linhas e
+várias colunas por chunk, uma chamada Python por valor dominava o tempo de
+CPU do import.
+"""
+from typing import Iterable, List
+
+import pandas as pd
+
+
+def filter_valid_codes(series: pd.Series, valid_codes: Iterable[str]) -> pd.Series:
+    """Mantém os códigos presentes em `valid_codes` e troca os demais por ''.
+
+    Equivale a validate_foreign_key aplicado célula a célula, mas em uma única
+    passada (Series.isin faz hash-lookup em C)."""
+    return series.where(series.isin(valid_codes), '')
+
+
+def format_rfb_dates(chunk: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    """Converte as colunas AAAAMMDD para AAAA-MM-DD ('' se inválida/zerada), in-place.
+
+    As colunas são processadas juntas e só os valores DISTINTOS são parseados:
+    um chunk de 1M linhas tem poucos milhares de datas diferentes, então o
+    to_datetime/strftime roda sobre elas e o resultado volta por indexação."""
+    if not columns:
+        return chunk
+    values = chunk[columns].to_numpy(dtype=object).ravel()
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format='%Y%m%d', errors='coerce')
+    formatted = parsed.dt.strftime('%Y-%m-%d').fillna('').to_numpy(dtype=object)
+    chunk[columns] = formatted[codes].reshape(len(chunk), len(columns))
+    return chunk
@@ -0,0 +1,72 @@
+"""
+Cursor opaco para paginação keyset (seek) — puro, sem dependência de banco/IO.
+
+O cursor guarda a chave de ordenação da ÚLTIMA linha entregue. A próxima página
+filtra "depois desta chave" em vez de pular N linhas com OFFSET, então o custo
+de cada página independe da profundidade.
+"""
+import base64
+import json
+from typing import Optional
+
+# Ordenações suportadas (devem casar com o ORDER BY do /search)
+SORT_CNPJ = "c"     # ORDER BY cnpj_completo
+SORT_RAZAO = "r"    # ORDER BY razao_social, cnpj_completo
+SORT_RANK = "t"     # relevância da busca textual (q): sem keyset, só page/offset
+
+_VERSION = 1
+
+
+def encode_cursor(sort: str, values: list, filters_key: str) -> str:
+    """Serializa a chave da última linha em um token base64url opaco.
+    filters_key amarra o cursor ao conjunto de filtros que o gerou."""
+    payload = {"v": _VERSION, "s": sort, "k": values, "f": filters_key[:16]}
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, filters_key: Optional[str] = None) -> dict:
+    """
+    Valida e desserializa o cursor. Levanta ValueError se o token for inválido,
+    de outra versão, ou se foi gerado para outro conjunto de filtros.
+    """
+    if not token:
+        raise ValueError("cursor vazio")
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise ValueError("cursor malformado")
+    if not isinstance(payload, dict) or payload.get("v") != _VERSION:
+        raise ValueError("versão de cursor não suportada")
+    sort, values = payload.get("s"), payload.get("k")
+    if sort == SORT_CNPJ:
+        ok = isinstance(values, list) and len(values) == 1 and isinstance(values[0], str)
+    elif sort == SORT_RAZAO:
+        ok = (isinstance(values, list) and len(values) == 2
+              and (values[0] is None or isinstance(values[0], str))
+              and isinstance(values[1], str))
+    else:
+        ok = False
+    if not ok:
+        raise ValueError("cursor com chave de ordenação inválida")
+    if filters_key is not None and payload.get("f") != filters_key[:16]:
+        raise ValueError("cursor gerado para outros filtros")
+    return {"sort": sort, "values": values}
+
+
+def keyset_condition(sort: str, values: list) -> tuple[str, list]:
+    """
+    Predicado SQL "linhas depois do cursor" + parâmetros.
+
+    Para (razao_social, cnpj_completo), NULLs de razao_social vêm por último no
+    ORDER BY ASC; comparação de row-value com NULL daria NULL (linha sumiria),
+    por isso o trecho NULL é tratado explicitamente.
+    """
+    if sort == SORT_CNPJ:
+        return "cnpj_completo > %s", [values[0]]
+    razao, cnpj = values
+    if razao is None:
+        return "(razao_social IS NULL AND cnpj_completo > %s)", [cnpj]
+    return ("((razao_social, cnpj_completo) > (%s, %s) OR razao_social IS NULL)",
+            [razao, cnpj])
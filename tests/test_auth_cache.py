@@ -0,0 +1,40 @@
+from src.api import auth_cache as auth_cache_module
+from src.api.auth_cache import AuthCache
+
+
+def test_get_devolve_copia():
+    cache = AuthCache(ttl=60)
+    cache.set("h1", {"id": 1, "plan": "free"})
+    ctx = cache.get("h1")
+    ctx["plan"] = "pro"  # handlers mutam o dict do usuário
+    assert cache.get("h1")["plan"] == "free"
+
+
+def test_expira_apos_ttl(monkeypatch):
+    agora = [1000.0]
+    monkeypatch.setattr(auth_cache_module.time, "time", lambda: agora[0])
+    cache = AuthCache(ttl=30)
+    cache.set("h1", {"id": 1})
+    agora[0] += 29
+    assert cache.get("h1") is not None
+    agora[0] += 2
+    assert cache.get("h1") is None
+
+
+def test_invalidate_user_remove_todas_as_keys_do_usuario():
+    cache = AuthCache(ttl=60)
+    cache.set("h1", {"id": 1})
+    cache.set("h2", {"id": 1})
+    cache.set("h3", {"id": 2})
+    cache.invalidate_user(1)
+    assert cache.get("h1") is None and cache.get("h2") is None
+    assert cache.get("h3") == {"id": 2}
+
+
+def test_limite_de_entradas():
+    cache = AuthCache(ttl=60, max_entries=2)
+    cache.set("h1", {"id": 1})
+    cache.set("h2", {"id": 2})
+    cache.set("h3", {"id": 3})
+    assert cache.get("h3") == {"id": 3}
+    assert len(cache._entries) <= 2
@@ -0,0 +1,34 @@
+from src.api.autocomplete import cache_key, normalize_prefix, prefix_bounds, rows_to_suggestions
+
+
+def test_normalize_prefix_igual_ao_nome_norm_do_sql():
+    assert normalize_prefix("  Padaria   SÃO  Jo") == "padaria sao jo"
+
+
+def test_normalize_prefix_mantem_espaco_final():
+    assert normalize_prefix("sao ") == "sao "
+
+
+def test_normalize_prefix_curto_demais():
+    assert normalize_prefix("a") is None
+    assert normalize_prefix("   ") is None
+    assert normalize_prefix(None) is None
+
+
+def test_prefix_bounds_faixa_exata():
+    start, end = prefix_bounds("padaria sao j")
+    assert (start, end) == ("padaria sao j", "padaria sao k")
+    assert start <= "padaria sao jose ltda" < end
+    assert not ("padaria sao k" < end)
+
+
+def test_cache_key_separa_limites():
+    assert cache_key("co", 10) != cache_key("co", 20)
+
+
+def test_rows_to_suggestions():
+    rows = [("PADARIA SAO JOSE LTDA", "12345678000199", "SP", "02")]
+    assert rows_to_suggestions(rows) == [{
+        'razao_social': "PADARIA SAO JOSE LTDA", 'cnpj': "12345678000199",
+        'uf': "SP", 'situacao_cadastral': "02",
+    }]
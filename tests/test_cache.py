@@ -30,3 +30,77 @@ def test_incr_rate_desabilitado_retorna_menos_um():
     c = _disabled_cache()
     # fail-open: sem Redis o rate limiter cai para memória
     assert c.incr_rate('rl:x', 60) == -1
+
+
+def test_get_many_set_many_delete_many_fallback_memoria():
+    c = _disabled_cache()
+    assert c.set_many({'a': 1, 'b': [1, 2]}, ttl_seconds=60, ttls={'b': 5}) is True
+    assert c.get_many(['a', 'b', 'zz']) == {'a': 1, 'b': [1, 2]}
+    assert c.get_many([]) == {}
+    assert c.delete_many(['a', 'zz']) == 1
+    assert c.get_many(['a', 'b']) == {'b': [1, 2]}
+
+
+def test_codec_json_gzip_roundtrip():
+    from datetime import date
+    from src.api.models import CNAEModel
+    c = _disabled_cache()
+    raw = c._compress({'d': date(2024, 1, 31), 'm': CNAEModel(codigo='6201501', descricao='Dev'), 'ç': 1})
+    assert raw[:1] == b'J'
+    assert c._decompress(raw) == {'d': '2024-01-31', 'm': {'codigo': '6201501', 'descricao': 'Dev'}, 'ç': 1}
+
+
+def test_cached_body_guarda_o_gzip_como_esta():
+    import gzip
+    from src.api.cache_redis import CachedBody
+    c = _disabled_cache()
+    body = CachedBody.from_value({'total': 1, 'items': [{'uf': 'SP'}]})
+    assert gzip.decompress(body.gzipped) == b'{"total":1,"items":[{"uf":"SP"}]}'
+    back = c._decompress(c._compress(body))
+    assert isinstance(back, CachedBody) and back.gzipped == body.gzipped
+    assert back.value() == {'total': 1, 'items': [{'uf': 'SP'}]}
+
+
+def test_formato_antigo_pickle_zlib_nao_e_desserializado():
+    import pickle
+    import zlib
+    c = _disabled_cache()
+    assert c._decompress(zlib.compress(pickle.dumps({'a': 1}), level=6)) is None
+
+
+def test_sem_redis_chaves_nao_tem_prefixo_de_geracao():
+    c = _disabled_cache()
+    assert c.generation() is None
+    assert c._ns('cnpj:123') == 'cnpj:123'
+
+
+def test_geracao_prefixa_as_chaves():
+    c = _disabled_cache()
+    c._generation, c._generation_expires = '7', float('inf')
+    c.enabled = True  # só o prefixo: nenhuma chamada ao Redis
+    assert c._ns('search:abc') == 'g7:search:abc'
+
+
+def test_geracao_fixada_durante_a_carga():
+    c = _disabled_cache()
+    c._generation, c._generation_expires = '7', float('inf')
+    c.enabled = True  # só o prefixo: nenhuma chamada ao Redis
+    with c.pinned_generation():
+        assert not c.generation_changed()
+        c._generation = '8'  # ETL incrementou no meio da consulta
+        assert c._ns('search:abc') == 'g7:search:abc'
+        assert c.generation_changed()
+        # descartadas antes de chegar ao Redis (redis_client é None)
+        assert c.set('search:abc', {'total': 1}) is False
+        assert c.set_many({'search:abc': {'total': 1}}) is False
+    assert not c.generation_changed()
+    assert c._ns('search:abc') == 'g8:search:abc'
+
+
+def test_bump_generation_sem_redis_limpa_a_memoria():
+    c = _disabled_cache()
+    c.set('cnpj:1', {'a': 1}, ttl_seconds=60)
+    c.set('search:x', {'b': 2}, ttl_seconds=60)
+    assert c.delete_pattern('search:*') == 1
+    c.bump_generation()
+    assert c.get('cnpj:1') is None
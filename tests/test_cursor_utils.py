@@ -0,0 +1,39 @@
+import pytest
+
+from src.utils.cursor_utils import (
+    SORT_CNPJ, SORT_RAZAO, encode_cursor, decode_cursor, keyset_condition
+)
+
+FILTERS = "0123456789abcdef0123456789abcdef"
+
+
+def test_roundtrip_cnpj():
+    token = encode_cursor(SORT_CNPJ, ["12345678000190"], FILTERS)
+    assert decode_cursor(token, FILTERS) == {"sort": SORT_CNPJ, "values": ["12345678000190"]}
+
+
+def test_roundtrip_razao_com_acento_e_null():
+    token = encode_cursor(SORT_RAZAO, ["AÇÚCAR & CIA", "12345678000190"], FILTERS)
+    assert decode_cursor(token, FILTERS)["values"] == ["AÇÚCAR & CIA", "12345678000190"]
+    token = encode_cursor(SORT_RAZAO, [None, "12345678000190"], FILTERS)
+    assert decode_cursor(token, FILTERS)["values"] == [None, "12345678000190"]
+
+
+def test_cursor_de_outros_filtros_rejeitado():
+    token = encode_cursor(SORT_CNPJ, ["12345678000190"], FILTERS)
+    with pytest.raises(ValueError):
+        decode_cursor(token, "f" * 32)
+
+
+@pytest.mark.parametrize("token", ["", "lixo!!", "eyJ2IjoxfQ"])
+def test_cursor_malformado(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+def test_keyset_condition():
+    assert keyset_condition(SORT_CNPJ, ["1"]) == ("cnpj_completo > %s", ["1"])
+    sql, params = keyset_condition(SORT_RAZAO, ["ACME", "1"])
+    assert "OR razao_social IS NULL" in sql and params == ["ACME", "1"]
+    sql, params = keyset_condition(SORT_RAZAO, [None, "1"])
+    assert sql.startswith("(razao_social IS NULL") and params == ["1"]
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.etl import downloader_serpro
+from src.etl.downloader_serpro import download_concurrently, download_url, load_order
+
+DATA = os.urandom(200_000)
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """Stand-in do SERPRO+/Casa dos Dados: serve DATA com suporte a Range."""
+    ranges_seen = []
+
+    def do_HEAD(self):
+        self._send(head=True)
+
+    def do_GET(self):
+        self._send()
+
+    def _send(self, head=False):
+        body, status = DATA, 200
+        rng = self.headers.get("Range")
+        if rng and not head:
+            self.ranges_seen.append(rng)
+            start, _, end = rng.removeprefix("bytes=").partition("-")
+            body = DATA[int(start):int(end) + 1 if end else len(DATA)]
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"{rng.replace('=', ' ')}/{len(DATA)}")
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    _RangeHandler.ranges_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/Estabelecimentos0.zip"
+    server.shutdown()
+
+
+def test_download_segmentado_confere_bytes(url, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader_serpro, "SEGMENT_MIN_BYTES", 10_000)
+    dest = download_url(url, tmp_path / "Estabelecimentos0.zip", segments=4, max_retries=1)
+    assert dest.read_bytes() == DATA
+    assert len(_RangeHandler.ranges_seen) == 4
+    assert list(tmp_path.iterdir()) == [dest]  # nenhum .part sobrando
+
+
+def test_download_retoma_part_existente(url, tmp_path):
+    (tmp_path / "Estabelecimentos0.zip.part").write_bytes(DATA[:50_000])
+    dest = download_url(url, tmp_path / "Estabelecimentos0.zip", segments=1, max_retries=1)
+    assert dest.read_bytes() == DATA
+    assert _RangeHandler.ranges_seen == ["bytes=50000-"]
+
+
+def _layout(tmp_path, segments):
+    (tmp_path / "Estabelecimentos0.zip.part.meta").write_text(json.dumps(
+        {"size": len(DATA), "segments": segments, "step": -(-len(DATA) // segments)}))
+
+
+def test_segmento_retoma_e_part_maior_que_segmento_recomeca(url, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader_serpro, "SEGMENT_MIN_BYTES", 10_000)
+    _layout(tmp_path, 4)
+    # .part maior que o segmento 0 (50_000 bytes): junção interrompida
+    (tmp_path / "Estabelecimentos0.zip.part").write_bytes(DATA[:80_000])
+    (tmp_path / "Estabelecimentos0.zip.part.2").write_bytes(DATA[100_000:120_000])
+    dest = download_url(url, tmp_path / "Estabelecimentos0.zip", segments=4, max_retries=1)
+    assert dest.read_bytes() == DATA
+    assert "bytes=0-49999" in _RangeHandler.ranges_seen
+    assert "bytes=120000-149999" in _RangeHandler.ranges_seen
+    assert list(tmp_path.iterdir()) == [dest]  # nem .part.meta sobrando
+
+
+def test_segments_diferente_entre_execucoes_descarta_os_parts(url, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader_serpro, "SEGMENT_MIN_BYTES", 10_000)
+    # execução anterior com 4 segmentos; .part.1 (50_000..) NÃO é o segmento 1 de 2 (100_000..)
+    _layout(tmp_path, 4)
+    (tmp_path / "Estabelecimentos0.zip.part").write_bytes(DATA[:30_000])
+    (tmp_path / "Estabelecimentos0.zip.part.1").write_bytes(DATA[50_000:70_000])
+    (tmp_path / "Estabelecimentos0.zip.part.3").write_bytes(DATA[150_000:160_000])
+    dest = download_url(url, tmp_path / "Estabelecimentos0.zip", segments=2, max_retries=1)
+    assert dest.read_bytes() == DATA
+    assert sorted(_RangeHandler.ranges_seen) == ["bytes=0-99999", "bytes=100000-199999"]
+    assert list(tmp_path.iterdir()) == [dest]
+
+
+def test_part_n_sem_layout_nao_e_retomado(url, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader_serpro, "SEGMENT_MIN_BYTES", 10_000)
+    (tmp_path / "Estabelecimentos0.zip.part.2").write_bytes(b"x" * 20_000)
+    dest = download_url(url, tmp_path / "Estabelecimentos0.zip", segments=4, max_retries=1)
+    assert dest.read_bytes() == DATA
+    assert "bytes=100000-149999" in _RangeHandler.ranges_seen
+
+
+def test_um_stream_remove_part_n_de_execucao_segmentada(url, tmp_path):
+    _layout(tmp_path, 4)
+    (tmp_path / "Estabelecimentos0.zip.part").write_bytes(DATA[:30_000])
+    (tmp_path / "Estabelecimentos0.zip.part.2").write_bytes(DATA[100_000:120_000])
+    dest = download_url(url, tmp_path / "Estabelecimentos0.zip", segments=1, max_retries=1)
+    assert dest.read_bytes() == DATA
+    assert _RangeHandler.ranges_seen == ["bytes=30000-"]  # o .part começa no byte 0: retoma
+    assert list(tmp_path.iterdir()) == [dest]
+
+
+def test_um_stream_com_tamanho_diferente_recomeca(url, tmp_path):
+    (tmp_path / "Estabelecimentos0.zip.part.meta").write_text(
+        json.dumps({"size": 999_999, "segments": 1, "step": None}))
+    (tmp_path / "Estabelecimentos0.zip.part").write_bytes(b"y" * 30_000)
+    dest = download_url(url, tmp_path / "Estabelecimentos0.zip", segments=1, max_retries=1)
+    assert dest.read_bytes() == DATA
+    assert _RangeHandler.ranges_seen == []
+
+
+def test_download_concurrently_preserva_ordem_e_janela():
+    running, peak, lock = [0], [0], threading.Lock()
+    release = threading.Event()
+
+    def one(fn):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        release.wait(1)
+        with lock:
+            running[0] -= 1
+        return fn
+
+    release.set()
+    assert list(download_concurrently(one, ["a", "b", "c", "d", "e"], 2)) == ["a", "b", "c", "d", "e"]
+    assert peak[0] <= 2
+
+
+def test_load_order_auxiliares_empresas_depois_demais():
+    files = ["Socios0.zip", "Estabelecimentos0.zip", "Empresas1.zip", "Cnaes.zip",
+             "Simples.zip", "Empresas0.zip", "Municipios.zip"]
+    assert sorted(files, key=load_order) == [
+        "Cnaes.zip", "Municipios.zip", "Empresas0.zip", "Empresas1.zip",
+        "Estabelecimentos0.zip", "Simples.zip", "Socios0.zip"]
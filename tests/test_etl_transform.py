@@ -0,0 +1,25 @@
+import pandas as pd
+
+from src.etl.transform import filter_valid_codes, format_rfb_dates
+
+
+def test_filter_valid_codes_troca_invalidos_e_vazios_por_vazio():
+    s = pd.Series(['01', '99', '', '02'])
+    assert filter_valid_codes(s, {'01', '02'}).tolist() == ['01', '', '', '02']
+
+
+def test_filter_valid_codes_sem_cache_zera_tudo():
+    # load_valid_codes devolve set() quando a tabela auxiliar falha
+    assert filter_valid_codes(pd.Series(['01', '']), set()).tolist() == ['', '']
+
+
+def test_format_rfb_dates_varias_colunas_de_uma_vez():
+    chunk = pd.DataFrame({
+        'a': ['20240131', '00000000', '', '20240131'],
+        'b': ['19991231', 'abc', '20240230', ''],
+        'x': ['1', '2', '3', '4'],
+    })
+    format_rfb_dates(chunk, ['a', 'b'])
+    assert chunk['a'].tolist() == ['2024-01-31', '', '', '2024-01-31']
+    assert chunk['b'].tolist() == ['1999-12-31', '', '', '']
+    assert chunk['x'].tolist() == ['1', '2', '3', '4']
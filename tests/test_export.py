@@ -0,0 +1,93 @@
+import json
+import threading
+from contextlib import contextmanager
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.export import encode_items, export_conditions, export_header, export_query, stream_export
+from src.api.search_filters import CNAE_ANY_CONDITION, CNAE_SECONDARY_CONDITION, SEARCH_COLUMNS, TEXT_SEARCH_CONDITION
+
+
+def _filters(**kwargs):
+    base = dict.fromkeys([
+        'razao_social', 'nome_fantasia', 'cnae', 'municipio', 'uf', 'situacao',
+        'data_inicio_atividade_min', 'data_inicio_atividade_max', 'q', 'cnae_secundario', 'cnae_qualquer',
+    ])
+    base.update(kwargs)
+    return base
+
+
+def _row(**values):
+    return tuple(values.get(c) for c in SEARCH_COLUMNS)
+
+
+@contextmanager
+def _rows(rows):
+    yield iter(rows)
+
+
+def test_export_usa_o_mesmo_construtor_do_search():
+    conditions, params = export_conditions(_filters(q="Padaria", cnae_secundario="6201501", cnae_qualquer="4721102"))
+    assert conditions == [TEXT_SEARCH_CONDITION, CNAE_SECONDARY_CONDITION, CNAE_ANY_CONDITION]
+    assert params == ["padaria", ['6201501'], ['4721102'], ['4721102']]
+    assert "ORDER BY" not in export_query(conditions)
+
+
+def test_export_sem_filtro_ou_filtro_invalido_e_400():
+    for filters in (_filters(), _filters(q="!!!"), _filters(cnae_qualquer="62%"),
+                    _filters(data_inicio_atividade_min="01/01/2020")):
+        with pytest.raises(HTTPException) as exc:
+            export_conditions(filters)
+        assert exc.value.status_code == 400
+
+
+def test_csv_com_cabecalho_vazio_para_none_e_aspas():
+    item = {'cnpj_completo': '12345678000199', 'razao_social': 'SILVA, SOUZA & CIA', 'nome_fantasia': None}
+    header = export_header('csv').decode()
+    line = encode_items([item], 'csv').decode()
+    assert header.startswith('cnpj_completo,identificador_matriz_filial,razao_social,')
+    assert line.startswith('12345678000199,,"SILVA, SOUZA & CIA",,')
+    assert line.endswith('\r\n')
+
+
+def test_ndjson_um_json_utf8_por_linha():
+    items = [{'razao_social': 'CONSTRUÇÃO LTDA'}, {'razao_social': 'PADARIA'}]
+    body = encode_items(items, 'ndjson')
+    assert export_header('ndjson') == b""
+    assert 'CONSTRUÇÃO'.encode('utf-8') in body
+    assert [json.loads(line) for line in body.decode().splitlines()] == items
+
+
+def test_stream_em_lotes_e_devolve_o_slot():
+    slots = threading.BoundedSemaphore(1)
+    rows = [_row(cnpj_completo=f'1234567800019{i}') for i in range(5)]
+    chunks = list(stream_export(lambda: _rows(rows), 'ndjson', slots=slots, itersize=2))
+    assert chunks[0] == b""
+    assert [c.count(b"\n") for c in chunks[1:]] == [2, 2, 1]
+    assert slots.acquire(blocking=False)
+
+
+def test_sem_slot_e_429_e_nao_vaza():
+    slots = threading.BoundedSemaphore(1)
+    held = stream_export(lambda: _rows([]), 'csv', slots=slots)
+    next(held)
+    with pytest.raises(HTTPException) as exc:
+        next(stream_export(lambda: _rows([]), 'csv', slots=slots))
+    assert exc.value.status_code == 429
+    # Cliente desconectou no meio: fechar o gerador devolve o slot
+    held.close()
+    assert slots.acquire(blocking=False)
+
+
+def test_erro_ao_abrir_as_linhas_devolve_o_slot():
+    slots = threading.BoundedSemaphore(1)
+
+    @contextmanager
+    def _broken():
+        raise RuntimeError("relation does not exist")
+        yield
+
+    with pytest.raises(RuntimeError):
+        next(stream_export(_broken, 'ndjson', slots=slots))
+    assert slots.acquire(blocking=False)
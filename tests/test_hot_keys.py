@@ -0,0 +1,46 @@
+import random
+
+from src.api.cache_redis import RedisCache
+from src.api.hot_keys import HotKeys, parse_search_member, search_member
+
+
+class _Recorder:
+    """Cache mínimo: guarda os ZINCRBY em vez de mandar ao Redis."""
+
+    def __init__(self):
+        self.calls = []
+
+    def zincr(self, key, member, amount=1, ttl_seconds=0):
+        self.calls.append((key, member))
+        return True
+
+    def ztrim(self, key, keep):
+        return 0
+
+
+def test_membro_de_busca_e_canonico_e_ignora_filtros_vazios():
+    a = search_member({'uf': 'SP', 'cnae': '6201501', 'razao_social': None}, 100)
+    b = search_member({'cnae': '6201501', 'uf': 'SP'}, 100)
+    assert a == b
+    assert parse_search_member(a) == ({'cnae': '6201501', 'uf': 'SP'}, 100)
+
+
+def test_registro_e_amostrado():
+    rec = _Recorder()
+    hot = HotKeys(cache=rec, sample_rate=0.25, rng=random.Random(1))
+    for _ in range(4000):
+        hot.record('cnpj', '00000000000191')
+    assert 800 < len(rec.calls) < 1200
+    assert rec.calls[0] == ('hot:cnpj', '00000000000191')
+
+
+def test_amostragem_zero_nao_registra():
+    rec = _Recorder()
+    HotKeys(cache=rec, sample_rate=0).record('cnpj', '1')
+    assert rec.calls == []
+
+
+def test_sem_redis_top_vazio_e_registro_nao_levanta():
+    hot = HotKeys(cache=RedisCache(host='127.0.0.1', port=1), sample_rate=1)
+    hot.record('search', search_member({'uf': 'SP'}, 10))
+    assert hot.top('search', 10) == []
@@ -0,0 +1,74 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.api.http_cache import cache_headers, etag_matches, matches_any, resource_etag
+
+
+def test_etag_depende_da_geracao_e_do_recurso():
+    a = resource_etag('/cnpj/00000000000191', generation='7')
+    assert a.startswith('W/"7-') and a.endswith('"')
+    assert resource_etag('/cnpj/00000000000191', generation='8') != a
+    assert resource_etag('/cnpj/11222333000181', generation='7') != a
+
+
+def test_ordem_dos_parametros_nao_muda_o_etag():
+    assert resource_etag('/cnaes', 'search=comercio&limit=10', generation='1') == \
+        resource_etag('/cnaes', 'limit=10&search=comercio', generation='1')
+    assert resource_etag('/cnaes', 'limit=10', generation='1') != \
+        resource_etag('/cnaes', 'limit=20', generation='1')
+
+
+def test_if_none_match():
+    etag = 'W/"7-abc"'
+    assert etag_matches('W/"7-abc"', etag)
+    assert etag_matches('"1-x", W/"7-abc"', etag)
+    assert etag_matches('"7-abc"', etag)  # comparação fraca
+    assert not etag_matches('"6-abc"', etag)
+    assert not etag_matches(None, etag)
+    # `*` depende de o recurso existir: decidido depois da rota
+    assert not etag_matches('*', etag)
+    assert matches_any('*') and matches_any('"1-x", *')
+    assert not matches_any('W/"7-abc"') and not matches_any(None)
+
+
+def test_sem_etag_nao_ha_cache_no_cliente():
+    assert cache_headers(None) == {}
+    assert set(cache_headers('W/"7-abc"')) == {'ETag', 'Cache-Control', 'Vary'}
+    assert cache_headers('W/"7-abc"')['Vary'] == 'Accept-Encoding'
+
+
+def _cnpj_client(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "postgresql://u@127.0.0.1:1/db")
+    from src.api import http_cache, routes
+
+    async def _authorize(x_api_key, cost=1, rate_bucket=None):
+        return {'id': 1, 'plan': 'free'}
+
+    async def _log_query(**kwargs):
+        return None
+
+    async def _load_cnpj(cleaned, raw):
+        return {'cnpj': cleaned}
+
+    monkeypatch.setattr(http_cache.shared_cache, "generation", lambda: '7')
+    monkeypatch.setattr(routes, "authorize_api_key", _authorize)
+    monkeypatch.setattr(routes, "log_query", _log_query)
+    monkeypatch.setattr(routes, "get_from_cache", lambda key: None)
+    monkeypatch.setattr(routes, "load_cnpj", _load_cnpj)
+    app = FastAPI()
+    app.include_router(routes.router)
+    return TestClient(app)
+
+
+def test_if_none_match_qualquer_com_cnpj_malformado_e_400(monkeypatch):
+    client = _cnpj_client(monkeypatch)
+    r = client.get('/cnpj/abc', headers={'X-API-Key': 'k', 'If-None-Match': '*'})
+    assert r.status_code == 400
+    assert r.json()['detail']['error'] == 'invalid_cnpj_format'
+
+
+def test_if_none_match_qualquer_com_cnpj_existente_e_304(monkeypatch):
+    client = _cnpj_client(monkeypatch)
+    r = client.get('/cnpj/00000000000191', headers={'X-API-Key': 'k', 'If-None-Match': '*'})
+    assert r.status_code == 304
+    assert r.headers['ETag'] == resource_etag('/cnpj/00000000000191', generation='7')
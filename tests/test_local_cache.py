@@ -0,0 +1,64 @@
+from src.api import local_cache as local_cache_module
+from src.api.local_cache import LocalCache
+
+
+def test_lru_despeja_o_menos_usado():
+    cache = LocalCache(max_entries=2, max_bytes=10**6)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" passa a ser o menos usado
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_limite_em_bytes():
+    cache = LocalCache(max_entries=100, max_bytes=4000)
+    for i in range(10):
+        cache.set(f"k{i}", "x" * 800)
+    assert cache.stats()['bytes'] <= 4000
+    assert cache.get("k9") is not None and cache.get("k0") is None
+
+
+def test_entrada_gigante_nao_entra():
+    cache = LocalCache(max_entries=100, max_bytes=4000)
+    cache.set("grande", "x" * 2000)
+    assert cache.get("grande") is None
+
+
+def test_ttl_com_teto(monkeypatch):
+    agora = [1000.0]
+    monkeypatch.setattr(local_cache_module.time, "time", lambda: agora[0])
+    cache = LocalCache(max_ttl=60)
+    cache.set("a", 1, ttl_seconds=3600)
+    agora[0] += 59
+    assert cache.get("a") == 1
+    agora[0] += 2
+    assert cache.get("a") is None
+
+
+def test_geracao_nova_descarta_tudo(monkeypatch):
+    agora = [1000.0]
+    monkeypatch.setattr(local_cache_module.time, "time", lambda: agora[0])
+    geracao = ["1"]
+    cache = LocalCache(generation_source=lambda: geracao[0])
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    geracao[0] = "2"
+    assert cache.get("a") == 1  # ainda dentro do intervalo de checagem
+    agora[0] += local_cache_module.GENERATION_CHECK_INTERVAL
+    assert cache.get("a") is None
+    assert cache.generation == "2"
+
+
+def test_delete_pattern_glob_e_contadores():
+    cache = LocalCache()
+    cache.set("search:1", 1)
+    cache.set("search:count:1", 2)
+    cache.set("cnpj:1", 3)
+    assert cache.delete_pattern("search:*") == 2
+    assert cache.get("cnpj:1") == 3
+    assert cache.get("search:1") is None
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['entries'] == 1
@@ -32,3 +32,21 @@ def test_planos_tem_limites_coerentes():
     rl = RateLimiter()
     assert rl.RATE_LIMITS['pro']['requests'] >= rl.RATE_LIMITS['free']['requests']
     assert rl.BURST_LIMITS['pro'] >= rl.BURST_LIMITS['free']
+
+
+def test_balde_autocomplete_em_memoria_e_separado_do_burst(monkeypatch):
+    import asyncio
+    from src.api import rate_limiter as rl_module
+    monkeypatch.setattr(rl_module.shared_cache, 'incr_rate', lambda key, window: -1)
+    monkeypatch.setitem(RateLimiter.BUCKET_LIMITS, 'autocomplete', {'free': 2})
+    rl = RateLimiter()
+    rl._check_rate_limit_memory(4, max_requests=100, window_seconds=3600, burst_limit=1)
+
+    async def run():
+        await rl.check_bucket_limit(4, 'autocomplete')
+        await rl.check_bucket_limit(4, 'autocomplete')
+        with pytest.raises(HTTPException) as exc:
+            await rl.check_bucket_limit(4, 'autocomplete')
+        assert exc.value.status_code == 429
+
+    asyncio.run(run())
@@ -0,0 +1,72 @@
+import asyncio
+
+from src.api.reference_registry import ReferenceRegistry
+
+TABLES = {
+    'cnaes': {'6201501': 'Desenvolvimento de programas de computador sob encomenda',
+              '4711302': 'Comércio varejista de mercadorias em geral - supermercados',
+              '0111301': 'Cultivo de arroz'},
+    'municipios': {'7107': 'SAO PAULO'},
+}
+
+
+def _registry(generation):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return TABLES
+
+    return ReferenceRegistry(loader=loader, generation_source=lambda: generation[0]), calls
+
+
+def test_carrega_uma_vez_e_resolve_descricoes():
+    generation = ['1']
+    reg, calls = _registry(generation)
+    assert asyncio.run(reg.ensure_fresh()) is True
+    assert asyncio.run(reg.ensure_fresh()) is True
+    assert len(calls) == 1
+    assert reg.describe('municipios', '7107') == 'SAO PAULO'
+    assert reg.descriptions('cnaes', ['6201501', '9999999']) == {
+        '6201501': 'Desenvolvimento de programas de computador sob encomenda'}
+    assert reg.version == '1'
+
+
+def test_nova_geracao_recarrega():
+    generation = ['1']
+    reg, calls = _registry(generation)
+    asyncio.run(reg.ensure_fresh())
+    generation[0] = '2'
+    reg._next_check = 0  # pula o intervalo de conferência
+    asyncio.run(reg.ensure_fresh())
+    assert len(calls) == 2
+    assert reg.version == '2'
+
+
+def test_cnaes_ordenados_e_busca_sem_diferenciar_maiusculas():
+    reg, _ = _registry(['1'])
+    asyncio.run(reg.ensure_fresh())
+    assert [c['codigo'] for c in reg.cnaes()] == ['0111301', '4711302', '6201501']
+    assert [c['codigo'] for c in reg.cnaes(search='COMÉRCIO')] == ['4711302']
+    assert len(reg.cnaes(limit=2)) == 2
+
+
+def test_falha_na_carga_sem_dados_retorna_false():
+    def loader():
+        raise RuntimeError("banco fora")
+
+    reg = ReferenceRegistry(loader=loader, generation_source=lambda: None)
+    assert asyncio.run(reg.ensure_fresh()) is False
+    assert reg.describe('cnaes', '6201501') is None
+
+
+def test_municipio_por_nome_resolve_homonimos_e_trecho():
+    from src.api.reference_registry import resolve_municipio_codigos
+    tables = dict(TABLES, municipios={
+        '7107': 'SAO PAULO', '1234': 'SÃO PAULO DO POTENGI', '5379': 'SAO JOSE', '8327': 'SAO JOSE'})
+    reg = ReferenceRegistry(loader=lambda: tables, generation_source=lambda: None)
+    assert asyncio.run(resolve_municipio_codigos('São Paulo', reg)) == ['7107']
+    assert asyncio.run(resolve_municipio_codigos('sao jose', reg)) == ['5379', '8327']
+    assert asyncio.run(resolve_municipio_codigos('potengi', reg)) == ['1234']
+    assert asyncio.run(resolve_municipio_codigos('atlantida', reg)) == []
+    assert asyncio.run(resolve_municipio_codigos('7107', reg)) is None
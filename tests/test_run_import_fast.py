@@ -0,0 +1,46 @@
+import zipfile
+
+import pytest
+
+import run_import_fast
+
+
+def _zip(path, *members):
+    with zipfile.ZipFile(path, "w") as z:
+        for m in members:
+            z.writestr(m, "x\n")
+    return path
+
+
+def test_load_stream_avisa_o_zip_so_quando_todos_os_membros_foram_commitados(tmp_path, monkeypatch):
+    committed, loaded = [], []
+
+    def fake_job(url, job, type_name, src, suffix):
+        committed.append(src[1])
+        return type_name, 1, 1, 0.0
+
+    monkeypatch.setattr(run_import_fast, "_run_job", fake_job)
+    core = _zip(tmp_path / "Empresas0.zip", "K3241.K03200Y0.D60613.EMPRECSV", "K3241.K03200Y1.D60613.EMPRECSV")
+    aux = _zip(tmp_path / "Cnaes.zip", "F.K03200$Z.D60613.CNAECSV")
+
+    def on_loaded(zp):
+        assert len(committed) == 2  # os dois membros antes de liberar o zip
+        loaded.append(zp)
+
+    totals = run_import_fast.load_stream("postgresql://", [aux, core], jobs=2, on_loaded=on_loaded)
+    assert totals == {"empresas": 2}
+    assert loaded == [core]  # auxiliar não é avisado (fica para o cleanup)
+
+
+def test_load_stream_nao_avisa_zip_com_membro_que_falhou(tmp_path, monkeypatch):
+    def fake_job(url, job, type_name, src, suffix):
+        if src[1].endswith("Y1.D60613.EMPRECSV"):
+            raise RuntimeError("COPY falhou")
+        return type_name, 1, 1, 0.0
+
+    monkeypatch.setattr(run_import_fast, "_run_job", fake_job)
+    core = _zip(tmp_path / "Empresas0.zip", "K3241.K03200Y0.D60613.EMPRECSV", "K3241.K03200Y1.D60613.EMPRECSV")
+    loaded = []
+    with pytest.raises(RuntimeError):
+        run_import_fast.load_stream("postgresql://", [core], jobs=1, on_loaded=loaded.append)
+    assert loaded == []
@@ -0,0 +1,116 @@
+import sqlite3
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.search_filters import (
+    CNAE_ANY_CONDITION, CNAE_SECONDARY_CONDITION, TEXT_SEARCH_CONDITION, build_search_conditions,
+    build_tsquery, check_rank_offset, normalize_text, parse_cnae_codes, ranked_page_query
+)
+from src.api.search_rollup import build_rollup_conditions
+
+
+def test_normalize_text_remove_acentos_e_maiusculas():
+    assert normalize_text("CONSTRUÇÃO Elétrica") == "construcao eletrica"
+
+
+def test_build_tsquery_exige_todos_os_termos_e_descarta_pontuacao():
+    assert build_tsquery("Construção  Civil!") == "construcao & civil"
+    assert build_tsquery("d'ávila & filhos | (sa)") == "d & avila & filhos & sa"
+
+
+def test_build_tsquery_prefixo_no_ultimo_termo():
+    assert build_tsquery("padaria sao jo", prefix_last=True) == "padaria & sao & jo:*"
+
+
+def test_build_tsquery_sem_termos_retorna_none():
+    assert build_tsquery("  ?!-- ") is None
+    assert build_tsquery(None) is None
+
+
+def test_q_vira_condicao_full_text():
+    conditions, params = build_search_conditions(q="Comércio", uf="sp")
+    assert conditions[0] == TEXT_SEARCH_CONDITION
+    assert params[0] == "comercio"
+
+
+def test_q_sem_palavras_e_400():
+    with pytest.raises(HTTPException) as exc:
+        build_search_conditions(q="!!!")
+    assert exc.value.status_code == 400
+
+
+def test_q_nao_e_respondivel_pelo_rollup():
+    assert build_rollup_conditions(uf='SP', q='comercio') is None
+
+
+def _ranked_db(rows):
+    """MV mínima em SQLite: nome_busca em texto; ts_rank = ocorrências do termo."""
+    db = sqlite3.connect(":memory:")
+    db.create_function("to_tsquery", 2, lambda _config, query: query)
+    db.create_function("ts_rank", 3, lambda doc, query, _norm: doc.split().count(query))
+    db.create_function("casa", 2, lambda doc, query: query in doc.split())
+    db.execute("CREATE TABLE vw_estabelecimentos_completos (cnpj_completo TEXT, nome_busca TEXT)")
+    db.executemany("INSERT INTO vw_estabelecimentos_completos VALUES (?, ?)", rows)
+    return db
+
+
+def _ranked_page(db, term, limit, offset):
+    sql = ranked_page_query("cnpj_completo", "casa(nome_busca, %s)").replace("%s", "?")
+    return [r[0] for r in db.execute(sql, [term, term, limit, offset])]
+
+
+def test_ranked_page_query_ordena_todas_as_linhas_por_relevancia():
+    # muitas linhas fracas com CNPJ baixo; a mais relevante tem o MAIOR CNPJ
+    rows = [(f"{i:014d}", "comercio de roupas") for i in range(1, 51)]
+    rows.append(("99999999000199", "comercio comercio comercio"))
+    rows.append(("00000000000000", "padaria"))
+    db = _ranked_db(rows)
+    assert _ranked_page(db, "comercio", 3, 0) == ["99999999000199", f"{1:014d}", f"{2:014d}"]
+    # empate de rank: páginas seguem o CNPJ, sem repetir nem pular
+    assert _ranked_page(db, "comercio", 3, 3) == [f"{i:014d}" for i in (3, 4, 5)]
+    assert "00000000000000" not in _ranked_page(db, "comercio", 100, 0)
+
+
+def test_offset_alem_da_profundidade_e_400():
+    check_rank_offset(499, max_depth=500)
+    with pytest.raises(HTTPException) as exc:
+        check_rank_offset(500, max_depth=500)
+    assert exc.value.status_code == 400
+
+
+def test_cnae_secundario_vira_pertinencia_no_array():
+    conditions, params = build_search_conditions(cnae_secundario="6202300, 6201501,6201501")
+    assert conditions == [CNAE_SECONDARY_CONDITION]
+    assert params == [['6201501', '6202300']]
+
+
+def test_cnae_qualquer_cobre_principal_ou_secundario():
+    conditions, params = build_search_conditions(cnae_qualquer="6201501")
+    assert conditions == [CNAE_ANY_CONDITION]
+    assert params == [['6201501'], ['6201501']]
+
+
+def test_cnae_secundario_nao_numerico_e_400():
+    with pytest.raises(HTTPException) as exc:
+        parse_cnae_codes("62015%", 'cnae_secundario')
+    assert exc.value.status_code == 400
+    with pytest.raises(HTTPException):
+        parse_cnae_codes(" , ", 'cnae_secundario')
+
+
+def test_cnae_secundario_nao_e_respondivel_pelo_rollup():
+    assert build_rollup_conditions(cnae_secundario='6201501') is None
+    assert build_rollup_conditions(cnae_qualquer='6201501') is None
+
+
+def test_municipio_por_nome_sem_codigos_cai_no_ilike():
+    conditions, params = build_search_conditions(municipio=" Campinas ")
+    assert conditions == ["municipio_desc ILIKE %s"]
+    assert params == ["%Campinas%"]
+
+
+def test_municipio_por_nome_resolvido_usa_o_codigo():
+    conditions, params = build_search_conditions(municipio="Campinas", municipio_codigos=['6291'])
+    assert conditions == ["municipio = %s"]
+    assert params == ['6291']
@@ -0,0 +1,89 @@
+from src.api.search_rollup import (
+    FACET_COLUMNS, ROLLUP_DIMENSIONS, ROLLUP_SETS, answerable_facets, build_rollup_conditions, grouping_id,
+    label_facets, rollup_group
+)
+
+
+def test_filtros_por_igualdade_viram_condicoes_do_rollup():
+    conditions, params = build_rollup_conditions(cnae='6201501', uf='sp', situacao='02')
+    assert conditions == ["cnae_fiscal_principal = %s", "uf = %s", "situacao_cadastral = %s"]
+    assert params == ['6201501', 'SP', '02']
+
+
+def test_municipio_por_codigo_filtra_a_coluna_de_codigo():
+    conditions, params = build_rollup_conditions(municipio=' 7107 ')
+    assert conditions == ["municipio = %s"]
+    assert params == ['7107']
+
+
+def test_municipio_por_nome_com_codigos_resolvidos():
+    conditions, params = build_rollup_conditions(municipio='sao jose', municipio_codigos=['5379', '8327'])
+    assert conditions == ["municipio = ANY(%s::text[])"]
+    assert params == [['5379', '8327']]
+
+
+def test_anos_inteiros_viram_faixa_de_ano_inicio():
+    conditions, params = build_rollup_conditions(
+        data_inicio_atividade_min='2020-01-01', data_inicio_atividade_max='2023-12-31')
+    assert conditions == ["ano_inicio >= %s", "ano_inicio <= %s"]
+    assert params == [2020, 2023]
+
+
+def test_sem_filtros_conta_tudo():
+    assert build_rollup_conditions() == ([], [])
+
+
+def test_filtros_nao_respondiveis_caem_para_estimativa():
+    assert build_rollup_conditions(razao_social='padaria', uf='SP') is None
+    assert build_rollup_conditions(nome_fantasia='x') is None
+    assert build_rollup_conditions(municipio='campinas') is None
+    assert build_rollup_conditions(data_inicio_atividade_min='2020-03-01') is None
+    assert build_rollup_conditions(data_inicio_atividade_max='2020-12-30') is None
+
+
+def test_filtros_de_porte_simples_mei_do_batch():
+    conditions, params = build_rollup_conditions(uf='RJ', porte='01', opcao_simples='s', opcao_mei='n')
+    assert conditions == ["uf = %s", "porte_empresa = %s", "opcao_simples = %s", "opcao_mei = %s"]
+    assert params == ['RJ', '01', 'S', 'N']
+
+
+def test_grouping_id_igual_ao_grouping_do_postgres():
+    # GROUPING(uf, municipio, cnae, situacao, porte, simples, mei, ano):
+    # (uf, situacao) deixa de fora todas as outras seis dimensões
+    assert grouping_id(('uf', 'situacao_cadastral')) == 0b01101111
+    assert grouping_id(ROLLUP_DIMENSIONS) == 0
+
+
+def test_escolhe_o_menor_agrupamento_que_cobre_os_filtros():
+    conditions, _ = build_rollup_conditions(uf='SP', situacao='02')
+    assert rollup_group(conditions) == grouping_id(ROLLUP_SETS[0])
+    conditions, _ = build_rollup_conditions(cnae='6201501', uf='SP')
+    assert rollup_group(conditions) == grouping_id(('uf', 'cnae_fiscal_principal', 'situacao_cadastral'))
+    conditions, _ = build_rollup_conditions(
+        uf='SP', data_inicio_atividade_min='2020-01-01', data_inicio_atividade_max='2020-12-31')
+    assert rollup_group(conditions) == grouping_id(('uf', 'situacao_cadastral', 'ano_inicio'))
+
+
+def test_combinacao_sem_agrupamento_cai_para_estimativa():
+    conditions, _ = build_rollup_conditions(cnae='6201501', municipio='7107')
+    assert rollup_group(conditions) is None
+
+
+def test_facetas_respondidas_dependem_dos_filtros():
+    conditions, _ = build_rollup_conditions(cnae='6201501')
+    assert answerable_facets(conditions, ['uf', 'situacao', 'municipio', 'porte']) == ['uf', 'situacao']
+
+
+def test_faceta_municipio_agrupa_pelo_codigo_e_ganha_label():
+    assert FACET_COLUMNS['municipio'] == 'municipio'
+    names = {'municipios': {'7107': 'SAO PAULO'}}
+    counts = {
+        'municipio': [{'value': '7107', 'count': 10}, {'value': '9999', 'count': 1}],
+        'uf': [{'value': 'SP', 'count': 11}],
+    }
+    label_facets(counts, lambda table, codigo: names.get(table, {}).get(codigo))
+    assert counts['municipio'] == [
+        {'value': '7107', 'count': 10, 'label': 'SAO PAULO'},
+        {'value': '9999', 'count': 1, 'label': None},
+    ]
+    assert 'label' not in counts['uf'][0]
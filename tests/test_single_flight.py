@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from src.api.cache_redis import RedisCache
+from src.api.single_flight import SingleFlight
+
+
+def _flight():
+    # Redis inexistente: só a coalescência dentro do worker
+    return SingleFlight(cache=RedisCache(host='127.0.0.1', port=1))
+
+
+def test_misses_simultaneos_carregam_uma_vez():
+    flight = _flight()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'uf': 'SP'}
+
+    async def main():
+        return await asyncio.gather(*[flight.load('search:x', loader, lambda k: None) for _ in range(10)])
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert results == [{'uf': 'SP'}] * 10
+    assert flight.stats()['coalesced_local'] == 9
+    assert flight.stats()['inflight'] == 0
+
+
+def test_erro_chega_a_todos_e_nao_fica_preso():
+    flight = _flight()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise LookupError('404')
+
+    async def main():
+        return await asyncio.gather(
+            *[flight.load('cnpj:1', loader, lambda k: None) for _ in range(3)], return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(isinstance(r, LookupError) for r in results)
+    # Próxima requisição carrega de novo
+    with pytest.raises(LookupError):
+        asyncio.run(flight.load('cnpj:1', loader, lambda k: None))
+    assert len(calls) == 2
+
+
+def test_cancelamento_de_quem_carrega_nao_derruba_quem_espera():
+    flight = _flight()
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def fast():
+        return 42
+
+    async def main():
+        leader = asyncio.create_task(flight.load('k', slow, lambda k: None))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.load('k', fast, lambda k: None))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == 42
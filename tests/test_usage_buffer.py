@@ -0,0 +1,69 @@
+import asyncio
+
+from src.api.cache_redis import RedisCache
+from src.api.usage_buffer import UsageBuffer
+
+
+def _buffer():
+    # Redis inexistente: exercita o fallback em memória do processo
+    return UsageBuffer(cache=RedisCache(host='127.0.0.1', port=1))
+
+
+def test_charge_sem_redis_devolve_none():
+    buf = _buffer()
+    assert buf.charge("h1", 1, "2025-01", 100, None) is None
+
+
+def test_record_local_agrega_ate_o_drain():
+    buf = _buffer()
+    buf.record_local("h1", 1)
+    buf.record_local("h1", 1)
+    buf.record_local("h2", 2, count_daily=False)
+    pending = buf.drain()
+    assert pending['keys'] == {"h1": 2, "h2": 1}
+    assert set(pending['lastused']) == {"h1", "h2"}
+    assert list(pending['daily'].values()) == [2]
+    assert next(iter(pending['daily']))[0] == 1
+    assert pending['quota'] == {}
+    # Drenado: nada pendente
+    assert buf.drain()['keys'] == {}
+
+
+def test_restore_devolve_pendentes_apos_falha():
+    buf = _buffer()
+    buf.record_local("h1", 1)
+    pending = buf.drain()
+    buf.record_local("h1", 1)
+    buf.restore(pending)
+    assert buf.drain()['keys'] == {"h1": 2}
+
+
+def test_record_local_lote_conta_consultas_no_uso_diario():
+    # /cnpj/bulk: 1 requisição (total_requests) e N consultas no uso diário
+    buf = _buffer()
+    buf.record_local("h1", 1, amount=250)
+    pending = buf.drain()
+    assert pending['keys'] == {"h1": 1}
+    assert list(pending['daily'].values()) == [250]
+
+
+def test_requisicao_gratuita_acima_do_teto_nao_e_recusada(monkeypatch):
+    # 304/autocomplete (amount=0) com o uso já acima do limite e Redis fora:
+    # não passa pela cota atômica do banco, só lê o uso atual
+    monkeypatch.setenv("DATABASE_URL", "postgresql://u@127.0.0.1:1/db")
+    from src.database.async_connection import async_db_manager
+
+    async def _used(user_id, month_year):
+        return 150
+
+    async def _charge(*args):
+        raise AssertionError("amount=0 não deve cobrar a cota")
+
+    monkeypatch.setattr(async_db_manager, "get_monthly_queries_used", _used)
+    monkeypatch.setattr(async_db_manager, "charge_monthly_quota", _charge)
+    buf = _buffer()
+    charged = asyncio.run(buf.charge_request("h1", 1, "2025-01", 100, amount=0))
+    assert charged == {'key_ok': True, 'queries_used': 150, 'current_used': 150}
+    pending = buf.drain()
+    assert pending['keys'] == {"h1": 1}
+    assert pending['daily'] == {}
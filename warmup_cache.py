@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Aquecimento pós-ETL: cache Redis + shared buffers do Postgres.
+
+Depois do swap mensal a MV vw_estabelecimentos_completos e seus índices são
+objetos novos (buffers frios) e o bump da geração deixou o Redis vazio: as
+primeiras horas de tráfego pagavam tudo isso em latência. Este script roda no
+fim do atualizar_mensal.py e:
+
+  1. pg_prewarm dos índices da MV (o de cnpj_completo primeiro), do índice do
+     autocomplete, do rollup de contagens e das tabelas de referência — limitado a uma fração do
+     shared_buffers e com no máximo --prewarm-jobs relações em paralelo
+  2. Recarrega no cache os CNPJs e as 1as páginas de busca mais pedidos
+     (amostrados em produção por src/api/hot_keys.py), com no máximo
+     --concurrency consultas simultâneas, pelo MESMO código das rotas
+     (load_cnpj / load_search_page) — as chaves batem com as da API
+  3. Reporta progresso, % já em cache e o hit ratio dos buffers durante a
+     recarga (pg_stat_database)
+
+Uso:
+  DATABASE_URL=... python warmup_cache.py
+  DATABASE_URL=... python warmup_cache.py --cnpjs 20000 --searches 1000 --concurrency 4
+  DATABASE_URL=... python warmup_cache.py --no-prewarm     # só o cache
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import psycopg2
+
+sys.path.append(str(Path(__file__).parent))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+log = logging.getLogger("warmup")
+
+MATVIEW = "vw_estabelecimentos_completos"
+ROLLUP = "search_facet_counts"
+AUTOCOMPLETE = "autocomplete_nomes"
+REFERENCE_TABLES = ["cnaes", "municipios"]
+# Fração do shared_buffers que o prewarm pode ocupar (o resto fica para o tráfego)
+PREWARM_BUFFER_FRACTION = float(os.getenv("PREWARM_BUFFER_FRACTION", "0.6"))
+
+# Índices de uma relação: o de cnpj_completo (lookup do /cnpj) primeiro, depois do menor ao maior
+INDEXES_SQL = """
+    SELECT c.oid::regclass::text, pg_relation_size(c.oid)
+    FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE i.indrelid = %s::regclass
+    ORDER BY (pg_get_indexdef(c.oid) LIKE '%%(cnpj_completo)%%') DESC, pg_relation_size(c.oid)
+"""
+
+
+def get_conn():
+    return psycopg2.connect(os.environ["DATABASE_URL"])
+
+
+def buffer_counters(conn) -> tuple:
+    """(blks_hit, blks_read) do banco. `conn` em autocommit: dentro de uma
+    transação o Postgres congela o snapshot das estatísticas na 1ª leitura
+    (stats_fetch_consistency) e antes/depois dariam o mesmo valor."""
+    cur = conn.cursor()
+    cur.execute("SELECT blks_hit, blks_read FROM pg_stat_database WHERE datname = current_database()")
+    row = cur.fetchone()
+    cur.close()
+    return row
+
+
+def hit_ratio(before: tuple, after: tuple) -> str:
+    hit, read = after[0] - before[0], after[1] - before[1]
+    return f"{hit / (hit + read) * 100:.1f}%" if hit + read else "n/d"
+
+
+def prewarm_plan(conn) -> list:
+    """[(relação, bytes)] em ordem de prioridade, cortado pelo orçamento de buffers."""
+    cur = conn.cursor()
+    cur.execute("SELECT pg_size_bytes(current_setting('shared_buffers'))")
+    budget = int(cur.fetchone()[0] * PREWARM_BUFFER_FRACTION)
+
+    relations = []
+    cur.execute(INDEXES_SQL, (MATVIEW,))
+    relations += cur.fetchall()
+    # autocomplete: só o índice de prefixos (a tabela é lida em faixas pequenas)
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (AUTOCOMPLETE,))
+    if cur.fetchone()[0]:
+        cur.execute(INDEXES_SQL, (AUTOCOMPLETE,))
+        relations += cur.fetchall()
+    for table in [ROLLUP] + REFERENCE_TABLES:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+        if not cur.fetchone()[0]:
+            continue
+        cur.execute("SELECT pg_relation_size(%s::regclass)", (table,))
+        relations.append((table, cur.fetchone()[0]))
+        cur.execute(INDEXES_SQL, (table,))
+        relations += cur.fetchall()
+
+    plan, used = [], 0
+    for name, size in relations:
+        if used + size > budget:
+            log.info("  ⏭️  %s (%.0f MB) não cabe no orçamento de buffers", name, size / 1e6)
+            continue
+        plan.append((name, size))
+        used += size
+    log.info("Prewarm: %d relações, %.0f MB de %.0f MB de orçamento (%.0f%% do shared_buffers)",
+             len(plan), used / 1e6, budget / 1e6, PREWARM_BUFFER_FRACTION * 100)
+    return plan
+
+
+def prewarm_one(name: str) -> int:
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_prewarm(%s::regclass)", (name,))
+        return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def prewarm(jobs: int):
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        try:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_prewarm")
+            conn.commit()
+        except psycopg2.Error as e:
+            log.warning("pg_prewarm indisponível (%s); pulando o prewarm", str(e).strip()[:80])
+            return
+        plan = prewarm_plan(conn)
+    finally:
+        conn.close()
+
+    t0 = time.time()
+    blocks = 0
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(prewarm_one, name): (name, size) for name, size in plan}
+        for done, fut in enumerate(as_completed(futures), 1):
+            name, size = futures[fut]
+            try:
+                blocks += fut.result()
+                log.info("  [%d/%d] %s (%.0f MB)", done, len(plan), name, size / 1e6)
+            except psycopg2.Error as e:
+                log.warning("  [%d/%d] %s falhou: %s", done, len(plan), name, str(e).strip()[:80])
+    log.info("🔥 Prewarm concluído: %d blocos em %.1fs", blocks, time.time() - t0)
+
+
+async def replay(cnpjs: list, searches: list, concurrency: int) -> dict:
+    from fastapi import HTTPException
+    from src.api.hot_keys import parse_search_member
+    from src.api.routes import (
+        get_from_cache, get_many_from_cache, load_cnpj, load_search_page, search_keys,
+    )
+    from src.database.async_connection import async_db_manager
+
+    async def warm_cnpj(cnpj):
+        if get_from_cache(f"cnpj:{cnpj}") is not None:
+            return 'hit'
+        await load_cnpj(cnpj)
+        return 'loaded'
+
+    async def warm_search(member):
+        filters, limit = parse_search_member(member)
+        keys = search_keys(filters, limit)
+        found = get_many_from_cache([keys.page_key, keys.count_key])
+        if keys.page_key in found:
+            return 'hit'
+        await load_search_page(filters, limit, keys, found.get(keys.count_key))
+        return 'loaded'
+
+    sem = asyncio.Semaphore(concurrency)
+    stats = {'cnpj': Counter(), 'search': Counter()}
+    total = len(cnpjs) + len(searches)
+    step = max(1, total // 10)
+    done = 0
+
+    async def one(kind, warm, item):
+        nonlocal done
+        async with sem:
+            try:
+                outcome = await warm(item)
+            except HTTPException as e:
+                outcome = 'not_found' if e.status_code == 404 else 'error'
+            except Exception as e:
+                log.debug("warm-up de %s %s falhou: %s", kind, item, e)
+                outcome = 'error'
+        stats[kind][outcome] += 1
+        done += 1
+        if done % step == 0 or done == total:
+            log.info("  recarga: %d/%d (%.0f%%)", done, total, done / total * 100)
+
+    try:
+        await asyncio.gather(
+            *(one('cnpj', warm_cnpj, c) for c in cnpjs),
+            *(one('search', warm_search, m) for m in searches),
+        )
+    finally:
+        await async_db_manager.close()
+    return stats
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--cnpjs", type=int, default=int(os.getenv("WARMUP_CNPJS", "10000")),
+                   help="CNPJs mais pedidos a recarregar")
+    p.add_argument("--searches", type=int, default=int(os.getenv("WARMUP_SEARCHES", "500")),
+                   help="1as páginas de busca mais pedidas a recarregar")
+    p.add_argument("--concurrency", type=int, default=int(os.getenv("WARMUP_CONCURRENCY", "4")),
+                   help="consultas simultâneas na recarga (<= DB_ASYNC_POOL_MAX)")
+    p.add_argument("--prewarm-jobs", type=int, default=2, help="relações aquecidas em paralelo")
+    p.add_argument("--no-prewarm", action="store_true", help="não roda o pg_prewarm")
+    args = p.parse_args()
+
+    from src.api.hot_keys import CNPJ, SEARCH, hot_keys
+
+    t0 = time.time()
+    if not args.no_prewarm:
+        prewarm(args.prewarm_jobs)
+
+    cnpjs = hot_keys.top(CNPJ, args.cnpjs)
+    searches = hot_keys.top(SEARCH, args.searches)
+    if not cnpjs and not searches:
+        log.info("Nenhum acesso amostrado (Redis fora ou HOT_KEYS_SAMPLE_RATE=0): nada a recarregar")
+        return
+    log.info("♨️  Recarregando %d CNPJs e %d buscas (%d simultâneas)...",
+             len(cnpjs), len(searches), args.concurrency)
+
+    conn = get_conn()
+    conn.autocommit = True  # cada leitura das estatísticas com snapshot novo
+    before = buffer_counters(conn)
+    t1 = time.time()
+    stats = asyncio.run(replay(cnpjs, searches, args.concurrency))
+    elapsed = time.time() - t1
+    after = buffer_counters(conn)
+    conn.close()
+
+    for kind, c in stats.items():
+        n = sum(c.values())
+        if not n:
+            continue
+        log.info("  %-6s %6d | já em cache %5.1f%% | carregados %d | 404 %d | erros %d",
+                 kind, n, c['hit'] / n * 100, c['loaded'], c['not_found'], c['error'])
+    log.info("  buffers do Postgres durante a recarga: hit ratio %s", hit_ratio(before, after))
+    log.info("✅ Warm-up concluído em %.1fs (recarga %.1fs, %.0f itens/s)",
+             time.time() - t0, elapsed, (len(cnpjs) + len(searches)) / elapsed if elapsed else 0)
+
+    # Cauda longa amostrada no mês não precisa ir para o próximo
+    hot_keys.trim(CNPJ)
+    hot_keys.trim(SEARCH)
+
+
+if __name__ == "__main__":
+    main()